@@ -134,6 +134,40 @@ class AvocadoTest(Test):
         self.__print_breaks("COMMAND IN MODULE <->")
         return self.backend.run(*args, **kwargs)
 
+    def run_many(self, *args, **kwargs):
+        """
+        Run list of independent commands inside module in one invocation (if backend allows it)
+
+        :param args: list of commands
+        :param kwargs: shell, ignore_status, verbose
+        :return: list of avocado.process.CmdResult objects
+        """
+        self.__print_breaks("COMMANDS IN MODULE <->")
+        return self.backend.run_many(*args, **kwargs)
+
+    def run_iter(self, *args, **kwargs):
+        """
+        Run command inside module and yield lines of its output as soon as they are printed
+
+        :param args: command
+        :param kwargs: spool_limit
+        :return: generator of tuples (stream name, line)
+        """
+        self.__print_breaks("COMMAND IN MODULE (STREAM) <->")
+        return self.backend.run_iter(*args, **kwargs)
+
+    def run_stream(self, *args, **kwargs):
+        """
+        Run command inside module, callback is called for every line of output.
+        Big output is spooled to disk instead of memory
+
+        :param args: command
+        :param kwargs: callback, spool_limit, ignore_status
+        :return: CmdStream object (stdout, stderr, exit_status, stdout_file, stderr_file)
+        """
+        self.__print_breaks("COMMAND IN MODULE (STREAM) <->")
+        return self.backend.run_stream(*args, **kwargs)
+
     def runCheckState(self, command="ls /", expected_state=0,
                       output_text=None, *args, **kwargs):
         """
@@ -38,6 +38,17 @@ class ContainerAvocadoTest(AvocadoTest):
             self.cancel("Docker specific test")
         super(ContainerAvocadoTest, self).setUp()
 
+    def start_prepared(self, *args, **kwargs):
+        """
+        Start the module prepared by expensive setup, setup is done just by first test,
+        other tests start from image committed after it. See ContainerHelper.start_prepared
+
+        :param args: commands, setup function and key of setup
+        :param kwargs: commands, setup function and key of setup
+        :return: bool - True in case container was started from prepared image
+        """
+        return self.backend.start_prepared(*args, **kwargs)
+
     def checkLabel(self, key, value):
         """
         check label of docker image, expect key value (could be read from config file)
@@ -26,59 +26,163 @@ Custom configuration and debugging library.
 
 from __future__ import print_function
 
-import netifaces
 import socket
 import os
 import urllib
-import yaml
 import subprocess
-import copy
 import sys
 import random
 import string
-import requests
 import warnings
-from avocado.utils import process
+import re
+import time
+import select
+import shlex
+import tempfile
+import json
+import functools
+import importlib
+import hashlib
+import marshal
 from moduleframework.mtfexceptions import ModuleFrameworkException, ConfigExc, CmdExc
+from moduleframework.host_facts import PACKAGER_COMMAND, get_host_facts, get_host_fact, cache_dir, open_private
+
+
+class LazyModule(object):
+    """
+    Module imported on first access to its attribute, so that import of moduleframework
+    (and start of mtf binaries) does not pay for modules what are not used.
+    """
+
+    def __init__(self, name):
+        self.__name = name
+        self.__module = None
+
+    def __getattr__(self, attr):
+        if self.__module is None:
+            self.__module = importlib.import_module(self.__name)
+        return getattr(self.__module, attr)
+
+
+class Lazy(object):
+    """
+    Value of LazyDict what is computed by function (without parameters) on first access.
+    It can be used also directly as value it represents (e.g. module attribute)
+    """
+
+    def __init__(self, function):
+        self.function = function
+        self.__value = None
+        self.__evaluated = False
+
+    def value(self):
+        if not self.__evaluated:
+            self.__value = self.function()
+            self.__evaluated = True
+        return self.__value
+
+    def __str__(self):
+        # ** unpacking of LazyDict does not call __getitem__, so that str.format gets Lazy object
+        return str(self.value())
+
+    def __format__(self, format_spec):
+        return format(self.value(), format_spec)
+
+    def __repr__(self):
+        return repr(self.value()) if self.__evaluated else "<not evaluated>"
+
+    def __getattr__(self, name):
+        if name.startswith("__") or name.startswith("_Lazy__"):
+            raise AttributeError(name)
+        return getattr(self.value(), name)
+
+    def __eq__(self, other):
+        return self.value() == other
+
+    def __ne__(self, other):
+        return self.value() != other
+
+    def __hash__(self):
+        return hash(self.value())
+
+    def __nonzero__(self):
+        return bool(self.value())
+
+    def __len__(self):
+        return len(self.value())
+
+    def __contains__(self, item):
+        return item in self.value()
+
+    def __add__(self, other):
+        return self.value() + other
+
+    def __radd__(self, other):
+        return other + self.value()
+
+    def __mod__(self, other):
+        return self.value() % other
+
+
+class LazyDict(dict):
+    """
+    Dictionary what evaluates Lazy values on first access to them
+    """
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if isinstance(value, Lazy):
+            value = value.value()
+            dict.__setitem__(self, key, value)
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+
+yaml = LazyModule("yaml")
+process = LazyModule("avocado.utils.process")
 
-defroutedev = netifaces.gateways().get('default').values(
-)[0][1] if netifaces.gateways().get('default') else "lo"
-hostipaddr = netifaces.ifaddresses(defroutedev)[2][0]['addr']
 hostname = socket.gethostname()
 dusername = "test"
 dpassword = "test"
 ddatabase = "basic"
-PACKAGER_COMMAND = "test -e /usr/bin/dnf && echo 'dnf -y'   ||" \
-                   "( test -e /usr/bin/microdnf && echo 'microdnf' ||" \
-                   "( test -e /usr/bin/yum && echo 'yum -y'        ||" \
-                   "echo 'apt-get -y' " \
-                   ") )"
-hostpackager = subprocess.check_output([PACKAGER_COMMAND], shell=True).strip()
-guestpackager = hostpackager
 ARCH = "x86_64"
 DOCKERFILE = "Dockerfile"
 HELP_MD_FILE = "help.md"
 DEFAULT_DIR_OF_DOCKER_RELATED_STUFF = os.path.abspath("../")
 
+# facts about host, they are probed when they are used first time
+defroutedev = Lazy(lambda: get_host_fact("defroutedev"))
+hostipaddr = Lazy(lambda: get_host_fact("hostipaddr"))
+hostpackager = Lazy(lambda: get_host_fact("packager"))
+guestpackager = hostpackager
+
 __persistent_config = None
+__persistent_config_key = None
+__module_sections = {}
+__module_types = {}
 
 # translation table for {VARIABLE} in the config.yaml file
-trans_dict = {"HOSTIPADDR": hostipaddr,
-              "GUESTIPADDR": hostipaddr,
-              "DEFROUTE": defroutedev,
-              "HOSTNAME": hostname,
-              "ROOT": "/",
-              "USER": dusername,
-              "PASSWORD": dpassword,
-              "DATABASENAME": ddatabase,
-              "HOSTPACKAGER": hostpackager,
-              "GUESTPACKAGER": guestpackager,
-              "GUESTARCH": ARCH,
-              "HOSTARCH": ARCH
-              }
+# facts about host are probed when they are used first time
+trans_dict = LazyDict({"HOSTIPADDR": Lazy(lambda: get_host_fact("hostipaddr")),
+                       "GUESTIPADDR": Lazy(lambda: get_host_fact("hostipaddr")),
+                       "DEFROUTE": Lazy(lambda: get_host_fact("defroutedev")),
+                       "HOSTNAME": hostname,
+                       "ROOT": "/",
+                       "USER": dusername,
+                       "PASSWORD": dpassword,
+                       "DATABASENAME": ddatabase,
+                       "HOSTPACKAGER": Lazy(lambda: get_host_fact("packager")),
+                       "GUESTPACKAGER": Lazy(lambda: get_host_fact("packager")),
+                       "GUESTARCH": ARCH,
+                       "HOSTARCH": ARCH,
+                       "JOBNAME": Lazy(lambda: get_job_name())
+                       })
 
 
 BASEPATHDIR = "/opt"
+CONFIG_CACHE = "/var/tmp/mtf_config_%s.cache"
 PDCURL = "https://pdc.fedoraproject.org/rest_api/v1/unreleasedvariants"
 REPOMD = "repodata/repomd.xml"
 MODULEFILE = 'tempmodule.yaml'
@@ -91,6 +195,10 @@ DEFAULTNSPAWNTIMEOUT = 10
 MODULE_DEFAULT_PROFILE = "default"
 TRUE_VALUES_DICT = ['yes', 'YES', 'yes', 'True', 'true', 'ok', 'OK']
 OPENSHIFT_INIT_WAIT = 50
+# maximal size of script created by run_many (single argument is limited to 128kB by kernel)
+BATCH_MAX_SIZE = 64 * 1024
+# size of output kept in memory by run_stream, bigger output is spooled to disk
+DEFAULT_SPOOL_LIMIT = 1024 * 1024
 
 def generate_unique_name(size=10):
     return ''.join(random.choice(string.ascii_lowercase) for _ in range(size))
@@ -227,6 +335,165 @@ def get_if_reuse():
     return bool(reuse)
 
 
+def get_nspawn_target():
+    """
+    Return the **MTF_NSPAWN_TARGET** envvar.
+
+    :return: str
+    """
+    return os.environ.get('MTF_NSPAWN_TARGET')
+
+
+def get_if_nspawn_exec_channel():
+    """
+    Return the **MTF_NSPAWN_EXEC_CHANNEL** envvar.
+
+    :return: bool
+    """
+    return bool(os.environ.get('MTF_NSPAWN_EXEC_CHANNEL'))
+
+
+def get_if_nspawn_session():
+    """
+    Return the **MTF_NSPAWN_SESSION** envvar.
+
+    :return: bool
+    """
+    return bool(os.environ.get('MTF_NSPAWN_SESSION'))
+
+
+def get_if_nspawn_async_teardown():
+    """
+    Return the **MTF_NSPAWN_ASYNC_TEARDOWN** envvar.
+
+    :return: bool
+    """
+    return bool(os.environ.get('MTF_NSPAWN_ASYNC_TEARDOWN'))
+
+
+def get_if_docker_api():
+    """
+    Return the **MTF_DOCKER_API** envvar.
+
+    :return: bool
+    """
+    return bool(os.environ.get('MTF_DOCKER_API'))
+
+
+def get_docker_pool_size():
+    """
+    Return the **MTF_DOCKER_POOL** envvar (number of pre-started containers), 0 means disabled.
+
+    :return: int
+    """
+    return int(os.environ.get('MTF_DOCKER_POOL') or 0)
+
+
+def get_docker_image_check():
+    """
+    Return the **MTF_DOCKER_IMAGE_CHECK** envvar.
+
+    :return: str
+    """
+    return os.environ.get('MTF_DOCKER_IMAGE_CHECK') or "registry"
+
+
+def get_job_id():
+    """
+    Return the **MTF_JOB_ID** envvar, identifier of ``mtf`` run, it is set by ``mtf`` when it is not given.
+
+    :return: str
+    """
+    return os.environ.get('MTF_JOB_ID') or "default"
+
+
+def get_worker_id():
+    """
+    Return the **MTF_WORKER_ID** envvar, identifier of worker running tests of one job in parallel.
+
+    :return: str
+    """
+    return os.environ.get('MTF_WORKER_ID') or ""
+
+
+def get_job_name(*parts):
+    """
+    Return name unique for job and worker, it is used for names of containers, images and networks,
+    so that concurrent jobs on one host do not use same names.
+
+    :param parts: strings appended to name, e.g. name of component
+    :return: str - lower case name valid for docker container, image repository and network
+    """
+    name = "-".join(["mtf", get_job_id(), get_worker_id()] + list(parts))
+    return re.sub("[^a-z0-9]+", "-", name.lower()).strip("-")
+
+
+def get_nspawn_snapshot_method():
+    """
+    Return the **MTF_NSPAWN_SNAPSHOT** envvar.
+
+    :return: str
+    """
+    return os.environ.get('MTF_NSPAWN_SNAPSHOT')
+
+
+def get_nspawn_cache_quota():
+    """
+    Return the **MTF_NSPAWN_CACHE_QUOTA** envvar (size in MB) or None.
+
+    :return: int
+    """
+    quota = os.environ.get('MTF_NSPAWN_CACHE_QUOTA')
+    return int(quota) if quota else None
+
+
+def get_nspawn_pkg_cache_quota():
+    """
+    Return the **MTF_NSPAWN_PKG_CACHE_QUOTA** envvar (size in MB) or None.
+
+    :return: int
+    """
+    quota = os.environ.get('MTF_NSPAWN_PKG_CACHE_QUOTA')
+    return int(quota) if quota else None
+
+
+def get_nspawn_pool_size():
+    """
+    Return the **MTF_NSPAWN_POOL** envvar (number of pre-booted machines), 0 means disabled.
+
+    :return: int
+    """
+    return int(os.environ.get('MTF_NSPAWN_POOL') or 0)
+
+
+def get_if_timing():
+    """
+    Return the **MTF_TIMING** envvar, timing is enabled by **MTF_TIMING_FILE** envvar as well.
+
+    :return: bool
+    """
+    return bool(os.environ.get('MTF_TIMING') or get_timing_file())
+
+
+def get_timing_file():
+    """
+    Return the **MTF_TIMING_FILE** envvar, file where timing spans of environment preparation are stored.
+
+    :return: str
+    """
+    return os.environ.get('MTF_TIMING_FILE')
+
+
+def get_nspawn_pool_max_idle():
+    """
+    Return the **MTF_NSPAWN_POOL_MAX_IDLE** envvar (seconds) or None.
+
+    :return: int
+    """
+    max_idle = os.environ.get('MTF_NSPAWN_POOL_MAX_IDLE')
+    return int(max_idle) if max_idle else None
+
+
 def get_if_remoterepos():
     """
     Return the **MTF_REMOTE_REPOS** envvar.
@@ -253,6 +520,7 @@ def get_odcs_auth():
     if odcstoken in TRUE_VALUES_DICT:
         # to not have hard dependency on openidc (use just when using ODCS without defined token)
         import openidc_client
+        import requests
         id_provider = 'https://id.fedoraproject.org/openidc/'
         # Get the auth token using the OpenID client.
         oidc = openidc_client.OpenIDCClient(
@@ -323,7 +591,8 @@ def translate_cmd(cmd, translation_dict=None):
     if not translation_dict:
         return cmd
     try:
-        formattedcommand = cmd.format(**translation_dict)
+        # vformat reads just used keys via item access, so that Lazy values are evaluated on demand
+        formattedcommand = string.Formatter().vformat(cmd, (), translation_dict)
     except KeyError:
         raise ModuleFrameworkException(
             "Command is formatted by using trans_dict. If you want to use "
@@ -333,6 +602,46 @@ def translate_cmd(cmd, translation_dict=None):
     return formattedcommand
 
 
+def batch_cmd(commands, token):
+    """
+    Create one bash script what runs all commands one by one, stdout and stderr of every command
+    are framed by lines with token and index of command, exit code is part of stdout frame.
+
+    :param commands: list of commands
+    :param token: unique string used in frames
+    :return: str
+    """
+    script = ""
+    for index, command in enumerate(commands):
+        script += "printf '{t}:{i}:begin\\n'; printf '{t}:{i}:begin\\n' >&2\n" \
+                  "( {comm}\n) </dev/null\n" \
+                  "printf '{t}:{i}:end:%d\\n' $?; printf '{t}:{i}:end\\n' >&2\n".format(
+                      t=token, i=index, comm=command)
+    return script
+
+
+def parse_batch_result(commands, token, cmdresult):
+    """
+    Split output of script created by batch_cmd to results of every command
+
+    :param commands: list of commands passed to batch_cmd
+    :param token: token passed to batch_cmd
+    :param cmdresult: avocado.process.CmdResult of whole script
+    :return: list of avocado.process.CmdResult
+    """
+    results = []
+    for index, command in enumerate(commands):
+        stdout = re.search("%s:%d:begin\n(.*?)%s:%d:end:(\\d+)\n" % (token, index, token, index),
+                           cmdresult.stdout, re.DOTALL)
+        stderr = re.search("%s:%d:begin\n(.*?)%s:%d:end\n" % (token, index, token, index),
+                           cmdresult.stderr, re.DOTALL)
+        if not stdout or not stderr:
+            raise CmdExc("Unable to parse output of batch for command: %s" % command, cmdresult)
+        results.append(process.CmdResult(command=command, stdout=stdout.group(1), stderr=stderr.group(1),
+                                         exit_status=int(stdout.group(2))))
+    return results
+
+
 def get_profile():
     """
     Return a profile name.
@@ -383,11 +692,168 @@ def get_modulemdurl():
     return mdf
 
 
+class TimingSpan(object):
+    """
+    Measure duration of one phase and append it as JSON line to file from **MTF_TIMING_FILE** envvar,
+    nothing is stored when envvar is not set. Use it as context manager::
+
+        with TimingSpan("image.install.packages", location=location):
+            install()
+    """
+
+    def __init__(self, phase, **attrs):
+        """
+
+        :param phase: str - name of phase, dots separate subphases
+        :param attrs: additional items stored with span
+        """
+        self.phase = phase
+        self.attrs = attrs
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        path = get_timing_file()
+        if path:
+            record = dict(self.attrs)
+            record.update({"phase": self.phase,
+                           "start": self.start,
+                           "duration": time.time() - self.start,
+                           "pid": os.getpid(),
+                           "status": "error" if exc_type else "ok"})
+            # one write of line with O_APPEND is not mixed with writes of parallel processes
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, json.dumps(record, sort_keys=True) + "\n")
+            finally:
+                os.close(fd)
+        return False
+
+
+def timed(phase):
+    """
+    Decorator of methods, every call is recorded as TimingSpan,
+    name and location of object are stored with span
+
+    :param phase: str - name of phase
+    :return: decorator
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            attrs = dict((key, getattr(self, key)) for key in ["name", "location"]
+                         if isinstance(getattr(self, key, None), basestring))
+            with TimingSpan(phase, **attrs):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def print_timing_summary(path):
+    """
+    Print count, total, mean and maximal duration of every phase stored in timing file
+
+    :param path: str - file with JSON lines created by TimingSpan
+    :return: None
+    """
+    phases = {}
+    try:
+        with open(path) as timingfile:
+            for line in timingfile:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                phases.setdefault(record["phase"], []).append(record["duration"])
+    except IOError:
+        return
+    if not phases:
+        return
+    print_info("TIMING SUMMARY (%s)" % path)
+    for phase in sorted(phases):
+        durations = phases[phase]
+        print_info("%-32s %4dx total %8.2fs mean %8.2fs max %8.2fs" %
+                   (phase, len(durations), sum(durations), sum(durations) / len(durations), max(durations)))
+
+
+class CmdStream(object):
+    """
+    Run command on host and read its output incrementally. Iteration yields tuples
+    (stream name, line) as soon as line is available. Whole output is stored in
+    spooled temporary files, they stay in memory up to spool_limit bytes, and they are
+    moved to disk when output is bigger.
+    """
+
+    def __init__(self, command, spool_limit=DEFAULT_SPOOL_LIMIT):
+        """
+
+        :param command: str - command to execute (it is not passed to shell)
+        :param spool_limit: int - bytes of output per stream kept in memory
+        """
+        self.command = command
+        self.spool_limit = spool_limit
+        self.stdout_file = tempfile.SpooledTemporaryFile(max_size=spool_limit)
+        self.stderr_file = tempfile.SpooledTemporaryFile(max_size=spool_limit)
+        self.exit_status = None
+        self.duration = 0
+
+    def __iter__(self):
+        start_time = time.time()
+        proc = subprocess.Popen(shlex.split(self.command), stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, close_fds=True)
+        streams = {proc.stdout.fileno(): ["stdout", self.stdout_file, ""],
+                   proc.stderr.fileno(): ["stderr", self.stderr_file, ""]}
+        try:
+            while streams:
+                for fd in select.select(list(streams), [], [])[0]:
+                    name, spool, partial = streams[fd]
+                    chunk = os.read(fd, 65536)
+                    if not chunk:
+                        del streams[fd]
+                        if partial:
+                            yield name, partial
+                        continue
+                    spool.write(chunk)
+                    lines = (partial + chunk).split("\n")
+                    # keep unfinished line, in case it is not too long
+                    streams[fd][2] = lines.pop()
+                    if len(streams[fd][2]) > self.spool_limit:
+                        lines.append(streams[fd][2])
+                        streams[fd][2] = ""
+                    for line in lines:
+                        yield name, line
+            self.exit_status = proc.wait()
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            self.duration = time.time() - start_time
+            self.stdout_file.seek(0)
+            self.stderr_file.seek(0)
+
+    @property
+    def stdout(self):
+        self.stdout_file.seek(0)
+        return self.stdout_file.read()
+
+    @property
+    def stderr(self):
+        self.stderr_file.seek(0)
+        return self.stderr_file.read()
+
+    def __repr__(self):
+        return "CmdStream(command=%r, exit_status=%r)" % (self.command, self.exit_status)
+
+
 class CommonFunctions(object):
     """
     Basic class to read configuration data and execute commands on a host machine.
     """
-    config = None
+    __config = None
+    __modifiable_config = None
     modulemdConf = None
     component_name = None
     source = None
@@ -396,7 +862,7 @@ class CommonFunctions(object):
     is_it_module = False
     packager = None
     # general use case is to have forwarded services to host (so thats why it is same)
-    _ip_address = trans_dict["HOSTIPADDR"]
+    _ip_address = None
     _dependency_list = None
 
     def __init__(self, *args, **kwargs):
@@ -410,24 +876,53 @@ class CommonFunctions(object):
 
         :return: None
         """
-        # we have to copy object. because there is just one global object, to improve performance
-        self.config = copy.deepcopy(get_config())
-        self.info = self.config.get("module", {}).get(get_module_type_base())
-        # if there is inheritance join both dictionary
-        self.info.update(self.config.get("module", {}).get(get_module_type()))
+        # config is shared by all instances, modifiable copy is created just when test asks for it (see config)
+        self.__config = get_config()
+        self.__modifiable_config = None
+        self.info = dict(get_module_section())
         if not self.info:
             raise ConfigExc("There is no section for (module: -> %s:) in the configuration file." %
                             get_module_type_base())
 
-        if self.config.get('modulemd-url') and get_if_module():
+        if self.__config.get('modulemd-url') and get_if_module():
             self.is_it_module = True
         else:
             pass
 
-        self.component_name = sanitize_text(self.config['name'])
-        self.source = self.config.get('source')
+        self.component_name = sanitize_text(self.__config['name'])
+        self.source = self.__config.get('source')
         self.set_url()
 
+    @property
+    def config(self):
+        """
+        Return modifiable copy of loaded config file, it is created on first use.
+        Changes of module section are used by instance (self.info)
+
+        :return: dict
+        """
+        if self.__modifiable_config is None and self.__config is not None:
+            config = thaw(self.__config)
+            modules = config.get("module", {})
+            info = modules.get(get_module_type_base())
+            # if there is inheritance join both dictionary
+            info.update(modules.get(get_module_type()) or {})
+            # values changed before copy was created are kept
+            section = get_module_section()
+            info.update((key, value) for key, value in self.info.items() if section.get(key) is not value)
+            self.__modifiable_config = config
+            self.info = info
+        return self.__modifiable_config
+
+    def __loaded_config(self):
+        """
+        Internal method
+        return modifiable copy of config in case test created it, shared config otherwise
+
+        :return: dict
+        """
+        return self.__config if self.__modifiable_config is None else self.__modifiable_config
+
     def set_url(self, url=None, force=False):
         """
         Set url via parameter or via URL envvar
@@ -466,7 +961,7 @@ class CommonFunctions(object):
         :return: str
         """
         if not self.sys_arch:
-            self.sys_arch = self.runHost(command='uname -m', verbose=False).stdout.strip()
+            self.sys_arch = get_host_fact("arch")
         return self.sys_arch
 
     def runHost(self, command="ls /", **kwargs):
@@ -486,7 +981,7 @@ class CommonFunctions(object):
 
         :return: list of test dependencies
         """
-        return self.config.get('testdependencies', {}).get('rpms', [])
+        return self.__loaded_config().get('testdependencies', {}).get('rpms', [])
 
     def installTestDependencies(self, packages=None):
         """
@@ -520,10 +1015,10 @@ class CommonFunctions(object):
         package_list = []
         mddata = self.getModulemdYamlconfig()
         if not profile:
-            if 'packages' in self.config:
-                packages_rpm = self.config.get('packages', {}).get('rpms', [])
+            if 'packages' in self.__loaded_config():
+                packages_rpm = self.__loaded_config().get('packages', {}).get('rpms', [])
                 packages_profiles = []
-                for profile_in_conf in self.config.get('packages', {}).get('profiles', []):
+                for profile_in_conf in self.__loaded_config().get('packages', {}).get('profiles', []):
                     packages_profiles += mddata['data']['profiles'][profile_in_conf]['rpms']
                 package_list += packages_rpm + packages_profiles
             if get_if_install_default_profile():
@@ -577,7 +1072,7 @@ class CommonFunctions(object):
             else:
                 modulemd = get_modulemdurl()
                 if not modulemd:
-                    modulemd = self.config.get("modulemd-url")
+                    modulemd = self.__loaded_config().get("modulemd-url")
         else:
             return link
         try:
@@ -612,7 +1107,7 @@ class CommonFunctions(object):
 
         :return: str
         """
-        return self._ip_address
+        return self._ip_address or trans_dict["HOSTIPADDR"]
 
     @ip_address.setter
     def ip_address(self, value):
@@ -647,6 +1142,107 @@ class CommonFunctions(object):
 
         return self.runHost('bash -c "%s"' % sanitize_cmd(command), **kwargs)
 
+    def _stream_cmd(self, command):
+        """
+        Internal method, return host command what runs command inside module,
+        it is used by run_iter and run_stream
+
+        :param command: str
+        :return: str
+        """
+        return 'bash -c "%s"' % sanitize_cmd(command)
+
+    def run_iter(self, command, spool_limit=DEFAULT_SPOOL_LIMIT):
+        """
+        Run command inside module and yield lines of output as soon as they are printed
+
+        :param command: str of command to execute
+        :param spool_limit: int - bytes of output kept in memory, rest is spooled to disk
+        :return: generator of tuples (stream name "stdout" or "stderr", line without newline)
+        """
+        return iter(CmdStream(translate_cmd(self._stream_cmd(command), translation_dict=trans_dict),
+                              spool_limit=spool_limit))
+
+    def run_stream(self, command, callback=None, spool_limit=DEFAULT_SPOOL_LIMIT, ignore_status=False):
+        """
+        Run command inside module, call callback for every line of output as soon as it is printed.
+        Output bigger than spool_limit is not kept in memory, but in temporary file
+        (result.stdout_file and result.stderr_file)
+
+        :param command: str of command to execute
+        :param callback: function called with (stream name, line)
+        :param spool_limit: int - bytes of output kept in memory, rest is spooled to disk
+        :param ignore_status: bool - do not raise exception in case of non zero exit code
+        :return: CmdStream
+        """
+        stream = CmdStream(translate_cmd(self._stream_cmd(command), translation_dict=trans_dict),
+                           spool_limit=spool_limit)
+        for name, line in stream:
+            if callback:
+                callback(name, line)
+        if stream.exit_status != 0 and not ignore_status:
+            raise process.CmdError(command, stream)
+        return stream
+
+    def run_many(self, commands, **kwargs):
+        """
+        Run list of independent commands inside module and return result for every command.
+        Generic version calls run for every command, helpers replace it by one invocation (_run_batch).
+
+        :param commands: list of commands
+        :param kwargs: dict from avocado.process.run, ignore_status is applied to every command
+        :return: list of avocado.process.CmdResult
+        """
+        ignore_status = kwargs.pop("ignore_status", False)
+        results = [self.run(command, ignore_status=True, **kwargs) for command in commands]
+        return self._check_batch_status(results, ignore_status)
+
+    def _check_batch_status(self, results, ignore_status=False):
+        """
+        Internal method, raise CmdError for first failed command unless ignore_status is set
+
+        :return: list of avocado.process.CmdResult
+        """
+        if not ignore_status:
+            for result in results:
+                if result.exit_status != 0:
+                    raise process.CmdError(result.command, result)
+        return results
+
+    def _run_batch(self, runner, commands, **kwargs):
+        """
+        Internal method, run all commands via one call of runner (method like run)
+
+        :param runner: function what runs bash command inside module
+        :param commands: list of commands
+        :param kwargs: dict from avocado.process.run
+        :return: list of avocado.process.CmdResult
+        """
+        if not commands:
+            return []
+        ignore_status = kwargs.pop("ignore_status", False)
+        # script contains $? what cannot be expanded by shell on host
+        kwargs.pop("shell", None)
+        token = "MTF_BATCH_%s" % generate_unique_name()
+        # script is passed as one argument, so that it is split to chunks under kernel limit
+        chunks = [[]]
+        chunksize = 0
+        for command in commands:
+            if chunks[-1] and chunksize + len(command) > BATCH_MAX_SIZE:
+                chunks.append([])
+                chunksize = 0
+            chunks[-1].append(command)
+            chunksize += len(command) + 3 * len(token)
+        results = []
+        for chunk in chunks:
+            start_time = time.time()
+            cmdresult = runner(batch_cmd(chunk, token), ignore_status=True, **kwargs)
+            chunkresults = parse_batch_result(chunk, token, cmdresult)
+            for result in chunkresults:
+                result.duration = (time.time() - start_time) / len(chunkresults)
+            results += chunkresults
+        return self._check_batch_status(results, ignore_status)
+
     def get_packager(self):
         if not self.packager:
             self.packager = self.run(PACKAGER_COMMAND, verbose=False).stdout.strip()
@@ -761,6 +1357,157 @@ class CommonFunctions(object):
         return self.run("bash " + dest + parameters, **kwargs)
 
 
+class FrozenDict(dict):
+    """
+    Read-only dictionary used for loaded config file, it is shared without copying.
+    copy.deepcopy returns mutable dict.
+    """
+    __slots__ = ()
+
+    def __readonly(self, *args, **kwargs):
+        raise TypeError("Config is read-only, use copy.deepcopy to get modifiable copy")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = __readonly
+
+    def __reduce__(self):
+        return self.__class__, (dict(self),)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+
+class FrozenList(list):
+    """
+    Read-only list used for loaded config file
+    """
+    __slots__ = ()
+
+    def __readonly(self, *args, **kwargs):
+        raise TypeError("Config is read-only, use copy.deepcopy to get modifiable copy")
+
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = __iadd__ = __imul__ = append = extend = \
+        insert = pop = remove = reverse = sort = __readonly
+
+    def __reduce__(self):
+        return self.__class__, (list(self),)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+
+class ModuleSection(FrozenDict):
+    """
+    Section of module type (module: -> type:) in config file, values of base module type (parent)
+    are included, values of module type have precedence.
+    """
+    __slots__ = ("name", "base")
+
+    def __init__(self, name, base, values):
+        super(ModuleSection, self).__init__(values)
+        self.name = name
+        self.base = base
+
+    def __reduce__(self):
+        return self.__class__, (self.name, self.base, dict(self))
+
+
+def freeze(value):
+    """
+    Return read-only copy of value, dicts and lists are converted recursively
+
+    :param value: object
+    :return: FrozenDict, FrozenList or value itself
+    """
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return FrozenList(freeze(item) for item in value)
+    return value
+
+
+def thaw(value):
+    """
+    Return modifiable copy of value, reverse of freeze
+
+    :param value: object
+    :return: dict, list or value itself
+    """
+    if isinstance(value, dict):
+        return dict((key, thaw(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return [thaw(item) for item in value]
+    return value
+
+
+def __config_key(cfgfile):
+    """
+    Return identifier of config file content, it changes when file is edited
+
+    :param cfgfile: str
+    :return: list - path, mtime and size
+    """
+    stat = os.stat(cfgfile)
+    return [os.path.abspath(cfgfile), stat.st_mtime, stat.st_size]
+
+
+def __parse_config_file(cfgfile):
+    """
+    Parse yaml config file. Parsed content is stored to cache file, what is valid until
+    config file is changed, so that every test process does not parse it again.
+
+    :param cfgfile: str
+    :return: dict
+    """
+    key = __config_key(cfgfile) + [sys.version]
+    cachefile = CONFIG_CACHE % hashlib.md5(key[0]).hexdigest()
+    try:
+        # do not trust cache file of other user
+        if os.stat(cachefile).st_uid == os.getuid():
+            with open(cachefile, 'rb') as cached:
+                content = marshal.load(cached)
+            if content.get("key") == key:
+                return content["config"]
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        pass
+    with open(cfgfile, 'r') as ymlfile:
+        xcfg = yaml.load(ymlfile.read())
+    try:
+        with open(cachefile + ".%d" % os.getpid(), 'wb') as cached:
+            marshal.dump({"key": key, "config": xcfg}, cached)
+        os.rename(cachefile + ".%d" % os.getpid(), cachefile)
+    except (IOError, OSError, ValueError):
+        # not writable or yaml types (dates) what are not supported by marshal, parse it next time
+        try:
+            os.remove(cachefile + ".%d" % os.getpid())
+        except OSError:
+            pass
+    return xcfg
+
+
+def get_config_path():
+    """
+    Return path of the module's configuration file, see get_config
+
+    :return: str
+    """
+    cfgfile = os.environ.get('CONFIG')
+    if cfgfile:
+        if os.path.exists(cfgfile):
+            print_debug("Config file defined via envvar: %s" % cfgfile)
+        else:
+            raise ConfigExc("File does not exist although defined CONFIG envvar: %s" % cfgfile)
+    else:
+        cfgfile = "./config.yaml"
+        if os.path.exists(cfgfile):
+            print_debug("Using module config file: %s" % cfgfile)
+        else:
+            cfgfile = "/usr/share/moduleframework/docs/example-config-minimal.yaml"
+            print_debug("Using default minimal config: %s" % cfgfile)
+            if not get_url():
+                raise ModuleFrameworkException("You have to use URL envvar for testing your images or repos")
+    return cfgfile
+
+
 def get_config():
     """
     Read the module's configuration file.
@@ -768,29 +1515,20 @@ def get_config():
     :default: ``./config.yaml`` in the ``tests`` directory of the module's root
      directory
     :envvar: **CONFIG=path/to/file** overrides default value.
-    :return: str
+    :return: FrozenDict (read-only), it is shared, use thaw to get modifiable copy
     """
-    global __persistent_config
-    if not __persistent_config:
-        cfgfile = os.environ.get('CONFIG')
-        if cfgfile:
-            if os.path.exists(cfgfile):
-                print_debug("Config file defined via envvar: %s" % cfgfile)
-            else:
-                raise ConfigExc("File does not exist although defined CONFIG envvar: %s" % cfgfile)
-        else:
-            cfgfile = "./config.yaml"
-            if os.path.exists(cfgfile):
-                print_debug("Using module config file: %s" % cfgfile)
-            else:
-                cfgfile = "/usr/share/moduleframework/docs/example-config-minimal.yaml"
-                print_debug("Using default minimal config: %s" % cfgfile)
-                if not get_url():
-                    raise ModuleFrameworkException("You have to use URL envvar for testing your images or repos")
-
+    global __persistent_config, __persistent_config_key
+    cfgfile = get_config_path()
+    try:
+        key = __config_key(cfgfile)
+    except OSError:
+        key = None
+    if not __persistent_config or key != __persistent_config_key:
+        # values resolved from previous content of config file
+        __module_sections.clear()
+        __module_types.clear()
         try:
-            with open(cfgfile, 'r') as ymlfile:
-                xcfg = yaml.load(ymlfile.read())
+            xcfg = __parse_config_file(cfgfile)
             doc_name = ['modularity-testing', 'meta-test-family', 'meta-test']
             if xcfg.get('document') not in doc_name:
                 raise ConfigExc("bad yaml file: item (%s)" %
@@ -802,10 +1540,11 @@ def get_config():
             # copy rpm section to nspawn, in case not defined explicitly
             # make it backward compatible
             if xcfg.get("module", {}).get("rpm") and not xcfg.get("module", {}).get("nspawn"):
-                xcfg["module"]["nspawn"] = copy.deepcopy(xcfg.get("module", {}).get("rpm"))
-            __persistent_config = xcfg
-            return xcfg
-        except IOError:
+                xcfg["module"]["nspawn"] = xcfg.get("module", {}).get("rpm")
+            __persistent_config = freeze(xcfg)
+            __persistent_config_key = key
+            return __persistent_config
+        except (IOError, OSError):
             raise ConfigExc(
                 "Error: File '%s' doesn't appear to exist or it's not a YAML file. "
                 "Tip: If the CONFIG envvar is not set, mtf-generator looks for './config'."
@@ -814,6 +1553,33 @@ def get_config():
         return __persistent_config
 
 
+def get_module_section(module_type=None):
+    """
+    Return section of module type from config file, values of parent backend are included.
+    It is resolved once and shared.
+
+    :param module_type: str - module type, default is actually used one (see get_module_type)
+    :return: ModuleSection (read-only)
+    """
+    module_type = module_type or get_module_type()
+    if module_type not in __module_sections:
+        modules = get_config().get("module", {})
+        parent = module_type
+        if module_type not in get_backend_list():
+            parent = modules.get(module_type, {}).get("parent")
+            if not parent:
+                raise ModuleFrameworkException(
+                    "Module (%s) does not provide parent backend parameter (there are: %s)" %
+                    (module_type, get_backend_list()))
+        if parent not in get_backend_list():
+            raise ModuleFrameworkException("As parent is allowed just base type: %s" % get_backend_list())
+        values = dict(modules.get(parent) or {})
+        # if there is inheritance join both dictionary
+        values.update(modules.get(module_type) or {})
+        __module_sections[module_type] = ModuleSection(module_type, parent, values)
+    return __module_sections[module_type]
+
+
 def list_modules_from_config():
     """
     Get all possible modules based on config file
@@ -841,15 +1607,18 @@ def get_module_type():
     :return: str
     """
     amodule = os.environ.get('MODULE')
+    # cache of module types is cleared when config file changes
     readconfig = get_config()
-    if "default_module" in readconfig and readconfig[
-        "default_module"] is not None and amodule is None:
-        amodule = readconfig["default_module"]
-    if amodule in list_modules_from_config():
-        return amodule
-    else:
-        raise ModuleFrameworkException("Unsupported MODULE={0}".format(amodule),
-                                       "supported are: %s" % list_modules_from_config())
+    if amodule not in __module_types:
+        module_type = amodule
+        if "default_module" in readconfig and readconfig[
+            "default_module"] is not None and amodule is None:
+            module_type = readconfig["default_module"]
+        if module_type not in list_modules_from_config():
+            raise ModuleFrameworkException("Unsupported MODULE={0}".format(module_type),
+                                           "supported are: %s" % list_modules_from_config())
+        __module_types[amodule] = module_type
+    return __module_types[amodule]
 
 
 def get_module_type_base():
@@ -858,16 +1627,7 @@ def get_module_type_base():
 
     :return: str
     """
-    module_type = get_module_type()
-    parent = module_type
-    if module_type not in get_backend_list():
-        parent = get_config().get("module", {}).get(module_type, {}).get("parent")
-        if not parent:
-            raise ModuleFrameworkException("Module (%s) does not provide parent backend parameter (there are: %s)" %
-                                           (module_type, get_backend_list()))
-    if parent not in get_backend_list():
-        raise ModuleFrameworkException("As parent is allowed just base type: %s" % get_backend_list)
-    return parent
+    return get_module_section().base
 
 
 def get_docker_file(dir_name=DEFAULT_DIR_OF_DOCKER_RELATED_STUFF):
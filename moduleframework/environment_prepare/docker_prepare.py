@@ -26,7 +26,7 @@ module for environment setup and cleanup, to be able to split action for ansible
 """
 
 from avocado.utils import service
-from moduleframework.common import print_info, CommonFunctions
+from moduleframework.common import print_info, CommonFunctions, get_job_name
 import os
 
 
@@ -39,6 +39,10 @@ class EnvDocker(CommonFunctions):
         self.__start_service()
 
     def cleanup_env(self):
+        from mtf.backend.docker_api import drain_container_pools, drain_prepared_images
+        # just objects of this job, parallel jobs can use the same docker daemon
+        drain_container_pools(job_name=get_job_name())
+        drain_prepared_images(job_name=get_job_name())
         self.__stop_service()
 
     def add_insecure_registry(self, registry):
@@ -27,6 +27,7 @@ module for environment setup and cleanup, to be able to split action for ansible
 
 import os
 from moduleframework.common import CommonFunctions, print_info, is_not_silent
+from mtf.backend.nspawn import drain_pools, drain_sessions, Reaper
 
 selinux_state_file="/var/tmp/mtf_selinux_state"
 setseto = "Permissive"
@@ -41,6 +42,9 @@ class EnvNspawn(CommonFunctions):
         self.__install_machined()
 
     def cleanup_env(self):
+        drain_pools()
+        drain_sessions()
+        Reaper().drain()
         self.__cleanup()
 
     def __prepare_selinux(self):
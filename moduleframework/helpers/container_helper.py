@@ -21,9 +21,15 @@
 #
 
 import json
+import shlex
+import re
+import hashlib
 from moduleframework.common import *
 from moduleframework.mtfexceptions import ContainerExc
 
+# containers started by run command with these options can not run in more instances (pool)
+NOT_POOLABLE_OPTIONS = re.compile(r"(^|\s)(-p|--publish|-P|--publish-all|--name)(\s|=|$)")
+
 
 class ContainerHelper(CommonFunctions):
     """
@@ -37,17 +43,22 @@ class ContainerHelper(CommonFunctions):
         set basic object variables
         """
         super(ContainerHelper, self).__init__()
-        static_name = "testcontainer"
         self.tarbased = None
         self.name = None
         self.docker_id = None
+        self.__api = None
+        self.__state = None
+        self.__pool = None
+        self.__reusable = False
+        self.__image_id = None
+        self.__run_image = None
         self._icontainer = self.get_url()
         if not self._icontainer:
             raise ConfigExc("No container image specified in the configuration file or environment variable.")
         if ".tar" in self._icontainer:
-            self.name = static_name
+            # name of imported image is derived from tarball in setUp
             self.tarbased = True
-        if "docker=" in self._icontainer:
+        elif "docker=" in self._icontainer:
             self.name = self._icontainer[7:]
             self.tarbased = False
         else:
@@ -56,7 +67,8 @@ class ContainerHelper(CommonFunctions):
             self.name = self._icontainer
         self.docker_static_name = ""
         if get_if_reuse():
-            self.docker_static_name = "--name %s" % static_name
+            # reused container is shared by tests of job (worker), not by parallel jobs
+            self.docker_static_name = "--name %s" % get_job_name(self.component_name or "")
 
     def getURL(self):
         """
@@ -100,9 +112,22 @@ class ContainerHelper(CommonFunctions):
         :return: None
         """
         self._icontainer = self.get_url()
+        if get_if_docker_api():
+            from mtf.backend.docker_api import get_docker_api
+            self.__api = get_docker_api()
+            if not self.__api:
+                print_info("Docker API is not available, docker CLI is used")
         self._callSetupFromConfig()
-        self.__pullContainer()
-        self.containerInfo = self.__load_inspect_json()
+        if "docker=" in self._icontainer:
+            # local image, it is not pulled
+            self.containerInfo = self.__load_inspect_json()
+        else:
+            cache = self.__image_cache()
+            if self.tarbased:
+                self.name = cache.tarball_reference(self._icontainer)
+            inspect = cache.get_image(self.name, tarball=self._icontainer if self.tarbased else None)
+            self.__image_id = inspect["Id"]
+            self.containerInfo = inspect["Config"]
 
     def tearDown(self):
         """
@@ -110,25 +135,31 @@ class ContainerHelper(CommonFunctions):
 
         :return: None
         """
-        super(ContainerHelper, self).tearDown()
-        if get_if_do_cleanup():
-            print_info("To run a command inside a container execute: ",
-                        "docker exec %s /bin/bash" % self.docker_id)
-
-    def __pullContainer(self):
+        try:
+            super(ContainerHelper, self).tearDown()
+            if get_if_do_cleanup():
+                print_info("To run a command inside a container execute: ",
+                            "docker exec %s /bin/bash" % self.docker_id)
+        finally:
+            # thread following events of container is stopped also when container is kept or stop failed
+            if self.__state:
+                self.__state.close()
+                self.__state = None
+
+    def __image_cache(self):
         """
-        Internal method, do not use it anyhow
+        Internal method
+        cache of pulled and imported images shared by tests
 
-        :return: None
+        :return: ImageDigestCache
         """
-        if self.tarbased:
-            self.runHost(
-                "docker import %s %s" %
-                (self._icontainer, self.name), verbose=is_not_silent())
-        elif "docker=" in self._icontainer:
-            pass
-        else:
-            self.runHost("docker pull %s" % self.name, verbose=is_not_silent())
+        from mtf.backend.docker_api import ImageDigestCache, docker_cli_inspect_image, docker_cli_pull, \
+            docker_cli_import
+        if self.__api:
+            return ImageDigestCache(inspect=self.__api.find_image, pull=self.__api.pull,
+                                    import_image=self.__api.import_image, check=get_docker_image_check())
+        return ImageDigestCache(inspect=docker_cli_inspect_image, pull=docker_cli_pull,
+                                import_image=docker_cli_import, check=get_docker_image_check())
 
     def __load_inspect_json(self):
         """
@@ -136,10 +167,15 @@ class ContainerHelper(CommonFunctions):
 
         :return: dict
         """
-        return json.loads(
-            self.runHost(
-                "docker inspect %s" %
-                self.name, verbose=is_not_silent()).stdout)[0]["Config"]
+        if self.__api:
+            inspect = self.__api.inspect_image(self.name)
+        else:
+            inspect = json.loads(
+                self.runHost(
+                    "docker inspect %s" %
+                    self.name, verbose=is_not_silent()).stdout)[0]
+        self.__image_id = inspect["Id"]
+        return inspect["Config"]
 
     def start(self, args="-it -d", command="/bin/bash"):
         """
@@ -150,17 +186,13 @@ class ContainerHelper(CommonFunctions):
         :return: None
         """
         if not self.status():
-            if self.info.get('start'):
-                self.docker_id = self.runHost(
-                    "%s -d %s %s" %
-                    (self.info['start'], self.docker_static_name, self.name), shell=True, ignore_bg_processes=True,
-                    verbose=is_not_silent()).stdout
+            runspec = self.info.get('start') or "docker run %s" % args
+            if get_docker_pool_size() and not get_if_reuse() and not NOT_POOLABLE_OPTIONS.search(runspec):
+                self.__pool = self.__container_pool(runspec, args, command)
+                self.__reusable = False
+                self.docker_id = self.__pool.claim()
             else:
-                self.docker_id = self.runHost(
-                    "docker run %s %s %s %s" %
-                    (args, self.docker_static_name, self.name, command),
-                    shell=True, ignore_bg_processes=True, verbose=is_not_silent()).stdout
-            self.docker_id = self.docker_id.strip()
+                self.docker_id = self.__run_container(args, command)
             # It installs packages in container is removed by default, in future maybe reconciled.
             # self.install_packages()
         if self.status() is False:
@@ -169,19 +201,126 @@ class ContainerHelper(CommonFunctions):
                     self.name, self.moduleName, self.docker_id))
             trans_dict["GUESTPACKAGER"] = self.get_packager()
 
+    def __run_container(self, args, command):
+        """
+        Internal method
+        run new container
+
+        :return: str - ID of container
+        """
+        from mtf.backend.docker_api import JOB_LABEL
+        image = self.__run_image or self.name
+        # containers of job are found by label, e.g. when job ends
+        label = "--label %s=%s" % (JOB_LABEL, get_job_id())
+        if self.__api and not self.info.get('start') and args == "-it -d":
+            return self.__api.run(
+                image, command=shlex.split(translate_cmd(command, translation_dict=trans_dict)),
+                name=self.docker_static_name.split()[-1] if self.docker_static_name else None,
+                labels={JOB_LABEL: get_job_id()})
+        elif self.info.get('start'):
+            docker_id = self.runHost(
+                "%s -d %s %s %s" %
+                (self.info['start'], label, self.docker_static_name, image), shell=True, ignore_bg_processes=True,
+                verbose=is_not_silent()).stdout
+        else:
+            docker_id = self.runHost(
+                "docker run %s %s %s %s %s" %
+                (args, label, self.docker_static_name, image, command),
+                shell=True, ignore_bg_processes=True, verbose=is_not_silent()).stdout
+        return docker_id.strip()
+
+    def __container_pool(self, runspec, args, command):
+        """
+        Internal method
+        pool of containers started by same run command, it is shared by tests
+
+        :return: ContainerPool
+        """
+        from mtf.backend.docker_api import ContainerPool, docker_cli_is_running, docker_cli_remove, \
+            DOCKER_POOL_BASEDIR
+        # image ID is part of pool key, so that containers of previous version of image (same name) are not used
+        return ContainerPool(image=self.__run_image or self.name, size=get_docker_pool_size(),
+                             runspec=" ".join([self.__image_id or "", runspec, command]),
+                             run=lambda: self.__run_container(args, command),
+                             is_running=self.__api.is_running if self.__api else docker_cli_is_running,
+                             remove=self.__api.remove if self.__api else docker_cli_remove,
+                             basedir=os.path.join(DOCKER_POOL_BASEDIR, get_job_name()))
+
+    def start_prepared(self, commands=None, setup=None, key="", args="-it -d", command="/bin/bash"):
+        """
+        Start container prepared by commands (and setup function) what are run inside it.
+        Container prepared by first test is committed to image (docker commit), later tests start
+        container from this image, so that preparation is skipped. Image is identified by hash of base image,
+        run command and preparation, it is removed at the end of job. Content of volumes and running processes
+        are not part of image, use it for installed packages, seeded files, etc.
+
+        :param commands: list of commands to run inside container
+        :param setup: function() - called after commands, it can use self.run, self.copyTo, etc.
+        :param key: str - identifies setup function, change it when setup function changes
+        :param args: Do not use it directly (It is defined in config.yaml)
+        :param command: Do not use it directly (It is defined in config.yaml)
+        :return: bool - True in case container was started from prepared image
+        """
+        from mtf.backend.docker_api import PreparedImages, docker_cli_inspect_image, docker_cli_commit, \
+            DOCKER_PREPARED_BASEDIR
+        # images are prepared per job, so that end of other job does not remove them
+        prepared = PreparedImages(inspect=self.__api.find_image if self.__api else docker_cli_inspect_image,
+                                  commit=self.__api.commit if self.__api else docker_cli_commit,
+                                  basedir=os.path.join(DOCKER_PREPARED_BASEDIR, get_job_name()),
+                                  repository=get_job_name("prepared"))
+        digest = hashlib.sha256(json.dumps([self.__image_id or self.name, self.info.get('start') or args,
+                                            command, commands or [], key])).hexdigest()
+        # lock is held just by test what prepares image, other tests wait for it
+        with prepared.lock(digest):
+            self.__run_image = prepared.find(digest)
+            if not self.__run_image:
+                self.start(args=args, command=command)
+                for preparation in commands or []:
+                    self.run(preparation)
+                if setup:
+                    setup()
+                print_info("Prepared container is committed to image:", prepared.commit(self.docker_id, digest))
+                return False
+        print_info("Container is started from prepared image:", self.__run_image)
+        self.start(args=args, command=command)
+        return True
+
+    def mark_reusable(self, reusable=True):
+        """
+        Mark container from pool (MTF_DOCKER_POOL) as reusable, it is returned to pool after test
+        instead of removal. Use it just in case test did not change container.
+
+        :param reusable: bool - False marks container as dirty again (default)
+        :return: None
+        """
+        self.__reusable = reusable
+
     def stop(self):
         """
         Stop the docker container
 
         :return: None
         """
-        if self.status():
+        if self.__pool:
+            # container is removed in background, so that test does not wait for docker stop
+            self.__pool.release(self.docker_id, reusable=self.__reusable)
+            self.__pool.wait_fill()
+            self.__pool = None
+            self.docker_id = None
+        elif self.status():
             try:
-                self.runHost("docker stop %s" % self.docker_id, verbose=is_not_silent())
-                self.runHost("docker rm %s" % self.docker_id, verbose=is_not_silent())
+                if self.__api:
+                    self.__api.stop(self.docker_id)
+                    self.__api.remove(self.docker_id)
+                else:
+                    self.runHost("docker stop %s" % self.docker_id, verbose=is_not_silent())
+                    self.runHost("docker rm %s" % self.docker_id, verbose=is_not_silent())
             except Exception as e:
                 print_debug(e, "docker already removed")
                 pass
+        if self.__state:
+            self.__state.close()
+            self.__state = None
 
     def status(self, command=None):
         """
@@ -189,20 +328,37 @@ class ContainerHelper(CommonFunctions):
 
         :return: bool
         """
-        if not self.docker_id and get_if_reuse():
-            result = self.runHost("docker ps -q --filter %s" % self.docker_static_name[2:],
+        if self.__api:
+            if not self.docker_id and get_if_reuse():
+                self.docker_id = self.__api.find_running(self.docker_static_name.split()[-1])
+        elif not self.docker_id and get_if_reuse():
+            result = self.runHost("docker ps -q --filter name=^/%s$" % self.docker_static_name.split()[-1],
                                   ignore_status=True,
                                   verbose=is_debug())
             # lenght of docker id  number is 12
             if result.exit_status == 0 and len(result.stdout) > 10:
                 self.docker_id = result.stdout.strip()
                 return True
-        if self.docker_id and self.docker_id[
-                              : 12] in self.runHost(
-            "docker ps", shell=True, verbose=is_not_silent()).stdout:
-            return True
-        else:
+        if not self.docker_id:
             return False
+        return self.__container_state().is_running()
+
+    def __container_state(self):
+        """
+        Internal method
+        state of actual container, it is followed via docker events, so that status does not call docker
+
+        :return: ContainerState
+        """
+        if not self.__state or self.__state.container_id != self.docker_id:
+            from mtf.backend.docker_api import ContainerState, docker_cli_is_running, docker_cli_events
+            if self.__state:
+                self.__state.close()
+            if self.__api:
+                self.__state = ContainerState(self.docker_id, self.__api.is_running, self.__api.events)
+            else:
+                self.__state = ContainerState(self.docker_id, docker_cli_is_running, docker_cli_events)
+        return self.__state
 
     def run(self, command="ls /", **kwargs):
         """
@@ -212,10 +368,51 @@ class ContainerHelper(CommonFunctions):
         :param kwargs: dict
         :return: avocado.process.run
         """
-        return self.runHost(
-            'docker exec %s bash -c "%s"' %
-            (self.docker_id, sanitize_cmd(command)),
-            **kwargs)
+        try:
+            if self.__api:
+                result = self.__api.execute(self.docker_id, translate_cmd(command, translation_dict=trans_dict),
+                                            **kwargs)
+            else:
+                result = self.runHost(
+                    'docker exec %s bash -c "%s"' %
+                    (self.docker_id, sanitize_cmd(command)),
+                    **kwargs)
+        except (process.CmdError, ContainerExc):
+            self.__refresh_state()
+            raise
+        if result.exit_status != 0:
+            self.__refresh_state()
+        return result
+
+    def __refresh_state(self):
+        """
+        Internal method
+        inspect container after failed command, it can be caused by stopped container
+        and cached state does not have to know about it yet
+
+        :return: None
+        """
+        if self.__state:
+            self.__state.refresh()
+
+    def _stream_cmd(self, command):
+        """
+        Internal method, docker exec command used by run_iter and run_stream
+
+        :param command: str
+        :return: str
+        """
+        return 'docker exec %s bash -c "%s"' % (self.docker_id, sanitize_cmd(command))
+
+    def run_many(self, commands, **kwargs):
+        """
+        Run list of independent commands inside module via one docker exec
+
+        :param commands: list of commands
+        :param kwargs: dict from avocado.process.run
+        :return: list of avocado.process.CmdResult
+        """
+        return self._run_batch(self.run, commands, **kwargs)
 
     def copyTo(self, src, dest):
         """
@@ -226,6 +423,9 @@ class ContainerHelper(CommonFunctions):
         :return: None
         """
         self.start()
+        if self.__api:
+            self.__api.copy_to(self.docker_id, src, dest)
+            return
         self.runHost("docker cp %s %s:%s" % (src, self.docker_id, dest), verbose=is_not_silent())
 
     def copyFrom(self, src, dest):
@@ -237,5 +437,8 @@ class ContainerHelper(CommonFunctions):
         :return: None
         """
         self.start()
+        if self.__api:
+            self.__api.copy_from(self.docker_id, src, dest)
+            return
         self.runHost("docker cp %s:%s %s" % (self.docker_id, src, dest), verbose=is_not_silent())
 
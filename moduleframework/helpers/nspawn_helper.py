@@ -21,13 +21,15 @@
 #
 
 import time
-import hashlib
 import os
 
 from moduleframework.common import BASEPATHDIR, translate_cmd, \
-    get_if_reuse, trans_dict, print_info, is_debug, get_if_do_cleanup
+    get_if_reuse, trans_dict, print_info, is_debug, get_if_do_cleanup, get_nspawn_target, \
+    get_if_nspawn_exec_channel, get_nspawn_cache_quota, get_nspawn_pool_size, get_nspawn_pool_max_idle, \
+    get_nspawn_pkg_cache_quota, get_if_nspawn_async_teardown, get_if_nspawn_session
 from moduleframework.helpers.rpm_helper import RpmHelper
-from mtf.backend.nspawn import Image, Container
+from mtf.backend.nspawn import ImageCache, PackageCache, Container, MachinePool, MachineSession, Reaper, \
+    DEFAULT_BOOT_TARGET
 
 
 class NspawnHelper(RpmHelper):
@@ -54,6 +56,9 @@ class NspawnHelper(RpmHelper):
         else:
             self.name = self.component_name
         self.chrootpath = os.path.abspath(self.baseprefix + self.name)
+        self.__pool = None
+        self.__session = None
+        self.__imagecache = None
 
     def setUp(self):
         """
@@ -65,26 +70,98 @@ class NspawnHelper(RpmHelper):
         :return: None
         """
 
-        trans_dict["ROOT"] = self.chrootpath
-        print_info("name of CHROOT directory:", self.chrootpath)
         self.setRepositoriesAndWhatToInstall()
         # never move this line to __init__ this localtion can change before setUp (set repositories)
-        self.chrootpath_baseimage = os.path.abspath(self.baseprefix +
-                                                    self.component_name +
-                                                    "_image_" +
-                                                    hashlib.md5(" ".join(self.repos)).hexdigest())
-        self.__image_base = Image(location=self.chrootpath_baseimage,
-                                  packageset=self.whattoinstallrpm,
-                                  repos=self.repos,
-                                  ignore_installed=True)
-        self.__image = self.__image_base.create_snapshot(self.chrootpath)
-        self.__container = Container(image=self.__image, name=self.name)
-        self._callSetupFromConfig()
-        self.__container.boot_machine()
+        self.__imagecache = ImageCache(basedir=BASEPATHDIR,
+                                       prefix="chroot_%s_image_" % self.component_name,
+                                       quota=get_nspawn_cache_quota(),
+                                       package_cache=PackageCache(basedir=os.path.join(BASEPATHDIR,
+                                                                                       "nspawn_pkgcache"),
+                                                                  quota=get_nspawn_pkg_cache_quota()))
+        # base image is locked as used until tearDown, so that parallel jobs do not evict it
+        self.__image_base = self.__imagecache.get_image(packageset=self.whattoinstallrpm,
+                                                        repos=self.repos)
+        self.chrootpath_baseimage = self.__image_base.get_location()
+        if get_nspawn_pool_size() and not get_if_reuse():
+            # machine is already booted, so that setup from config is called after boot
+            self.__pool = MachinePool(image=self.__image_base,
+                                      size=get_nspawn_pool_size(),
+                                      max_idle=get_nspawn_pool_max_idle(),
+                                      boot_target=get_nspawn_target() or DEFAULT_BOOT_TARGET)
+            self.__container = self.__pool.claim(exec_channel=get_if_nspawn_exec_channel())
+            self.name = self.__container.name
+            self.chrootpath = self.__container.location
+            trans_dict["ROOT"] = self.chrootpath
+            print_info("name of CHROOT directory:", self.chrootpath)
+            self._callSetupFromConfig()
+        elif get_if_nspawn_session() and not get_if_reuse() and self.__acquire_session():
+            print_info("name of CHROOT directory:", self.chrootpath)
+        else:
+            trans_dict["ROOT"] = self.chrootpath
+            print_info("name of CHROOT directory:", self.chrootpath)
+            self.__image = self.__image_base.create_snapshot(self.chrootpath)
+            self.__container = Container(image=self.__image, name=self.name,
+                                         exec_channel=get_if_nspawn_exec_channel())
+            self._callSetupFromConfig()
+            self.__container.boot_machine(boot_target=get_nspawn_target() or DEFAULT_BOOT_TARGET)
+
+    def __acquire_session(self):
+        """
+        Internal method
+        take machine shared by tests of job, setup from config is called just for first test,
+        other tests get machine rolled back to state after setup
+
+        :return: bool - False in case session is used by other (parallel) test
+        """
+        session = MachineSession(image=self.__image_base, key=self.component_name)
+        trans_dict["ROOT"] = session.location
+        self.__container = session.acquire(setup=self.__session_callback(self._callSetupFromConfig),
+                                           start=self.__session_callback(self.start),
+                                           boot_target=get_nspawn_target() or DEFAULT_BOOT_TARGET,
+                                           exec_channel=get_if_nspawn_exec_channel())
+        if not self.__container:
+            print_info("nspawn session %s is used by other test, using own machine" % session.name)
+            return False
+        self.__session = session
+        self.name = self.__container.name
+        self.chrootpath = self.__container.location
+        return True
+
+    def __session_callback(self, method):
+        """
+        Internal method
+        return function called by MachineSession with its machine, it calls method of helper
+
+        :param method: method of helper without arguments
+        :return: function
+        """
+        def callback(container):
+            self.__container = container
+            method()
+        return callback
 
     def run(self, command, **kwargs):
         return self.__container.execute(command=translate_cmd(command, translation_dict=trans_dict), **kwargs)
 
+    def _stream_cmd(self, command):
+        """
+        Internal method, nsenter command used by run_iter and run_stream
+
+        :param command: str
+        :return: str
+        """
+        return self.__container.stream_cmd(command)
+
+    def run_many(self, commands, **kwargs):
+        """
+        Run list of independent commands inside NSPAWN container via one execute call
+
+        :param commands: list of commands
+        :param kwargs: dict from avocado.process.run
+        :return: list of avocado.process.CmdResult
+        """
+        return self._run_batch(self.run, commands, **kwargs)
+
     def start(self, command="/bin/true"):
         """
         Start 'service' inside NSPAWN container
@@ -111,7 +188,7 @@ class NspawnHelper(RpmHelper):
         """
         Copy file to module from host
 
-        :param src: source file on host
+        :param src: source file on host or list of files (dest is directory then)
         :param dest: destination file on module
         :return: None
         """
@@ -121,7 +198,7 @@ class NspawnHelper(RpmHelper):
         """
         Copy file from module to host
 
-        :param src: source file on module
+        :param src: source file on module or list of files (dest is directory then)
         :param dest: destination file on host
         :return: None
         """
@@ -133,16 +210,29 @@ class NspawnHelper(RpmHelper):
 
         :return: None
         """
-        if get_if_do_cleanup() and not get_if_reuse():
-            try:
-                self.__container.stop()
-            except:
-                pass
-            try:
-                self.__container.rm()
-            except:
-                pass
-        else:
-            print_info("tearDown skipped", "running nspawn: %s" % self.name)
-            print_info("To connect to a machine use:",
-                       "machinectl shell root@%s /bin/bash" % self.name)
+        try:
+            if self.__session:
+                # changes done by test are removed and machine is booted for next test in background
+                self.__session.release(self.__container, boot_target=get_nspawn_target() or DEFAULT_BOOT_TARGET)
+            elif get_if_do_cleanup() and not get_if_reuse():
+                if get_if_nspawn_async_teardown():
+                    # machine is stopped and removed in background, job end waits for it
+                    Reaper().submit(self.__container)
+                else:
+                    try:
+                        self.__container.stop()
+                    except:
+                        pass
+                    try:
+                        self.__container.rm()
+                    except:
+                        pass
+                if self.__pool:
+                    self.__pool.wait_fill()
+            else:
+                print_info("tearDown skipped", "running nspawn: %s" % self.name)
+                print_info("To connect to a machine use:",
+                           "machinectl shell root@%s /bin/bash" % self.name)
+        finally:
+            if self.__imagecache:
+                self.__imagecache.release(self.__image_base)
@@ -22,7 +22,6 @@
 
 import json
 import os
-import time
 from moduleframework import common
 from moduleframework.helpers.container_helper import ContainerHelper
 from moduleframework.mtfexceptions import ConfigExc
@@ -145,7 +144,6 @@ class OpenShiftHelper(ContainerHelper):
         oc_new_app = self.runHost("oc new-app -l mtf_testing=true %s --name=%s" % (self.container_name,
                                                                                    self.app_name),
                                   ignore_status=True)
-        time.sleep(1)
 
     def _get_pod_status(self):
         """
@@ -169,18 +167,25 @@ class OpenShiftHelper(ContainerHelper):
 
     def _verify_pod(self):
         """
-        It verifies if an application POD is initiated and ready for testing
-        :return: False, application is not initiated during 10 seconds
+        It verifies if an application POD is initiated and ready for testing.
+        PODs of application are watched, so that it returns as soon as POD is ready.
+        :return: False, application is not ready during OPENSHIFT_INIT_WAIT seconds
                  True, application is initiated and ready for testing
+        :raises ContainerExc: POD failed, e.g. image can not be pulled (ImagePullBackOff)
         """
-        pod_initiated = False
-        for x in range(0, common.OPENSHIFT_INIT_WAIT):
-            # We need wait a second before pod is really initiated.
-            time.sleep(1)
-            if self._get_pod_status():
-                pod_initiated = True
-                break
-        return pod_initiated
+        from mtf.backend.openshift_api import get_openshift_api, oc_watch_pods, wait_for_pod
+        api = get_openshift_api()
+        label_selector = "app=%s" % self.app_name
+        if api:
+            events = api.watch_pods(label_selector, timeout=common.OPENSHIFT_INIT_WAIT)
+        else:
+            events = oc_watch_pods(label_selector)
+        pod = wait_for_pod(events, timeout=common.OPENSHIFT_INIT_WAIT)
+        if not pod:
+            return False
+        self.pod_id = pod.get('metadata').get('name')
+        self._pod_status = pod.get('status').get('phase')
+        return True
 
     def setUp(self):
         """
@@ -315,3 +320,24 @@ class OpenShiftHelper(ContainerHelper):
         :return: avocado.process.run
         """
         return self.runHost('oc exec %s %s' % (self.pod_id, common.sanitize_cmd(command)))
+
+    def _stream_cmd(self, command):
+        """
+        Internal method, oc exec command used by run_iter and run_stream
+
+        :param command: str
+        :return: str
+        """
+        return 'oc exec %s -- bash -c "%s"' % (self.pod_id, common.sanitize_cmd(command))
+
+    def run_many(self, commands, **kwargs):
+        """
+        Run list of independent commands inside OpenShift POD via one oc exec
+
+        :param commands: list of commands
+        :param kwargs: dict from avocado.process.run
+        :return: list of avocado.process.CmdResult
+        """
+        def oc_exec_bash(command, **kwargs):
+            return self.runHost('oc exec %s -- bash -c "%s"' % (self.pod_id, common.sanitize_cmd(command)), **kwargs)
+        return self._run_batch(oc_exec_bash, commands, **kwargs)
@@ -20,9 +20,17 @@
 # Authors: Petr Hracek <phracek@redhat.com>
 #
 
+import hashlib
+import json
 from moduleframework import pdc_data
 from moduleframework.common import *
 
+# fingerprint of last successful installation of packages per config file, repositories and packages
+INSTALL_STATE_FILE = "rpm_state_%s.json"
+# directory of state files, default is cache_dir()
+INSTALL_STATE_DIR = None
+RPMDB_DIRS = ["/var/lib/rpm", "/usr/lib/sysimage/rpm"]
+
 
 class RpmHelper(CommonFunctions):
     """
@@ -127,21 +135,92 @@ class RpmHelper(CommonFunctions):
         :return: None
         """
         counter = 0
-        f = open(self.yumrepo, 'w')
+        content = ""
         for repo in self.repos:
             counter = counter + 1
-            add = """[%s%d]
+            content += """[%s%d]
 name=%s%d
 baseurl=%s
 enabled=1
 gpgcheck=0
 
 """ % (self.component_name, counter, self.component_name, counter, repo)
-            f.write(add)
-        f.close()
-        self.install_packages()
+        if not os.path.exists(self.yumrepo) or open(self.yumrepo).read() != content:
+            with open(self.yumrepo, 'w') as f:
+                f.write(content)
+        self.__install_if_changed()
         self.ip_address = trans_dict["GUESTIPADDR"]
 
+    def __install_fingerprint(self, packages):
+        """
+        Internal method
+        return identifier of repositories, packages and state of rpm database (mtime of its files)
+
+        :param packages: list of packages
+        :return: str
+        """
+        rpmdb_mtime = 0
+        for rpmdb in RPMDB_DIRS:
+            if os.path.isdir(rpmdb):
+                for filename in os.listdir(rpmdb):
+                    rpmdb_mtime = max(rpmdb_mtime, os.path.getmtime(os.path.join(rpmdb, filename)))
+        content = {"repos": sorted(self.repos),
+                   "packages": sorted(packages),
+                   "rpmdb": rpmdb_mtime}
+        return hashlib.sha256(json.dumps(content, sort_keys=True)).hexdigest()
+
+    def __install_state_path(self, packages):
+        """
+        Internal method
+        return path of state file of installation, it is specific for config file, repositories and packages
+
+        :param packages: list of packages
+        :return: str
+        """
+        content = [os.path.abspath(get_config_path()), sorted(self.repos), sorted(packages)]
+        return os.path.join(INSTALL_STATE_DIR or cache_dir(),
+                            INSTALL_STATE_FILE % hashlib.sha256(json.dumps(content)).hexdigest()[:16])
+
+    def __install_if_changed(self):
+        """
+        Internal method
+        install packages just in case repositories, packages or rpm database changed since last
+        successful installation and some of packages is not installed
+
+        :return: None
+        """
+        packages = self.getPackageList()
+        try:
+            statepath = self.__install_state_path(packages)
+            with open_private(statepath) as statefile:
+                state = json.load(statefile)
+        except (IOError, OSError, ValueError):
+            state = {}
+        if state.get("fingerprint") == self.__install_fingerprint(packages):
+            print_info("Packages already installed (no change of repositories, packages and rpmdb)")
+            return
+        if packages and self.runHost("rpm -q --whatprovides %s" % " ".join(packages), ignore_status=True,
+                                     verbose=is_not_silent()).exit_status == 0:
+            print_info("Packages already installed", packages)
+        else:
+            self.install_packages()
+        try:
+            with open_private(self.__install_state_path(packages), "w") as statefile:
+                json.dump({"fingerprint": self.__install_fingerprint(packages)}, statefile)
+        except (IOError, OSError):
+            # cache directory is not private, packages are checked by every test
+            pass
+
+    def run_many(self, commands, **kwargs):
+        """
+        Run list of independent commands via one bash invocation
+
+        :param commands: list of commands
+        :param kwargs: dict from avocado.process.run
+        :return: list of avocado.process.CmdResult
+        """
+        return self._run_batch(self.run, commands, **kwargs)
+
     def copyTo(self, src, dest):
         """
         Copy file from one location (host) to another one to (module)
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+#
+# Meta test family (MTF) is a tool to test components of a modular Fedora:
+# https://docs.pagure.org/modularity/
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# he Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Authors: Jan Scotka <jscotka@redhat.com>
+#
+
+"""
+Facts about host (systemd features, packager, architecture, default route).
+They are probed once and stored in cache file in private directory, which is valid until reboot,
+change of probed binaries or change of routing table.
+"""
+
+import os
+import stat
+import json
+import errno
+import hashlib
+import subprocess
+
+# directory of files cached by MTF for root, other users use ~/.cache/mtf
+MTF_CACHE_DIR = "/var/cache/mtf"
+# path of cache file, default is host_facts.json in cache_dir()
+HOST_FACTS_CACHE = None
+BOOT_ID = "/proc/sys/kernel/random/boot_id"
+ROUTE_TABLE = "/proc/net/route"
+PROBED_BINARIES = ["systemctl", "systemd-run", "systemd-nspawn", "dnf", "microdnf", "yum", "apt-get"]
+PACKAGER_COMMAND = "test -e /usr/bin/dnf && echo 'dnf -y'   ||" \
+                   "( test -e /usr/bin/microdnf && echo 'microdnf' ||" \
+                   "( test -e /usr/bin/yum && echo 'yum -y'        ||" \
+                   "echo 'apt-get -y' " \
+                   ") )"
+
+__host_facts = None
+
+
+def private_dir(path):
+    """
+    Create directory accessible just by current user. Existing directory is accepted just when
+    it is owned by current user and others can not access it, so that files in it can be trusted.
+
+    :param path: str
+    :return: str - path
+    :raises OSError: directory is not private
+    """
+    try:
+        os.makedirs(path, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise OSError(errno.EPERM, "Directory is not private (owned by current user, mode 0700)", path)
+    return path
+
+
+def cache_base():
+    """
+    Return path of directory for files cached by MTF, it is not created
+
+    :return: str
+    """
+    return MTF_CACHE_DIR if os.getuid() == 0 else os.path.join(os.path.expanduser("~"), ".cache", "mtf")
+
+
+def cache_dir(*parts):
+    """
+    Return private directory for files cached by MTF, it is created when it does not exist
+
+    :param parts: subdirectories
+    :return: str
+    :raises OSError: directory is not private
+    """
+    path = private_dir(cache_base())
+    for part in parts:
+        path = private_dir(os.path.join(path, part))
+    return path
+
+
+def open_private(path, mode="r"):
+    """
+    Open file in private directory, symlinks are not followed and file created by other user is refused
+
+    :param path: str
+    :param mode: str - "r" or "w"
+    :return: file object
+    :raises OSError, IOError:
+    """
+    flags = os.O_NOFOLLOW | (os.O_WRONLY | os.O_CREAT | os.O_TRUNC if "w" in mode else os.O_RDONLY)
+    fd = os.open(path, flags, 0o600)
+    info = os.fstat(fd)
+    if info.st_uid != os.getuid() or info.st_mode & 0o022:
+        os.close(fd)
+        raise OSError(errno.EPERM, "File is not owned by current user or it is writable by others", path)
+    return os.fdopen(fd, mode)
+
+
+def __read(path):
+    try:
+        with open(path) as content:
+            return content.read()
+    except IOError:
+        return ""
+
+
+def __binary_path(binary):
+    for directory in os.environ.get("PATH", "/usr/bin").split(os.pathsep):
+        path = os.path.join(directory, binary)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def __stamp():
+    """
+    Return identifier of host state, facts have to be probed again when it changes
+
+    :return: str
+    """
+    items = [__read(BOOT_ID).strip(), hashlib.md5(__read(ROUTE_TABLE)).hexdigest()]
+    for binary in PROBED_BINARIES:
+        path = __binary_path(binary)
+        items.append("%s:%s" % (binary, os.path.getmtime(path) if path else None))
+    return ";".join(items)
+
+
+def __output(command):
+    try:
+        return subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                close_fds=True).communicate()[0]
+    except OSError:
+        return ""
+
+
+def __probe():
+    """
+    Probe all facts, it calls subprocesses
+
+    :return: dict
+    """
+    import netifaces
+    gateways = netifaces.gateways()
+    defroutedev = gateways.get('default').values()[0][1] if gateways.get('default') else "lo"
+    systemd_version = __output(["systemctl", "--version"]).split("\n")[0].split()
+    return {
+        "defroutedev": defroutedev,
+        "hostipaddr": netifaces.ifaddresses(defroutedev)[2][0]['addr'],
+        "packager": subprocess.check_output([PACKAGER_COMMAND], shell=True).strip(),
+        "arch": os.uname()[4],
+        "systemd_version": int(systemd_version[1]) if len(systemd_version) > 1 and
+                                                      systemd_version[1].isdigit() else None,
+        "systemd_run_wait": "--wait" in __output(["systemd-run", "--help"]),
+        "nspawn_notify_ready": "--notify-ready" in __output(["systemd-nspawn", "--help"]),
+    }
+
+
+def get_host_facts(refresh=False):
+    """
+    Return facts about host, they are read from cache file when it is still valid
+
+    :param refresh: bool - probe facts again
+    :return: dict
+    """
+    global __host_facts
+    # host does not change during run of process, stamp is checked once
+    if not refresh and __host_facts:
+        return __host_facts
+    stamp = __stamp()
+    try:
+        cachepath = HOST_FACTS_CACHE or os.path.join(cache_dir(), "host_facts.json")
+    except OSError:
+        # facts are not cached in directory what is not private
+        cachepath = None
+    if not refresh and cachepath:
+        try:
+            with open_private(cachepath) as cachefile:
+                cached = json.load(cachefile)
+            if cached.get("stamp") == stamp:
+                __host_facts = cached
+                return __host_facts
+        except (IOError, OSError, ValueError):
+            pass
+    facts = __probe()
+    facts["stamp"] = stamp
+    if cachepath:
+        try:
+            with open_private(cachepath + ".%d" % os.getpid(), "w") as cachefile:
+                json.dump(facts, cachefile, sort_keys=True)
+            os.rename(cachepath + ".%d" % os.getpid(), cachepath)
+        except (IOError, OSError):
+            # facts are valid anyway
+            pass
+    __host_facts = facts
+    return __host_facts
+
+
+def get_host_fact(name):
+    """
+    Return one fact about host
+
+    :param name: str - one of defroutedev, hostipaddr, packager, arch, systemd_version,
+                 systemd_run_wait, nspawn_notify_ready
+    :return: value of fact
+    """
+    return get_host_facts()[name]
@@ -25,22 +25,23 @@
 Module to setup and cleanup the test environment.
 """
 from moduleframework.common import get_module_type_base, print_info
-from moduleframework.environment_prepare.docker_prepare import EnvDocker
-from moduleframework.environment_prepare.rpm_prepare import EnvRpm
-from moduleframework.environment_prepare.nspawn_prepare import EnvNspawn
-from moduleframework.environment_prepare.openshift_prepare import EnvOpenShift
 
 
 module_name = get_module_type_base()
 print_info("Setting environment for module: {} ".format(module_name))
 
+# import just environment of used module, others bring heavy dependencies
 if module_name == "docker":
+    from moduleframework.environment_prepare.docker_prepare import EnvDocker
     env = EnvDocker()
 elif module_name == "rpm":
+    from moduleframework.environment_prepare.rpm_prepare import EnvRpm
     env = EnvRpm()
 elif module_name == "nspawn":
+    from moduleframework.environment_prepare.nspawn_prepare import EnvNspawn
     env = EnvNspawn()
 elif module_name == "openshift":
+    from moduleframework.environment_prepare.openshift_prepare import EnvOpenShift
     env = EnvOpenShift()
 
 
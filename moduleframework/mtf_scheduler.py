@@ -27,6 +27,7 @@ import moduleframework
 import tempfile
 import json
 import glob
+import uuid
 
 import subprocess
 from moduleframework import common
@@ -70,6 +71,8 @@ VARIABLES
 
     MTF_REUSE=yes uses the same module between tests. It speeds up test execution.
 
+    MTF_JOB_ID=<id> identifies run in names of docker containers and images, it is generated when not set.
+
     MTF_REMOTE_REPOS=yes disables downloading of Koji packages and creating a local repo.
 
     MTF_DISABLE_MODULE=yes disables module handling to use nonmodular test mode.
@@ -276,8 +279,46 @@ def main():
 
     a = AvocadoStart(args, unknown)
     if args.action == 'run':
+        timing_file = common.get_timing_file()
+        if common.get_if_timing() and not timing_file:
+            # file is kept just when user asks for it
+            fd, path = tempfile.mkstemp(prefix="mtf_timing_")
+            os.close(fd)
+            os.environ['MTF_TIMING_FILE'] = path
+        if not os.environ.get('MTF_JOB_ID'):
+            # names of containers and images used by tests are derived from it, so that parallel runs do not clash
+            os.environ['MTF_JOB_ID'] = uuid.uuid4().hex[:12]
         returncode = a.avocado_run()
         a.show_error()
+        if common.get_docker_pool_size():
+            # remove pre-started containers what were not used by tests
+            from mtf.backend.docker_api import drain_container_pools
+            drain_container_pools(job_name=common.get_job_name())
+        try:
+            module_type = common.get_module_type_base()
+        except moduleframework.mtfexceptions.ModuleFrameworkException:
+            # tests without config.yaml
+            module_type = None
+        if module_type == "docker":
+            # remove images committed by start_prepared of docker tests
+            from mtf.backend.docker_api import drain_prepared_images
+            drain_prepared_images(job_name=common.get_job_name())
+        if common.get_nspawn_pool_size():
+            # destroy pre-booted machines what were not used by tests
+            from mtf.backend.nspawn import drain_pools
+            drain_pools()
+        if common.get_if_nspawn_session():
+            # destroy machines shared by tests
+            from mtf.backend.nspawn import drain_sessions
+            drain_sessions()
+        if common.get_if_nspawn_async_teardown():
+            # wait for machines what are removed in background
+            from mtf.backend.nspawn import Reaper
+            Reaper().drain()
+        if common.get_if_timing():
+            common.print_timing_summary(common.get_timing_file())
+            if not timing_file:
+                os.remove(common.get_timing_file())
     else:
         # when there is any need, change general method or create specific one:
         returncode = a.avocado_general()
@@ -59,6 +59,15 @@ class ContainerExc(ModuleFrameworkException):
         super(ContainerExc, self).__init__('TYPE container', *args, **kwargs)
 
 
+class DockerAPIExc(ContainerExc):
+    """
+    Indicates error response of Docker API, HTTP status of response is in status attribute.
+    """
+    def __init__(self, status, *args, **kwargs):
+        super(DockerAPIExc, self).__init__(*args, **kwargs)
+        self.status = status
+
+
 class ConfigExc(ModuleFrameworkException):
     """
     Indicates ``tests/config.yaml`` or module's ModuleMD YAML file error.
@@ -31,17 +31,11 @@ Construct parameters for automatization (CIs)
 import yaml
 import os
 import sys
-from avocado.utils import process
 from common import print_info, DEFAULTRETRYCOUNT, DEFAULTRETRYTIMEOUT, \
     get_if_remoterepos, BASEPATHDIR, MODULEFILE, print_debug,\
-    is_debug, ARCH, is_recursive_download, trans_dict, get_odcs_auth
+    is_debug, ARCH, is_recursive_download, trans_dict, get_odcs_auth, translate_cmd, process
 from moduleframework import mtfexceptions
-from pdc_client import PDCClient
 from timeoutlib import Retry
-try:
-    from odcs.client.odcs import ODCS, AuthMech
-except:
-    print_debug("ODCS  library cannot be imported. ODCS is not supported")
 
 
 PDC_SERVER = "https://pdc.fedoraproject.org/rest_api/v1/unreleasedvariants"
@@ -103,6 +97,7 @@ class PDCParserGeneral():
                 pdc_query['variant_release'] = self.version
             @Retry(attempts=DEFAULTRETRYCOUNT, timeout=DEFAULTRETRYTIMEOUT, error=mtfexceptions.PDCExc("Could not query PDC server"))
             def retry_tmpfunc():
+                from pdc_client import PDCClient
                 # Using develop=True to not authenticate to the server
                 pdc_session = PDCClient(PDC_SERVER, ssl_verify=True, develop=True)
                 print_debug(pdc_session, pdc_query)
@@ -234,8 +229,8 @@ class PDCParserKoji(PDCParserGeneral):
         :return: str
         """
         dir_prefix = BASEPATHDIR
-        process.run("{HOSTPACKAGER} install createrepo koji".format(
-            **trans_dict), ignore_status=True)
+        process.run(translate_cmd("{HOSTPACKAGER} install createrepo koji", translation_dict=trans_dict),
+                    ignore_status=True)
         if is_recursive_download():
             dirname = os.path.join(dir_prefix,"localrepo_recursive")
         else:
@@ -262,9 +257,24 @@ class PDCParserKoji(PDCParserGeneral):
 
 class PDCParserODCS(PDCParserGeneral):
     compose_type = "module"
-    auth_token = get_odcs_auth()
+    __auth_token = None
+
+    @property
+    def auth_token(self):
+        """
+        Return ODCS token, it is asked just once and when ODCS is really used
+
+        :return: str
+        """
+        if PDCParserODCS.__auth_token is None:
+            PDCParserODCS.__auth_token = get_odcs_auth()
+        return PDCParserODCS.__auth_token
 
     def get_repo(self):
+        try:
+            from odcs.client.odcs import ODCS, AuthMech
+        except ImportError:
+            raise mtfexceptions.PDCExc("ODCS library cannot be imported. ODCS is not supported")
         odcs = ODCS(ODCS_URL, auth_mech=AuthMech.OpenIDC, openidc_token=self.auth_token)
         print_debug("ODCS Starting module composing: %s" % odcs,
                     "%s compose for: %s" % (self.compose_type, self.get_module_identifier()))
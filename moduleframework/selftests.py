@@ -0,0 +1,420 @@
+# -*- coding: utf-8 -*-
+#
+# Meta test family (MTF) is a tool to test components of a modular Fedora:
+# https://docs.pagure.org/modularity/
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# he Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Authors: Jan Scotka <jscotka@redhat.com>
+#
+
+"""
+Unit tests of moduleframework library, they do not need any module (container, machine), run them via:
+py.test moduleframework/selftests.py
+"""
+
+import os
+import json
+import tempfile
+import shutil
+import subprocess
+import pytest
+
+from avocado.utils import process
+from moduleframework import common
+from moduleframework import host_facts
+from moduleframework.helpers import rpm_helper
+from mtf.backend.nspawn import Image, Reaper, resolve_in_root, tar_copy
+
+
+def bash_runner(calls):
+    """
+    Return runner for _run_batch what runs script by bash on host and records scripts
+
+    :param calls: list where scripts are appended
+    :return: function
+    """
+    def runner(script, **kwargs):
+        calls.append(script)
+        bash = subprocess.Popen(["bash", "-c", script], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = bash.communicate()
+        return process.CmdResult(command=script, stdout=stdout, stderr=stderr, exit_status=bash.returncode)
+    return runner
+
+
+def test_batch_framing():
+    commands = ["echo out; echo err >&2", "printf 'no newline'", "exit 3", "echo MTF_BATCH_other:0:end:1"]
+    token = "MTF_BATCH_token"
+    calls = []
+    results = common.parse_batch_result(commands, token, bash_runner(calls)(common.batch_cmd(commands, token)))
+    assert [x.command for x in results] == commands
+    assert (results[0].stdout, results[0].stderr) == ("out\n", "err\n")
+    assert results[1].stdout == "no newline"
+    assert [x.exit_status for x in results] == [0, 0, 3, 0]
+    # frame of other batch in output is output of command
+    assert results[3].stdout == "MTF_BATCH_other:0:end:1\n"
+
+
+def test_batch_broken_output():
+    commands = ["true", "true"]
+    cmdresult = process.CmdResult(command="", stdout="MTF_BATCH_t:0:begin\nMTF_BATCH_t:0:end:0\n",
+                                  stderr="MTF_BATCH_t:0:begin\nMTF_BATCH_t:0:end\n", exit_status=1)
+    try:
+        common.parse_batch_result(commands, "MTF_BATCH_t", cmdresult)
+    except common.CmdExc:
+        pass
+    else:
+        assert False
+
+
+def test_run_batch_status():
+    helper = object.__new__(common.CommonFunctions)
+    results = helper._run_batch(bash_runner([]), ["true", "exit 3", "echo ok"], ignore_status=True)
+    assert [x.exit_status for x in results] == [0, 3, 0]
+    assert results[2].stdout == "ok\n"
+    try:
+        helper._run_batch(bash_runner([]), ["true", "exit 3", "echo ok"])
+    except process.CmdError as e:
+        assert e.result.command == "exit 3"
+    else:
+        assert False
+
+
+def test_run_batch_chunks():
+    helper = object.__new__(common.CommonFunctions)
+    calls = []
+    commands = ["echo %s" % (str(index) * (common.BATCH_MAX_SIZE / 3)) for index in range(5)]
+    results = helper._run_batch(bash_runner(calls), commands)
+    assert len(calls) > 1
+    assert all(len(x) < 2 * common.BATCH_MAX_SIZE for x in calls)
+    assert [x.stdout.strip() for x in results] == [x[5:] for x in commands]
+
+
+def test_timing_spans(monkeypatch):
+    class Machine(object):
+        name = "machine1"
+        location = 42
+
+        @common.timed("machine.boot")
+        def boot(self, fail=False):
+            if fail:
+                raise common.CmdExc("boot failed")
+            return "booted"
+
+    fd, path = tempfile.mkstemp(prefix="mtf_timing_")
+    os.close(fd)
+    try:
+        monkeypatch.delenv("MTF_TIMING_FILE", raising=False)
+        monkeypatch.delenv("MTF_TIMING", raising=False)
+        assert not common.get_if_timing()
+        # nothing is recorded when timing is disabled
+        Machine().boot()
+        assert os.path.getsize(path) == 0
+        monkeypatch.setenv("MTF_TIMING_FILE", path)
+        assert common.get_if_timing()
+        assert Machine().boot() == "booted"
+        try:
+            Machine().boot(fail=True)
+        except common.CmdExc:
+            pass
+        with common.TimingSpan("image.install", location="/opt/image"):
+            pass
+        with open(path) as timingfile:
+            records = [json.loads(line) for line in timingfile]
+        assert [(x["phase"], x["status"]) for x in records] == [("machine.boot", "ok"), ("machine.boot", "error"),
+                                                                 ("image.install", "ok")]
+        # just string attributes of object are stored
+        assert records[0]["name"] == "machine1" and "location" not in records[0]
+        assert records[2]["location"] == "/opt/image"
+        assert all(x["duration"] >= 0 and x["pid"] == os.getpid() for x in records)
+        printed = []
+        monkeypatch.setattr(common, "print_info", printed.append)
+        common.print_timing_summary(path)
+        summary = dict((x.split()[0], x.split()[1]) for x in printed[1:])
+        assert summary == {"machine.boot": "2x", "image.install": "1x"}
+    finally:
+        os.remove(path)
+
+
+def test_image_bind_options():
+    image = Image(repos=["http://example.com/repo/", "file:///var/tmp/repo1", "file:///opt/repo2"],
+                  packageset=[], location="/var/tmp/image", installed=True)
+    assert image.bind_options() == ["--bind-ro=/var/tmp/repo1", "--bind-ro=/opt/repo2"]
+    assert Image(repos=["http://example.com/repo/"], packageset=[], location="/var/tmp/image",
+                 installed=True).bind_options() == []
+
+
+def test_resolve_in_root():
+    root = tempfile.mkdtemp(prefix="mtf_root_")
+    try:
+        os.makedirs(os.path.join(root, "usr", "share", "zoneinfo"))
+        os.makedirs(os.path.join(root, "run"))
+        os.makedirs(os.path.join(root, "etc"))
+        open(os.path.join(root, "usr", "share", "zoneinfo", "UTC"), "w").close()
+        os.symlink("/usr/share/zoneinfo/UTC", os.path.join(root, "etc", "localtime"))
+        os.symlink("../run", os.path.join(root, "etc", "run"))
+        os.symlink("/../../..", os.path.join(root, "escape"))
+        assert resolve_in_root(root, "/etc/localtime") == root + "/usr/share/zoneinfo/UTC"
+        assert resolve_in_root(root, "/escape/etc") == root + "/etc"
+        # just parent directories are resolved, name of copied file is kept
+        assert resolve_in_root(root, "/etc/localtime", follow=False) == root + "/etc/localtime"
+        assert resolve_in_root(root, "/etc/run/file", follow=False) == root + "/run/file"
+        assert resolve_in_root(root, "/etc/run/..", follow=False) == root + "/"
+        destdir = os.path.join(root, "back")
+        os.mkdir(destdir)
+        tar_copy([resolve_in_root(root, "/etc/localtime", follow=False)], destdir)
+        assert os.listdir(destdir) == ["localtime"]
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+class DummyContainer(object):
+    """
+    Container what records calls of Reaper
+    """
+    def __init__(self, name, location):
+        self.name = name
+        self.location = location
+        self.image = Image(repos=[], packageset=[], location=location, installed=True, snapshot_method="overlay")
+        self.calls = []
+
+    def detach(self):
+        self.calls.append("detach")
+
+    def stop(self):
+        self.calls.append("stop")
+
+    def rm(self):
+        self.calls.append("rm")
+
+
+def test_reaper_round_trip(monkeypatch):
+    basedir = tempfile.mkdtemp(prefix="mtf_reaper_")
+    try:
+        reaped = []
+        monkeypatch.setattr(Reaper, "_Reaper__reap", staticmethod(reaped.append))
+        # no worker slot, so that queue is processed just by drain of this process
+        reaper = Reaper(basedir=basedir, workers=0, min_free=0)
+        containers = [DummyContainer("machine%d" % index, os.path.join(basedir, "machine%d" % index))
+                      for index in range(3)]
+        for container in containers:
+            reaper.submit(container)
+        assert all(x.calls == ["detach"] for x in containers)
+        assert len(os.listdir(os.path.join(basedir, "queue"))) == 3
+        # machine of crashed worker is removed as well
+        with open(os.path.join(basedir, "running", "crashed.json"), "w") as memberfile:
+            json.dump({"name": "crashed", "location": "/nonexistent", "snapshot_method": None}, memberfile)
+        reaper.drain()
+        assert sorted(x["name"] for x in reaped) == ["crashed", "machine0", "machine1", "machine2"]
+        assert dict((x["name"], x["snapshot_method"]) for x in reaped)["machine0"] == "overlay"
+        assert not os.listdir(os.path.join(basedir, "queue")) and not os.listdir(os.path.join(basedir, "running"))
+        # lack of disk space, container is removed synchronously
+        container = DummyContainer("machine3", os.path.join(basedir, "machine3"))
+        Reaper(basedir=basedir, workers=0, min_free=1.1).submit(container)
+        assert container.calls == ["detach", "stop", "rm"]
+        assert not os.listdir(os.path.join(basedir, "queue"))
+    finally:
+        shutil.rmtree(basedir, ignore_errors=True)
+
+
+def test_host_facts_cache(monkeypatch):
+    tmpdir = tempfile.mkdtemp(prefix="mtf_host_facts_")
+    try:
+        probes = []
+
+        def probe():
+            probes.append(1)
+            return {"arch": "x86_64", "packager": "dnf -y"}
+
+        for name, content in [("boot_id", "boot1\n"), ("route", "route1\n"), ("dnf", "")]:
+            with open(os.path.join(tmpdir, name), "w") as hostfile:
+                hostfile.write(content)
+        monkeypatch.setattr(host_facts, "HOST_FACTS_CACHE", os.path.join(tmpdir, "facts.json"))
+        monkeypatch.setattr(host_facts, "BOOT_ID", os.path.join(tmpdir, "boot_id"))
+        monkeypatch.setattr(host_facts, "ROUTE_TABLE", os.path.join(tmpdir, "route"))
+        monkeypatch.setattr(host_facts, "__probe", probe)
+        monkeypatch.setattr(host_facts, "__host_facts", None)
+        monkeypatch.setenv("PATH", tmpdir)
+        assert host_facts.get_host_fact("arch") == "x86_64"
+        assert len(probes) == 1 and os.path.exists(host_facts.HOST_FACTS_CACHE)
+        # hit in memory and hit in cache file of other process
+        assert host_facts.get_host_fact("packager") == "dnf -y"
+        monkeypatch.setattr(host_facts, "__host_facts", None)
+        assert host_facts.get_host_fact("packager") == "dnf -y"
+        assert len(probes) == 1
+        # host is checked once per process, other processes miss after change of routing table,
+        # reboot and update of packager
+        with open(os.path.join(tmpdir, "route"), "w") as hostfile:
+            hostfile.write("route2\n")
+        host_facts.get_host_fact("arch")
+        assert len(probes) == 1
+        monkeypatch.setattr(host_facts, "__host_facts", None)
+        host_facts.get_host_fact("arch")
+        assert len(probes) == 2
+        with open(os.path.join(tmpdir, "boot_id"), "w") as hostfile:
+            hostfile.write("boot2\n")
+        monkeypatch.setattr(host_facts, "__host_facts", None)
+        host_facts.get_host_fact("arch")
+        assert len(probes) == 3
+        os.utime(os.path.join(tmpdir, "dnf"), (0, 0))
+        monkeypatch.setattr(host_facts, "__host_facts", None)
+        host_facts.get_host_fact("arch")
+        assert len(probes) == 4
+        host_facts.get_host_facts(refresh=True)
+        assert len(probes) == 5
+        host_facts.get_host_fact("arch")
+        assert len(probes) == 5
+        # cache file writable by others and symlink are not trusted
+        os.chmod(host_facts.HOST_FACTS_CACHE, 0o666)
+        monkeypatch.setattr(host_facts, "__host_facts", None)
+        host_facts.get_host_fact("arch")
+        assert len(probes) == 6
+        os.rename(host_facts.HOST_FACTS_CACHE, os.path.join(tmpdir, "other.json"))
+        os.symlink(os.path.join(tmpdir, "other.json"), host_facts.HOST_FACTS_CACHE)
+        monkeypatch.setattr(host_facts, "__host_facts", None)
+        host_facts.get_host_fact("arch")
+        assert len(probes) == 7
+        # directory accessible by others is refused
+        os.chmod(tmpdir, 0o755)
+        with pytest.raises(OSError):
+            host_facts.private_dir(tmpdir)
+        os.chmod(tmpdir, 0o700)
+        assert host_facts.private_dir(os.path.join(tmpdir, "sub")) == os.path.join(tmpdir, "sub")
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def test_lazy_host_attributes(monkeypatch):
+    facts = []
+    monkeypatch.setattr(common, "get_host_fact", lambda name: facts.append(name) or "dnf -y")
+    # module attributes are not probed on import
+    assert isinstance(common.hostpackager, common.Lazy) and common.guestpackager is common.hostpackager
+    hostpackager = common.Lazy(lambda: common.get_host_fact("packager"))
+    assert not facts
+    assert "%s install" % hostpackager == hostpackager + " install" == "dnf -y install"
+    assert "sudo " + hostpackager == "sudo dnf -y"
+    assert hostpackager == "dnf -y" and hostpackager.split() == ["dnf", "-y"]
+    assert facts == ["packager"]
+
+
+def test_rpm_install_if_changed(monkeypatch):
+    tmpdir = tempfile.mkdtemp(prefix="mtf_rpm_state_")
+    try:
+        installed = []
+        queried = []
+        os.makedirs(os.path.join(tmpdir, "rpmdb"))
+        open(os.path.join(tmpdir, "rpmdb", "Packages"), "w").close()
+        monkeypatch.setattr(rpm_helper, "INSTALL_STATE_DIR", tmpdir)
+        monkeypatch.setattr(rpm_helper, "RPMDB_DIRS", [os.path.join(tmpdir, "rpmdb")])
+        monkeypatch.setattr(rpm_helper, "get_config_path", lambda: "/etc/mtf/config.yaml")
+        helper = object.__new__(rpm_helper.RpmHelper)
+        helper.repos = ["http://example.com/repo/"]
+        helper.packages = ["memcached"]
+        monkeypatch.setattr(helper, "getPackageList", lambda: helper.packages, raising=False)
+        monkeypatch.setattr(helper, "install_packages", lambda: installed.append(list(helper.packages)),
+                            raising=False)
+        monkeypatch.setattr(helper, "runHost", lambda command, **kwargs:
+                            queried.append(command) or process.CmdResult(command=command, exit_status=1),
+                            raising=False)
+        helper._RpmHelper__install_if_changed()
+        assert installed == [["memcached"]] and len(queried) == 1
+        # skip path, nothing changed since last installation
+        helper._RpmHelper__install_if_changed()
+        assert installed == [["memcached"]] and len(queried) == 1
+        # reinstall path, package list, repositories or rpm database changed
+        helper.packages = ["memcached", "perl"]
+        helper._RpmHelper__install_if_changed()
+        assert installed[-1] == ["memcached", "perl"]
+        helper.repos = ["http://example.com/other/"]
+        helper._RpmHelper__install_if_changed()
+        assert len(installed) == 3
+        os.utime(os.path.join(tmpdir, "rpmdb", "Packages"), (1, 1))
+        helper._RpmHelper__install_if_changed()
+        assert len(installed) == 4
+        # every config file, repositories and packages have own state
+        assert len([x for x in os.listdir(tmpdir) if x.startswith("rpm_state_")]) == 3
+        # cleanup of test changes rpm database, so that installation is checked again
+        helper._RpmHelper__install_if_changed()
+        assert len(installed) == 4
+        os.utime(os.path.join(tmpdir, "rpmdb", "Packages"), (2, 2))
+        helper._RpmHelper__install_if_changed()
+        assert len(installed) == 5
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+CONFIG_TEMPLATE = """
+document: meta-test-family
+version: 1
+name: %s
+module:
+    docker:
+        start: "docker run -it -d"
+        container: docker.io/example
+    rpm:
+        repo:
+            - http://example.com/repo/
+"""
+
+
+def test_config_reload(monkeypatch):
+    tmpdir = tempfile.mkdtemp(prefix="mtf_config_")
+    try:
+        cfgfile = os.path.join(tmpdir, "config.yaml")
+        with open(cfgfile, "w") as config:
+            config.write(CONFIG_TEMPLATE % "first")
+        monkeypatch.setattr(common, "CONFIG_CACHE", os.path.join(tmpdir, "config_%s.cache"))
+        monkeypatch.setattr(common, "__persistent_config", None)
+        monkeypatch.setenv("CONFIG", cfgfile)
+        monkeypatch.setenv("MODULE", "docker")
+        monkeypatch.delenv("URL", raising=False)
+        assert common.get_config()["name"] == "first"
+        assert common.get_config() is common.get_config()
+        assert common.get_module_section()["start"] == "docker run -it -d"
+        # helper shares config, modifiable copy is created when test asks for it and shared config is not changed
+        helper = object.__new__(common.CommonFunctions)
+        helper.loadconfig()
+        assert helper.info["start"] == "docker run -it -d"
+        assert helper._CommonFunctions__modifiable_config is None
+        helper.info["container"] = "docker.io/other"
+        helper.config["module"]["docker"]["start"] = "docker run -p 3307:3306"
+        assert helper.info["start"] == "docker run -p 3307:3306"
+        assert helper.info["container"] == "docker.io/other"
+        assert helper.config is helper.config
+        assert common.get_config()["module"]["docker"]["start"] == "docker run -it -d"
+        # edited config is picked up by running process, parsed content is cached for other processes
+        with open(cfgfile, "w") as config:
+            config.write((CONFIG_TEMPLATE % "second").replace("-it -d", "-d"))
+        os.utime(cfgfile, (os.path.getmtime(cfgfile) + 10,) * 2)
+        assert common.get_config()["name"] == "second"
+        assert common.get_module_section()["start"] == "docker run -d"
+        # default module is read again from edited config
+        with open(cfgfile, "a") as config:
+            config.write("default_module: rpm\n")
+        os.utime(cfgfile, (os.path.getmtime(cfgfile) + 10,) * 2)
+        monkeypatch.delenv("MODULE")
+        assert common.get_module_type() == "rpm"
+        with open(cfgfile, "w") as config:
+            config.write((CONFIG_TEMPLATE % "second") + "default_module: docker\n")
+        os.utime(cfgfile, (os.path.getmtime(cfgfile) + 20,) * 2)
+        assert common.get_module_type() == "docker"
+        monkeypatch.setenv("MODULE", "docker")
+        assert len(os.listdir(tmpdir)) == 2
+        monkeypatch.setattr(common, "yaml", None)
+        monkeypatch.setattr(common, "__persistent_config", None)
+        assert common.get_config()["name"] == "second"
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
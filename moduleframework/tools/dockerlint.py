@@ -115,9 +115,9 @@ class DockerfileLinterInContainer(container_avocado_test.ContainerAvocadoTest):
 
     def _file_to_check(self, doc_file_list):
         test_failed = False
-        for doc in doc_file_list:
-            exit_status = self.run("test -e %s" % doc, ignore_status=True).exit_status
-            if int(exit_status) == 0:
+        results = self.run_many(["test -e %s" % doc for doc in doc_file_list], ignore_status=True)
+        for doc, result in zip(doc_file_list, results):
+            if int(result.exit_status) == 0:
                 self.log.debug("%s doc file exists in container" % doc)
                 test_failed = True
         return test_failed
@@ -0,0 +1,1638 @@
+# -*- coding: utf-8 -*-
+#
+# Meta test family (MTF) is a tool to test components of a modular Fedora:
+# https://docs.pagure.org/modularity/
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# he Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Authors: Jan Scotka <jscotka@redhat.com>
+#
+
+"""
+Low level library handling docker containers and images. It contains client of Docker Engine REST API
+(or compatible one) via unix socket, one connection is kept open and reused by all calls, so that there is
+no docker CLI process per operation. Classes what need docker calls get them as functions,
+so that they work with API client and with docker CLI.
+"""
+
+import os
+import io
+import json
+import time
+import base64
+import socket
+import struct
+import shutil
+import tarfile
+import tempfile
+import httplib
+import logging
+import threading
+import urllib
+import urllib2
+import urlparse
+import hashlib
+import fcntl
+import re
+import glob
+import subprocess
+import BaseHTTPServer
+import Queue
+import SocketServer
+import SimpleHTTPServer
+
+from avocado import Test
+from avocado.utils import process
+from mtf import mtfexceptions
+from moduleframework.host_facts import cache_base, private_dir, open_private
+
+DEFAULT_DOCKER_SOCKET = "/var/run/docker.sock"
+# API version supported by docker >= 1.12 and by podman compat API
+DOCKER_API_VERSION = "v1.24"
+DEFAULT_API_TIMEOUT = 300
+# header of frame of multiplexed stdout/stderr stream: stream type, 3 zero bytes, size of frame
+STREAM_HEADER = struct.Struct(">BxxxL")
+STREAM_STDOUT = 1
+STREAM_STDERR = 2
+# os.ModeDir of golang, it is part of mode in X-Docker-Container-Path-Stat header
+GO_MODE_DIR = 1 << 31
+# events what change running state of container, paused container is running as in docker ps
+EVENTS_RUNNING = ["start", "restart"]
+EVENTS_STOPPED = ["die", "destroy"]
+
+# directories are private (mode 0700), files in them are trusted
+DOCKER_IMAGE_CACHE = os.path.join(cache_base(), "docker_images")
+# image is not checked again against registry for this time (seconds)
+IMAGE_CHECK_TTL = 300
+REGISTRY_TIMEOUT = 10
+DEFAULT_REGISTRY = "docker.io"
+DOCKER_HUB_REGISTRY = "registry-1.docker.io"
+MANIFEST_TYPES = ["application/vnd.docker.distribution.manifest.list.v2+json",
+                  "application/vnd.docker.distribution.manifest.v2+json",
+                  "application/vnd.oci.image.index.v1+json",
+                  "application/vnd.oci.image.manifest.v1+json"]
+# check modes of ImageDigestCache
+IMAGE_CHECK_REGISTRY = "registry"
+IMAGE_CHECK_LOCAL = "local"
+IMAGE_CHECK_ALWAYS = "always"
+# repository of images imported from tarballs, tag is checksum of tarball
+IMPORT_REPOSITORY = "mtf-import"
+
+DOCKER_POOL_BASEDIR = os.path.join(cache_base(), "docker_pool")
+DOCKER_PREPARED_BASEDIR = os.path.join(cache_base(), "docker_prepared")
+PREPARED_REPOSITORY = "mtf-prepared"
+# label of containers created by MTF, value is ID of job (MTF_JOB_ID)
+JOB_LABEL = "mtf.job"
+DEFAULT_RETRYTIMEOUT = 30
+
+__clients = {}
+
+
+def docker_socket():
+    """
+    Return path to unix socket of docker daemon, DOCKER_HOST envvar is used when set
+
+    :return: str or None in case DOCKER_HOST is not unix socket
+    """
+    docker_host = os.environ.get("DOCKER_HOST")
+    if not docker_host:
+        return DEFAULT_DOCKER_SOCKET
+    if docker_host.startswith("unix://"):
+        return docker_host[len("unix://"):]
+    return None
+
+
+def get_docker_api(socket_path=None):
+    """
+    Return client of docker API shared in process
+
+    :param socket_path: str - path to unix socket, default is from docker_socket()
+    :return: DockerAPI or None in case API is not available (docker CLI has to be used)
+    """
+    socket_path = socket_path or docker_socket()
+    if not socket_path:
+        return None
+    if socket_path not in __clients:
+        client = DockerAPI(socket_path)
+        try:
+            client.ping()
+        except (mtfexceptions.ContainerExc, socket.error) as e:
+            client.logger.debug("Docker API is not available via %s: %s" % (socket_path, e))
+            client = None
+        __clients[socket_path] = client
+    return __clients[socket_path]
+
+
+def demultiplex(data):
+    """
+    Split multiplexed stream of exec/attach (frames with header) to stdout and stderr
+
+    :param data: str - content of stream
+    :return: tuple (stdout, stderr)
+    """
+    streams = {STREAM_STDOUT: [], STREAM_STDERR: []}
+    position = 0
+    while position + STREAM_HEADER.size <= len(data):
+        stream, size = STREAM_HEADER.unpack_from(data, position)
+        position += STREAM_HEADER.size
+        streams.get(stream, streams[STREAM_STDOUT]).append(data[position:position + size])
+        position += size
+    return "".join(streams[STREAM_STDOUT]), "".join(streams[STREAM_STDERR])
+
+
+def docker_cli_is_running(container_id):
+    """
+    Check if container is running via docker inspect command
+
+    :param container_id: str
+    :return: bool
+    """
+    result = process.run("docker inspect -f '{{.State.Running}}' %s" % container_id,
+                         ignore_status=True, verbose=False)
+    return result.exit_status == 0 and result.stdout.strip() == "true"
+
+
+def docker_cli_events(container_id, since):
+    """
+    Return stream of events of container read from docker events command
+
+    :param container_id: str
+    :param since: str - unix timestamp, events since this time are replayed
+    :return: CommandEventStream
+    """
+    return CommandEventStream(["docker", "events", "--since", since,
+                               "--filter", "container=%s" % container_id, "--filter", "type=container",
+                               "--format", "{{.Status}}"])
+
+
+def docker_cli_inspect_image(image):
+    """
+    Return dict what is same as docker inspect of image
+
+    :param image: str
+    :return: dict or None in case image does not exist
+    """
+    result = process.run("docker inspect --type image %s" % image, ignore_status=True, verbose=False)
+    if result.exit_status != 0:
+        return None
+    return json.loads(result.stdout)[0]
+
+
+def docker_cli_pull(image):
+    process.run("docker pull %s" % image)
+
+
+def docker_cli_import(tarball, repository):
+    process.run("docker import %s %s" % (tarball, repository))
+
+
+def parse_reference(reference):
+    """
+    Split image reference to parts, short names are expanded in same way as docker does it
+
+    :param reference: str - e.g. fedora:26, quay.io/user/image@sha256:...
+    :return: tuple (registry, repository, tag, digest)
+    """
+    name, digest = reference.split("@", 1) if "@" in reference else (reference, None)
+    tag = None
+    if ":" in name.rsplit("/", 1)[-1]:
+        name, tag = name.rsplit(":", 1)
+    first = name.split("/", 1)
+    if len(first) == 2 and ("." in first[0] or ":" in first[0] or first[0] == "localhost"):
+        registry, repository = first
+    else:
+        registry, repository = DEFAULT_REGISTRY, name
+    if registry == DEFAULT_REGISTRY and "/" not in repository:
+        repository = "library/" + repository
+    return registry, repository, tag or (None if digest else "latest"), digest
+
+
+def registry_digest(reference):
+    """
+    Return digest of manifest of image in registry, it uses HEAD request, so that nothing is downloaded.
+    Anonymous bearer token is requested when registry asks for it.
+
+    :param reference: str - image reference
+    :return: str (sha256:...) or None in case registry is not accessible
+    """
+    registry, repository, tag, digest = parse_reference(reference)
+    if digest:
+        return digest
+    host = DOCKER_HUB_REGISTRY if registry == DEFAULT_REGISTRY else registry
+    url = "https://%s/v2/%s/manifests/%s" % (host, repository, tag)
+    headers = {"Accept": ", ".join(MANIFEST_TYPES)}
+    for _ in range(2):
+        request = urllib2.Request(url, headers=headers)
+        request.get_method = lambda: "HEAD"
+        try:
+            return urllib2.urlopen(request, timeout=REGISTRY_TIMEOUT).info().getheader("Docker-Content-Digest")
+        except urllib2.HTTPError as e:
+            challenge = e.info().getheader("WWW-Authenticate") or ""
+            if e.code != 401 or not challenge.startswith("Bearer") or "Authorization" in headers:
+                return None
+            params = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+            realm = params.pop("realm", None)
+            try:
+                token = json.load(urllib2.urlopen("%s?%s" % (realm, urllib.urlencode(params)),
+                                                  timeout=REGISTRY_TIMEOUT))
+            except (urllib2.URLError, socket.error, ValueError):
+                return None
+            headers["Authorization"] = "Bearer %s" % (token.get("token") or token.get("access_token"))
+        except (urllib2.URLError, socket.error, ValueError):
+            return None
+    return None
+
+
+def registry_auth(registry, config_path=None):
+    """
+    Return value of X-Registry-Auth header for registry, credentials are read from config
+    of docker CLI (config.json in directory from DOCKER_CONFIG envvar or in ~/.docker)
+
+    :param registry: str - registry host, see parse_reference
+    :param config_path: str - path of config.json
+    :return: str or None in case there are no credentials stored for registry
+    """
+    if not config_path:
+        config_path = os.path.join(os.environ.get("DOCKER_CONFIG") or os.path.expanduser("~/.docker"), "config.json")
+    try:
+        with open(config_path) as config:
+            auths = json.load(config).get("auths") or {}
+    except (IOError, ValueError):
+        return None
+    hosts = [registry, "index.docker.io", DOCKER_HUB_REGISTRY] if registry == DEFAULT_REGISTRY else [registry]
+    for address, value in auths.items():
+        if re.sub("^https?://", "", address).split("/")[0] in hosts and value.get("auth"):
+            try:
+                username, password = base64.b64decode(value["auth"]).split(":", 1)
+            except (TypeError, ValueError):
+                continue
+            return base64.urlsafe_b64encode(json.dumps({"username": username, "password": password,
+                                                        "serveraddress": address}))
+    return None
+
+
+def url_version(url):
+    """
+    Return identifier of version of remote file (ETag, or Last-Modified with size), HEAD request is used,
+    so that nothing is downloaded
+
+    :param url: str
+    :return: str or None in case server does not provide it or it is not accessible
+    """
+    request = urllib2.Request(url)
+    request.get_method = lambda: "HEAD"
+    try:
+        info = urllib2.urlopen(request, timeout=REGISTRY_TIMEOUT).info()
+    except (urllib2.URLError, socket.error, ValueError):
+        return None
+    if info.getheader("ETag"):
+        return info.getheader("ETag")
+    if info.getheader("Last-Modified"):
+        return "%s;%s" % (info.getheader("Last-Modified"), info.getheader("Content-Length"))
+    return None
+
+
+def file_checksum(path):
+    """
+    Return sha256 of file content
+
+    :param path: str
+    :return: str
+    """
+    checksum = hashlib.sha256()
+    with open(path, "rb") as content:
+        for chunk in iter(lambda: content.read(1024 * 1024), ""):
+            checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+class ImageDigestCache(object):
+    """
+    Cache of images pulled from registry or imported from tarball, it maps image reference or checksum of tarball
+    to image ID, so that image is not pulled or imported again when it did not change.
+    Cache is shared by processes, just one process pulls or imports same image in same time.
+    """
+    logger = logging.getLogger("ImageDigestCache")
+
+    def __init__(self, inspect, pull, import_image, basedir=DOCKER_IMAGE_CACHE, check=IMAGE_CHECK_REGISTRY):
+        """
+
+        :param inspect: function(image) - returns dict of docker inspect or None when image does not exist
+        :param pull: function(image) - pull image from registry
+        :param import_image: function(tarball, repository) - import image from tarball
+        :param basedir: str - directory of cache entries
+        :param check: str - registry: pull when digest in registry differs from local image,
+                      local: pull just when image does not exist locally, always: pull (import) every time
+        """
+        self.inspect = inspect
+        self.pull = pull
+        self.import_image = import_image
+        self.basedir = basedir
+        self.check = check
+        private_dir(self.basedir)
+
+    def __path(self, key, suffix):
+        return os.path.join(self.basedir, "%s.%s" % (hashlib.md5(key).hexdigest(), suffix))
+
+    def __load(self, key):
+        try:
+            with open_private(self.__path(key, "json")) as entry:
+                return json.load(entry)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def __store(self, key, entry):
+        path = self.__path(key, "json")
+        with open_private(path + ".%d" % os.getpid(), "w") as content:
+            json.dump(entry, content)
+        os.rename(path + ".%d" % os.getpid(), path)
+
+    def __tarball_checksum(self, tarball):
+        """
+        Internal method
+        checksum of tarball, it is computed again just when size or mtime of tarball changes.
+        Remote tarball (URL) is identified by URL and its ETag (Last-Modified)
+
+        :return: str or None in case version of remote tarball is not known (it is not cached then)
+        """
+        if "://" in tarball:
+            version = url_version(tarball)
+            return hashlib.sha256("%s\n%s" % (tarball, version)).hexdigest() if version else None
+        stat = os.stat(tarball)
+        key = "stat:%s" % os.path.abspath(tarball)
+        entry = self.__load(key)
+        if entry.get("stat") != [stat.st_size, stat.st_mtime, stat.st_ino]:
+            entry = {"stat": [stat.st_size, stat.st_mtime, stat.st_ino], "checksum": file_checksum(tarball)}
+            self.__store(key, entry)
+        return entry["checksum"]
+
+    def __is_fresh(self, entry, local):
+        return entry.get("id") == local["Id"] and time.time() - entry.get("checked", 0) < IMAGE_CHECK_TTL
+
+    def __is_current(self, reference, local, entry):
+        """
+        Internal method
+        check if local image is same as image in registry
+
+        :return: bool
+        """
+        if not local or self.check == IMAGE_CHECK_ALWAYS:
+            return False
+        if self.check == IMAGE_CHECK_LOCAL or parse_reference(reference)[3]:
+            # digest reference is immutable
+            return True
+        if self.__is_fresh(entry, local):
+            return True
+        remote = registry_digest(reference)
+        self.logger.debug("Registry digest of %s: %s, local: %s" % (reference, remote, local.get("RepoDigests")))
+        return bool(remote) and any(x.endswith("@" + remote) for x in local.get("RepoDigests") or [])
+
+    def tarball_reference(self, tarball):
+        """
+        Return name of image imported from tarball, it is derived from content of tarball,
+        so that parallel jobs importing different tarballs do not overwrite same name
+
+        :param tarball: str - path or URL of tarball of image
+        :return: str
+        """
+        checksum = self.__tarball_checksum(tarball) or hashlib.sha256(tarball).hexdigest()
+        return "%s:%s" % (IMPORT_REPOSITORY, checksum[:32])
+
+    def get_image(self, reference, tarball=None):
+        """
+        Return inspect of image, image is pulled (imported) just when it is not current
+
+        :param reference: str - image reference, it is name of imported image in case of tarball
+        :param tarball: str - path or URL of tarball of image
+        :return: dict of docker inspect
+        """
+        checksum = self.__tarball_checksum(tarball) if tarball else None
+        key = "tar:%s:%s" % (checksum or tarball, reference) if tarball else "ref:%s" % reference
+        with open_private(self.__path(key, "lock"), "w") as lockfile:
+            # other processes wait for pull of same image and use it then
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            entry = self.__load(key)
+            local = self.inspect(reference)
+            if tarball:
+                if local and entry.get("id") == local["Id"] and self.check != IMAGE_CHECK_ALWAYS and checksum:
+                    self.logger.debug("Image %s is imported from same tarball already" % reference)
+                    return local
+                self.import_image(tarball, reference)
+            elif self.__is_current(reference, local, entry):
+                self.logger.debug("Image %s is current, pull skipped" % reference)
+                if not self.__is_fresh(entry, local):
+                    self.__store(key, {"id": local["Id"], "checked": time.time()})
+                return local
+            else:
+                self.pull(reference)
+            local = self.inspect(reference)
+            if not local:
+                raise mtfexceptions.ContainerExc("Image %s does not exist after pull/import" % reference)
+            self.__store(key, {"id": local["Id"], "checked": time.time()})
+            return local
+
+
+def docker_cli_remove(container_id):
+    process.run("docker rm -f -v %s" % container_id, ignore_status=True, verbose=False)
+
+
+def docker_cli_commit(container_id, repository, tag):
+    process.run("docker commit %s %s:%s" % (container_id, repository, tag), verbose=False)
+
+
+def docker_cli_remove_image(image):
+    process.run("docker rmi -f %s" % image, ignore_status=True, verbose=False)
+
+
+def docker_cli_remove_background(container_id):
+    """
+    Remove container by docker command in background process, it is not waited for it
+
+    :param container_id: str
+    :return: None
+    """
+    with open(os.devnull, "w") as devnull:
+        subprocess.Popen(["docker", "rm", "-f", "-v", container_id], stdin=devnull, stdout=devnull,
+                         stderr=devnull, close_fds=True, preexec_fn=os.setsid)
+
+
+class ContainerPool(object):
+    """
+    Pool of running containers created from one image by one run command. State of pool is stored
+    in directory (one json file per container), so that it is shared by all tests of job.
+    Container is claimed by atomic rename of its file, pool is refilled in background thread and
+    used containers are removed in background process.
+    """
+    logger = logging.getLogger("ContainerPool")
+
+    def __init__(self, image, runspec, run, is_running, remove, size=1, basedir=DOCKER_POOL_BASEDIR):
+        """
+
+        :param image: str - image of containers
+        :param runspec: str - run command with arguments, there is one pool per image and runspec
+        :param run: function() - starts container, returns its ID
+        :param is_running: function(container_id) - returns bool
+        :param remove: function(container_id) - removes container, used when removal in background fails
+        :param size: int - number of containers to keep running
+        :param basedir: directory with pools
+        """
+        self.image = image
+        self.run = run
+        self.is_running = is_running
+        self.remove = remove
+        self.size = size
+        poolkey = hashlib.md5("%s %s" % (image, runspec)).hexdigest()[:8]
+        self.pooldir = os.path.join(basedir, "%s_%s" % (re.sub("[^a-zA-Z0-9_.-]", "_", image), poolkey))
+        for directory in [self.pooldir, self.__freedir(), self.__claimeddir()]:
+            private_dir(directory)
+        self.__refill_thread = None
+
+    def __freedir(self):
+        return os.path.join(self.pooldir, "free")
+
+    def __claimeddir(self):
+        return os.path.join(self.pooldir, "claimed")
+
+    def __members(self):
+        """
+        Internal method
+        list of json files of free containers, oldest first
+
+        :return: list
+        """
+        return sorted(glob.glob(os.path.join(self.__freedir(), "*.json")), key=os.path.getmtime)
+
+    def __add_member(self, container_id):
+        memberpath = os.path.join(self.__freedir(), "%s.json" % container_id)
+        with open_private(memberpath + ".tmp", "w") as memberfile:
+            json.dump({"id": container_id, "image": self.image}, memberfile)
+        os.rename(memberpath + ".tmp", memberpath)
+
+    def fill(self):
+        """
+        Start containers to have pool of required size
+
+        :return: None
+        """
+        with open_private(os.path.join(self.pooldir, ".filllock"), "w") as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            for foo in range(self.size - len(self.__members())):
+                self.__add_member(self.run())
+
+    def fill_background(self):
+        """
+        Call fill in background thread, use wait_fill to wait for it
+
+        :return: None
+        """
+        self.__refill_thread = threading.Thread(target=self.fill)
+        self.__refill_thread.daemon = True
+        self.__refill_thread.start()
+
+    def wait_fill(self):
+        if self.__refill_thread:
+            self.__refill_thread.join()
+            self.__refill_thread = None
+
+    def claim(self):
+        """
+        Return ID of running container from pool and start refilling of pool in background
+
+        :return: str
+        """
+        for foo in range(DEFAULT_RETRYTIMEOUT):
+            members = self.__members()
+            if not members:
+                self.logger.debug("Pool %s is empty" % self.pooldir)
+                self.fill()
+                continue
+            claimedpath = os.path.join(self.__claimeddir(), os.path.basename(members[0]))
+            try:
+                os.rename(members[0], claimedpath)
+            except OSError:
+                # other process was faster
+                continue
+            with open_private(claimedpath) as memberfile:
+                container_id = json.load(memberfile)["id"]
+            os.remove(claimedpath)
+            if not self.is_running(container_id):
+                self.logger.info("Pooled container %s is not running, removing" % container_id)
+                self.dispose(container_id)
+                continue
+            self.logger.debug("Pooled container claimed: %s" % container_id)
+            self.fill_background()
+            return container_id
+        raise mtfexceptions.ContainerExc("Unable to get running container from pool %s" % self.pooldir)
+
+    def dispose(self, container_id):
+        """
+        Remove container in background process
+
+        :param container_id: str
+        :return: None
+        """
+        try:
+            docker_cli_remove_background(container_id)
+        except OSError as e:
+            self.logger.debug("Unable to remove container in background (%s), removing it now" % e)
+            self.remove(container_id)
+
+    def release(self, container_id, reusable=False):
+        """
+        Return container used by test, it is removed in background or returned to pool
+
+        :param container_id: str
+        :param reusable: bool - test did not change container, it can be used by other test
+        :return: None
+        """
+        if reusable and self.is_running(container_id):
+            self.__add_member(container_id)
+        else:
+            self.dispose(container_id)
+
+
+class PreparedImages(object):
+    """
+    Images committed from containers prepared by expensive setup. Image is identified by digest of
+    base image and setup steps, it is created by first test and later tests start from it.
+    Images are tracked in directory (one json file per image), so that they are removed at the end of job.
+    """
+    logger = logging.getLogger("PreparedImages")
+
+    def __init__(self, inspect, commit, basedir=DOCKER_PREPARED_BASEDIR, repository=PREPARED_REPOSITORY):
+        """
+
+        :param inspect: function(image) - returns dict of docker inspect or None when image does not exist
+        :param commit: function(container_id, repository, tag) - commits container to image
+        :param basedir: directory with records of images
+        :param repository: str - repository of images, tag is digest
+        """
+        self.inspect = inspect
+        self.commit_container = commit
+        self.basedir = basedir
+        self.repository = repository
+        private_dir(self.basedir)
+
+    def image_name(self, digest):
+        return "%s:%s" % (self.repository, digest[:32])
+
+    def lock(self, digest):
+        """
+        Return locked file, other processes wait for preparation of same image until it is closed
+
+        :param digest: str
+        :return: file object
+        """
+        lockfile = open_private(os.path.join(self.basedir, "%s.lock" % digest[:32]), "w")
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+        return lockfile
+
+    def find(self, digest):
+        """
+        Return name of prepared image
+
+        :param digest: str
+        :return: str or None in case image was not prepared yet
+        """
+        image = self.image_name(digest)
+        if os.path.exists(os.path.join(self.basedir, "%s.json" % digest[:32])) and self.inspect(image):
+            return image
+        return None
+
+    def commit(self, container_id, digest):
+        """
+        Commit prepared container to image
+
+        :param container_id: str
+        :param digest: str
+        :return: str - name of image
+        """
+        image = self.image_name(digest)
+        self.commit_container(container_id, *image.split(":"))
+        with open_private(os.path.join(self.basedir, "%s.json" % digest[:32]), "w") as record:
+            json.dump({"image": image, "container": container_id}, record)
+        self.logger.debug("Prepared container %s committed as %s" % (container_id, image))
+        return image
+
+
+def drain_prepared_images(remove_image=docker_cli_remove_image, basedir=DOCKER_PREPARED_BASEDIR, job_name=None):
+    """
+    Remove prepared images, it is called at the end of job
+
+    :param remove_image: function(image) - removes image
+    :param basedir: directory with directories of jobs, there are records of images
+    :param job_name: str - images of this job are removed, images of all jobs when it is None
+    :return: None
+    """
+    for recordpath in glob.glob(os.path.join(basedir, job_name or "*", "*.json")):
+        with open_private(recordpath.replace(".json", ".lock"), "w") as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                with open_private(recordpath) as record:
+                    remove_image(json.load(record)["image"])
+                os.remove(recordpath)
+            except (IOError, OSError, ValueError):
+                # removed by other process
+                pass
+    if job_name:
+        shutil.rmtree(os.path.join(basedir, job_name), ignore_errors=True)
+
+
+def drain_container_pools(remove=docker_cli_remove, basedir=DOCKER_POOL_BASEDIR, job_name=None):
+    """
+    Remove free containers of all pools, it is called at the end of job
+
+    :param remove: function(container_id) - removes container
+    :param basedir: directory with directories of jobs, there are pools
+    :param job_name: str - pools of this job are drained, pools of all jobs when it is None
+    :return: None
+    """
+    for memberpath in glob.glob(os.path.join(basedir, job_name or "*", "*", "free", "*.json")):
+        claimedpath = os.path.join(os.path.dirname(os.path.dirname(memberpath)), "claimed",
+                                   os.path.basename(memberpath))
+        try:
+            os.rename(memberpath, claimedpath)
+        except OSError:
+            continue
+        with open_private(claimedpath) as memberfile:
+            remove(json.load(memberfile)["id"])
+        os.remove(claimedpath)
+    if job_name:
+        shutil.rmtree(os.path.join(basedir, job_name), ignore_errors=True)
+
+
+class CommandEventStream(object):
+    """
+    Events (one per line) read from output of command running on background
+    """
+
+    def __init__(self, command):
+        with open(os.devnull, "w") as devnull:
+            self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=devnull, close_fds=True)
+
+    def __iter__(self):
+        for line in iter(self.process.stdout.readline, ""):
+            yield line.strip()
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+
+
+class APIEventStream(object):
+    """
+    Events read from streamed response of events endpoint, every event is JSON on own line
+    """
+
+    def __init__(self, connection, response):
+        self.connection = connection
+        self.response = response
+
+    def lines(self):
+        """
+        Return lines of response body, chunked transfer encoding is decoded as chunks arrive
+
+        :return: generator of str
+        """
+        stream = self.response.fp
+        if not self.response.chunked:
+            for line in iter(stream.readline, ""):
+                yield line
+            return
+        buffered = ""
+        while True:
+            size = stream.readline().split(";")[0].strip()
+            if not size or not int(size, 16):
+                return
+            buffered += stream.read(int(size, 16))
+            stream.read(2)
+            while "\n" in buffered:
+                line, buffered = buffered.split("\n", 1)
+                yield line
+
+    def __iter__(self):
+        for line in self.lines():
+            if line.strip():
+                event = json.loads(line)
+                yield event.get("status") or event.get("Action")
+
+    def close(self):
+        try:
+            # wakes up reader blocked in other thread
+            self.connection.sock.shutdown(socket.SHUT_RDWR)
+        except (socket.error, AttributeError):
+            pass
+        self.connection.close()
+
+
+class ContainerState(object):
+    """
+    Running state of one container. It is updated by thread following events of the container,
+    so that checking of state does not call docker. Container is inspected only when events are not available.
+    """
+    logger = logging.getLogger("ContainerState")
+
+    def __init__(self, container_id, inspect, events):
+        """
+
+        :param container_id: str
+        :param inspect: function(container_id) - returns running state of container (bool)
+        :param events: function(container_id, since) - returns stream of event names with close method
+        """
+        self.container_id = container_id
+        self.__inspect = inspect
+        self.__destroyed = False
+        self.__thread = None
+        # events since subscription are replayed, so that change between subscription and inspect is not lost
+        since = "%.6f" % time.time()
+        try:
+            self.__events = events(container_id, since)
+        except (mtfexceptions.ContainerExc, socket.error, OSError) as e:
+            self.logger.debug("Events of container %s are not available: %s" % (container_id, e))
+            self.__events = None
+        self.__running = inspect(container_id)
+        if self.__events:
+            self.__thread = threading.Thread(target=self.__follow)
+            self.__thread.daemon = True
+            self.__thread.start()
+
+    def __follow(self):
+        try:
+            for event in self.__events:
+                self.logger.debug("Container %s event: %s" % (self.container_id, event))
+                if event in EVENTS_RUNNING:
+                    self.__running = True
+                elif event in EVENTS_STOPPED:
+                    self.__running = False
+                if event == "destroy":
+                    self.__destroyed = True
+                    break
+        except (socket.error, httplib.HTTPException, ValueError, IOError, AttributeError) as e:
+            # AttributeError is raised by socket file closed by close() in other thread
+            self.logger.debug("Events of container %s are not followed anymore: %s" % (self.container_id, e))
+        finally:
+            self.__events.close()
+
+    def is_running(self):
+        """
+        Return running state of container
+
+        :return: bool
+        """
+        if self.__destroyed:
+            return False
+        if self.__thread and self.__thread.is_alive():
+            return self.__running
+        self.__running = self.__inspect(self.container_id)
+        return self.__running
+
+    def refresh(self):
+        """
+        Inspect container again, it is used when command in container failed,
+        so that state does not wait for delayed (or lost) event
+
+        :return: bool - running state
+        """
+        if not self.__destroyed:
+            self.__running = self.__inspect(self.container_id)
+        return self.__running
+
+    def close(self):
+        """
+        Stop following of events
+
+        :return: None
+        """
+        if self.__events:
+            self.__events.close()
+        if self.__thread:
+            self.__thread.join()
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    """
+    HTTP connection via unix socket
+    """
+
+    def __init__(self, socket_path, timeout=None):
+        httplib.HTTPConnection.__init__(self, "localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class DockerAPI(object):
+    """
+    Client of Docker Engine API, methods are counterparts of docker CLI commands used by MTF
+    """
+    logger = logging.getLogger("DockerAPI")
+
+    def __init__(self, socket_path=DEFAULT_DOCKER_SOCKET, timeout=DEFAULT_API_TIMEOUT):
+        """
+
+        :param socket_path: str - path to unix socket of daemon
+        :param timeout: int - timeout of one API call in seconds
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.__connection = None
+
+    def __url(self, path, query=None):
+        url = "/%s%s" % (DOCKER_API_VERSION, path)
+        if query:
+            url += "?" + urllib.urlencode(query)
+        return url
+
+    def __send(self, connection, method, path, query, body, headers):
+        """
+        Internal method
+        send request and return response what is not read yet
+
+        :return: httplib.HTTPResponse
+        """
+        headers = dict(headers or {})
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        connection.request(method, self.__url(path, query), body=body, headers=headers)
+        return connection.getresponse()
+
+    def __check(self, method, path, response, data, expected):
+        if response.status not in expected:
+            try:
+                message = json.loads(data).get("message", data)
+            except ValueError:
+                message = data
+            raise mtfexceptions.DockerAPIExc(response.status, "Docker API %s %s failed (%s): %s" %
+                                             (method, path, response.status, message))
+
+    def call(self, method, path, query=None, body=None, headers=None, expected=(200, 201, 204), raw=False):
+        """
+        Call API via persistent connection, connection is opened again when daemon closed it
+
+        :param method: str - HTTP method
+        :param path: str - path without API version
+        :param query: dict - query parameters
+        :param body: dict/list (sent as JSON), str or file object
+        :param headers: dict
+        :param expected: tuple of expected HTTP statuses
+        :param raw: bool - return tuple (body, response) instead of decoded JSON
+        :return: decoded JSON or tuple (str, httplib.HTTPResponse)
+        """
+        with self.lock:
+            reused = self.__connection is not None
+            if not reused:
+                self.__connection = UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+            try:
+                response = self.__send(self.__connection, method, path, query, body, headers)
+                data = response.read()
+            except (socket.error, httplib.HTTPException):
+                self.__connection.close()
+                self.__connection = None
+                # connection closed by daemon after idle time, try it once again with new connection
+                if not reused or hasattr(body, "read"):
+                    raise
+                self.__connection = UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+                response = self.__send(self.__connection, method, path, query, body, headers)
+                data = response.read()
+            if response.will_close:
+                self.__connection.close()
+                self.__connection = None
+        self.__check(method, path, response, data, expected)
+        if raw:
+            return data, response
+        if data and "json" in (response.getheader("Content-Type") or ""):
+            return json.loads(data)
+        return data
+
+    def close(self):
+        with self.lock:
+            if self.__connection:
+                self.__connection.close()
+                self.__connection = None
+
+    def ping(self):
+        """
+        Check if daemon responds
+
+        :return: bool
+        """
+        return self.call("GET", "/_ping") == "OK"
+
+    def pull(self, image):
+        """
+        Pull image from registry, it is same as docker pull. Credentials of registry are sent
+        in case they are stored in docker config, docker pull is used when registry refuses
+        access (credentials could be provided by credential helper of docker CLI)
+
+        :param image: str - image name, optionally with tag or digest
+        :return: None
+        """
+        repository, tag = image, None
+        if "@" not in image and ":" in image.rsplit("/", 1)[-1]:
+            repository, tag = image.rsplit(":", 1)
+        query = {"fromImage": repository}
+        if tag:
+            query["tag"] = tag
+        auth = registry_auth(parse_reference(image)[0])
+        self.logger.debug("Pull image: %s" % image)
+        try:
+            progress = self.call("POST", "/images/create", query=query, raw=True,
+                                 headers={"X-Registry-Auth": auth} if auth else None)[0]
+        except mtfexceptions.DockerAPIExc as e:
+            if e.status not in (401, 404):
+                raise
+            self.logger.debug("Pull of %s via API refused (%s), using docker pull" % (image, e.status))
+            docker_cli_pull(image)
+            return
+        # errors of pull are reported in stream of progress messages and HTTP status is 200
+        for line in progress.splitlines():
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            if message.get("error"):
+                raise mtfexceptions.ContainerExc("Unable to pull image %s: %s" % (image, message["error"]))
+
+    def import_image(self, tarball, repository):
+        """
+        Import image from tarball, it is same as docker import
+
+        :param tarball: str - path or URL of tarball, URL is downloaded by daemon
+        :param repository: str - name of imported image
+        :return: None
+        """
+        if "://" in tarball:
+            self.call("POST", "/images/create", query={"fromSrc": tarball, "repo": repository})
+            return
+        with open(tarball, "rb") as content:
+            self.call("POST", "/images/create", query={"fromSrc": "-", "repo": repository}, body=content,
+                      headers={"Content-Type": "application/x-tar",
+                               "Content-Length": str(os.path.getsize(tarball))})
+
+    def inspect_image(self, image):
+        """
+        Return dict what is same as docker inspect of image
+
+        :param image: str
+        :return: dict
+        """
+        return self.call("GET", "/images/%s/json" % image)
+
+    def find_image(self, image):
+        """
+        Return dict what is same as docker inspect of image
+
+        :param image: str
+        :return: dict or None in case image does not exist
+        """
+        try:
+            return self.call("GET", "/images/%s/json" % image, expected=(200,))
+        except mtfexceptions.DockerAPIExc as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def run(self, image, command=None, name=None, tty=True, interactive=True, labels=None):
+        """
+        Create and start container, it is same as docker run -d
+
+        :param image: str
+        :param command: list - command with arguments, default command of image is used when not set
+        :param name: str - name of container
+        :param tty: bool - allocate pseudo tty (-t)
+        :param interactive: bool - keep stdin open (-i)
+        :param labels: dict - labels of container (--label)
+        :return: str - ID of container
+        """
+        config = {"Image": image, "Tty": tty, "OpenStdin": interactive}
+        if command:
+            config["Cmd"] = command
+        if labels:
+            config["Labels"] = labels
+        created = self.call("POST", "/containers/create", query={"name": name} if name else None, body=config)
+        self.call("POST", "/containers/%s/start" % created["Id"], expected=(204, 304))
+        return created["Id"]
+
+    def inspect_container(self, container_id):
+        """
+        Return dict what is same as docker inspect of container
+
+        :param container_id: str
+        :return: dict or None in case container does not exist
+        """
+        try:
+            return self.call("GET", "/containers/%s/json" % container_id, expected=(200,))
+        except mtfexceptions.DockerAPIExc as e:
+            if e.status == 404:
+                return None
+            raise
+
+    def is_running(self, container_id):
+        """
+        Check if container is running
+
+        :param container_id: str
+        :return: bool
+        """
+        info = self.inspect_container(container_id)
+        return bool(info and info.get("State", {}).get("Running"))
+
+    def find_running(self, name):
+        """
+        Return ID of running container with name, counterpart of docker ps -q --filter name=
+
+        :param name: str
+        :return: str or None
+        """
+        containers = self.call("GET", "/containers/json",
+                               query={"filters": json.dumps({"name": ["^/%s$" % name]})})
+        return containers[0]["Id"] if containers else None
+
+    def execute(self, container_id, command, timeout=None, ignore_status=False, **kwargs):
+        """
+        Run command inside container via bash, counterpart of docker exec.
+        Daemon takes connection of exec over (it is closed when command ends), so that there is own connection
+
+        :param container_id: str
+        :param command: str
+        :param timeout: int - timeout of command in seconds
+        :param ignore_status: bool - do not raise exception in case of non zero exit code
+        :param kwargs: rest of avocado.process.run params, ignored
+        :return: avocado.process.CmdResult
+        """
+        start_time = time.time()
+        created = self.call("POST", "/containers/%s/exec" % container_id,
+                            body={"AttachStdout": True, "AttachStderr": True, "Tty": False,
+                                  "Cmd": ["bash", "-c", command]})
+        connection = UnixHTTPConnection(self.socket_path, timeout=timeout or self.timeout)
+        try:
+            response = self.__send(connection, "POST", "/exec/%s/start" % created["Id"], None,
+                                   {"Detach": False, "Tty": False}, None)
+            data = response.read()
+        except socket.timeout:
+            raise mtfexceptions.ContainerExc("Command in container %s timed out after %ss: %s" %
+                                             (container_id, timeout, command))
+        finally:
+            connection.close()
+        self.__check("POST", "/exec/start", response, data, (200,))
+        stdout, stderr = demultiplex(data)
+        exit_status = self.call("GET", "/exec/%s/json" % created["Id"]).get("ExitCode")
+        comout = process.CmdResult(command=command, stdout=stdout, stderr=stderr,
+                                   exit_status=exit_status, duration=time.time() - start_time)
+        self.logger.debug(comout)
+        if exit_status != 0 and not ignore_status:
+            raise process.CmdError(command, comout)
+        return comout
+
+    def path_stat(self, container_id, path):
+        """
+        Return stat of path inside container
+
+        :param container_id: str
+        :param path: str
+        :return: dict (name, size, mode, mtime, linkTarget) or None in case path does not exist
+        """
+        data, response = self.call("HEAD", "/containers/%s/archive" % container_id, query={"path": path},
+                                   expected=(200, 404), raw=True)
+        header = response.getheader("X-Docker-Container-Path-Stat")
+        if response.status == 404 or not header:
+            return None
+        return json.loads(base64.b64decode(header))
+
+    def copy_to(self, container_id, src, dest):
+        """
+        Copy file or directory from host to container via archive endpoint, counterpart of docker cp
+
+        :param container_id: str
+        :param src: str - path on host
+        :param dest: str - path inside container, src is copied into it when it is existing directory
+        :return: None
+        """
+        stat = self.path_stat(container_id, dest)
+        if stat and stat["mode"] & GO_MODE_DIR:
+            target, arcname = dest, os.path.basename(src.rstrip("/"))
+        else:
+            target, arcname = os.path.dirname(dest.rstrip("/")) or "/", os.path.basename(dest.rstrip("/"))
+        with tempfile.TemporaryFile() as archive:
+            with tarfile.open(fileobj=archive, mode="w") as tar:
+                tar.add(src, arcname=arcname)
+            size = archive.tell()
+            archive.seek(0)
+            self.call("PUT", "/containers/%s/archive" % container_id, query={"path": target}, body=archive,
+                      headers={"Content-Type": "application/x-tar", "Content-Length": str(size)},
+                      expected=(200,))
+
+    def copy_from(self, container_id, src, dest):
+        """
+        Copy file or directory from container to host via archive endpoint, counterpart of docker cp
+
+        :param container_id: str
+        :param src: str - path inside container
+        :param dest: str - path on host, src is copied into it when it is existing directory
+        :return: None
+        """
+        data = self.call("GET", "/containers/%s/archive" % container_id, query={"path": src},
+                         expected=(200,), raw=True)[0]
+        with tarfile.open(fileobj=io.BytesIO(data), mode="r") as tar:
+            if os.path.isdir(dest):
+                tar.extractall(dest)
+                return
+            # archive contains basename of src, it has to be renamed to dest
+            tmpdir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(dest)))
+            try:
+                tar.extractall(tmpdir)
+                os.rename(os.path.join(tmpdir, os.path.basename(src.rstrip("/"))), dest)
+            finally:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def stop(self, container_id, timeout=10):
+        """
+        Stop container, counterpart of docker stop
+
+        :param container_id: str
+        :param timeout: int - seconds to wait before container is killed
+        :return: None
+        """
+        self.call("POST", "/containers/%s/stop" % container_id, query={"t": timeout}, expected=(204, 304))
+
+    def events(self, container_id, since):
+        """
+        Return stream of events of container, counterpart of docker events.
+        Stream is read from own connection, it is kept open until stream is closed
+
+        :param container_id: str
+        :param since: str - unix timestamp, events since this time are replayed
+        :return: APIEventStream
+        """
+        connection = UnixHTTPConnection(self.socket_path)
+        query = {"since": since, "filters": json.dumps({"container": [container_id], "type": ["container"]})}
+        try:
+            response = self.__send(connection, "GET", "/events", query, None, None)
+        except (socket.error, httplib.HTTPException):
+            connection.close()
+            raise
+        if response.status != 200:
+            data = response.read()
+            connection.close()
+            self.__check("GET", "/events", response, data, (200,))
+        return APIEventStream(connection, response)
+
+    def commit(self, container_id, repository, tag):
+        """
+        Create image from container, counterpart of docker commit
+
+        :param container_id: str
+        :param repository: str
+        :param tag: str
+        :return: None
+        """
+        self.call("POST", "/commit", query={"container": container_id, "repo": repository, "tag": tag})
+
+    def remove_image(self, image):
+        """
+        Remove image, counterpart of docker rmi -f
+
+        :param image: str
+        :return: None
+        """
+        self.call("DELETE", "/images/%s" % image, query={"force": 1}, expected=(200, 404))
+
+    def remove(self, container_id):
+        """
+        Remove container with its volumes, counterpart of docker rm -f -v
+
+        :param container_id: str
+        :return: None
+        """
+        self.call("DELETE", "/containers/%s" % container_id, query={"force": 1, "v": 1}, expected=(204, 404))
+
+
+# ====================== Self Tests ======================
+
+class FakeDockerHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Stand-in of docker daemon, it implements just calls used by testDockerAPI
+    """
+    protocol_version = "HTTP/1.1"
+
+    def address_string(self):
+        return "unix"
+
+    def log_message(self, *args):
+        pass
+
+    def __reply(self, status, body="", content_type="application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def __body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_GET(self):
+        self.server.connections.add(self.connection)
+        path = self.path.split("?")[0]
+        if path.endswith("/_ping"):
+            self.__reply(200, "OK", "text/plain")
+        elif path.endswith("/events"):
+            # chunked stream, events are sent by test via server.events queue
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            self.wfile.flush()
+            while True:
+                event = self.server.events.get()
+                if event is None:
+                    self.wfile.write("0\r\n\r\n")
+                    break
+                chunk = json.dumps({"status": event, "id": "c1"}) + "\n"
+                self.wfile.write("%x\r\n%s\r\n" % (len(chunk), chunk))
+                self.wfile.flush()
+            self.close_connection = 1
+        elif path.endswith("/containers/c1/json"):
+            self.server.inspected += 1
+            self.__reply(200, json.dumps({"State": {"Running": True}}))
+        elif path.endswith("/exec/e1/json"):
+            self.__reply(200, json.dumps({"ExitCode": 3}))
+        elif path.endswith("/containers/c1/archive"):
+            self.__reply(200, self.server.archive, "application/x-tar")
+        else:
+            self.__reply(404, json.dumps({"message": "no such object"}))
+
+    def do_HEAD(self):
+        stat = base64.b64encode(json.dumps({"name": "tmp", "mode": GO_MODE_DIR | 0o755}))
+        self.__reply(200, headers={"X-Docker-Container-Path-Stat": stat})
+
+    def do_PUT(self):
+        self.server.archive = self.__body()
+        self.__reply(200)
+
+    def do_POST(self):
+        body = self.__body()
+        if self.path.endswith("/containers/c1/exec"):
+            self.server.exec_command = json.loads(body)["Cmd"]
+            self.__reply(201, json.dumps({"Id": "e1"}))
+        elif self.path.endswith("/exec/e1/start"):
+            # hijacked connection: raw multiplexed stream without length, closed at the end
+            self.send_response(200)
+            self.send_header("Content-Type", "application/vnd.docker.raw-stream")
+            self.end_headers()
+            for stream, chunk in [(STREAM_STDOUT, "out1\n"), (STREAM_STDERR, "err\n"), (STREAM_STDOUT, "out2\n")]:
+                self.wfile.write(STREAM_HEADER.pack(stream, len(chunk)) + chunk)
+            self.close_connection = 1
+        elif "/images/create?" in self.path:
+            query = dict(urlparse.parse_qsl(self.path.split("?", 1)[1]))
+            self.server.pulls.append((query["fromImage"], self.headers.get("X-Registry-Auth")))
+            if query["fromImage"].startswith("private/"):
+                self.__reply(404, json.dumps({"message": "pull access denied for %s" % query["fromImage"]}))
+            else:
+                self.__reply(200, json.dumps({"status": "Downloaded newer image"}) + "\n")
+        else:
+            self.__reply(404, json.dumps({"message": "no such object"}))
+
+
+class QuietFileHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    """
+    Server of files in current directory used for tarballs on URL
+    """
+    def log_message(self, *args):
+        pass
+
+
+class FakeDockerServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path):
+        SocketServer.UnixStreamServer.__init__(self, socket_path, FakeDockerHandler)
+        self.connections = set()
+        self.archive = ""
+        self.exec_command = None
+        self.events = Queue.Queue()
+        self.inspected = 0
+        self.pulls = []
+
+
+class testDockerAPI(Test):
+    """
+    Test DockerAPI client against stand-in server on local unix socket
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.server = FakeDockerServer(os.path.join(self.tmpdir, "docker.sock"))
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.api = DockerAPI(os.path.join(self.tmpdir, "docker.sock"))
+
+    def test_connection_reuse(self):
+        for _ in range(10):
+            assert self.api.ping()
+        assert self.api.inspect_container("missing") is None
+        assert len(self.server.connections) == 1
+
+    def test_exec(self):
+        result = self.api.execute("c1", "echo out", ignore_status=True)
+        assert self.server.exec_command == ["bash", "-c", "echo out"]
+        assert result.stdout == "out1\nout2\n"
+        assert result.stderr == "err\n"
+        assert result.exit_status == 3
+        self.assertRaises(process.CmdError, self.api.execute, "c1", "echo out")
+
+    def test_copy(self):
+        src = os.path.join(self.tmpdir, "file")
+        with open(src, "w") as content:
+            content.write("content")
+        self.api.copy_to("c1", src, "/tmp")
+        with tarfile.open(fileobj=io.BytesIO(self.server.archive)) as tar:
+            assert tar.getnames() == ["file"]
+        self.api.copy_from("c1", "/tmp/file", os.path.join(self.tmpdir, "back"))
+        with open(os.path.join(self.tmpdir, "back")) as content:
+            assert content.read() == "content"
+
+    def test_pull_auth(self):
+        with open(os.path.join(self.tmpdir, "config.json"), "w") as config:
+            json.dump({"auths": {"https://index.docker.io/v1/": {"auth": base64.b64encode("user:secret")}},
+                       "credsStore": "secretservice"}, config)
+        with open(os.path.join(self.tmpdir, "docker"), "w") as cli:
+            cli.write("#!/bin/sh\necho \"$@\" >> %s\n" % os.path.join(self.tmpdir, "cli.log"))
+        os.chmod(os.path.join(self.tmpdir, "docker"), 0o755)
+        environ = dict(os.environ)
+        os.environ["DOCKER_CONFIG"] = self.tmpdir
+        os.environ["PATH"] = "%s:%s" % (self.tmpdir, os.environ.get("PATH", ""))
+        try:
+            self.api.pull("fedora:26")
+            self.api.pull("quay.io/user/image")
+            # registry refuses access, credential helper of docker CLI can provide credentials
+            self.api.pull("private/image:1")
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+        auth = json.loads(base64.urlsafe_b64decode(self.server.pulls[0][1]))
+        assert (auth["username"], auth["password"]) == ("user", "secret")
+        assert self.server.pulls[1] == ("quay.io/user/image", None)
+        with open(os.path.join(self.tmpdir, "cli.log")) as log:
+            assert log.read() == "pull private/image:1\n"
+        try:
+            self.api.inspect_image("missing")
+        except mtfexceptions.DockerAPIExc as e:
+            assert e.status == 404
+        else:
+            assert False
+
+    def test_container_state(self):
+        state = ContainerState("c1", self.api.is_running, self.api.events)
+        assert self.server.inspected == 1
+        for _ in range(100):
+            assert state.is_running()
+        assert self.server.inspected == 1
+        # failed command inspects container again
+        assert state.refresh()
+        assert self.server.inspected == 2
+        for event, running in [("die", False), ("start", True), ("destroy", False)]:
+            self.server.events.put(event)
+            for _ in range(50):
+                if state.is_running() == running:
+                    break
+                time.sleep(0.1)
+            assert state.is_running() == running
+        state.close()
+        assert not state.is_running() and not state.refresh()
+        assert self.server.inspected == 2
+
+    def test_image_cache(self):
+        images = {}
+        imported = []
+
+        def import_image(tarball, repository):
+            imported.append(tarball)
+            images[repository] = {"Id": "sha256:%s" % file_checksum(tarball), "Config": {}}
+
+        tarball = os.path.join(self.tmpdir, "image.tar")
+        with open(tarball, "w") as content:
+            content.write("image")
+        cache = ImageDigestCache(inspect=images.get, pull=None, import_image=import_image,
+                                 basedir=os.path.join(self.tmpdir, "images"))
+        reference = cache.tarball_reference(tarball)
+        for _ in range(3):
+            assert cache.get_image(reference, tarball=tarball)["Id"] == images[reference]["Id"]
+        assert len(imported) == 1
+        with open(tarball, "a") as content:
+            content.write("changed")
+        assert cache.tarball_reference(tarball) != reference
+        cache.get_image(cache.tarball_reference(tarball), tarball=tarball)
+        assert len(imported) == 2
+        assert images[reference]["Id"] != images[cache.tarball_reference(tarball)]["Id"]
+
+    def test_image_cache_url(self):
+        imported = []
+
+        def import_image(tarball, repository):
+            imported.append(tarball)
+            images[repository] = {"Id": "sha256:%d" % len(imported), "Config": {}}
+
+        images = {}
+        with open(os.path.join(self.tmpdir, "image.tar"), "w") as content:
+            content.write("image")
+        # file server sends Last-Modified and Content-Length
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        server = SocketServer.TCPServer(("127.0.0.1", 0), QuietFileHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            url = "http://127.0.0.1:%d/image.tar" % server.server_address[1]
+            cache = ImageDigestCache(inspect=images.get, pull=None, import_image=import_image,
+                                     basedir=os.path.join(self.tmpdir, "images"))
+            reference = cache.tarball_reference(url)
+            for _ in range(3):
+                cache.get_image(reference, tarball=url)
+            assert imported == [url]
+            with open(os.path.join(self.tmpdir, "image.tar"), "a") as content:
+                content.write("changed")
+            assert cache.tarball_reference(url) != reference
+            cache.get_image(cache.tarball_reference(url), tarball=url)
+            assert len(imported) == 2
+        finally:
+            server.shutdown()
+            server.server_close()
+            os.chdir(cwd)
+        # version of unreachable tarball is not known, it is imported every time
+        url = "http://127.0.0.1:%d/image.tar" % server.server_address[1]
+        for _ in range(2):
+            cache.get_image(cache.tarball_reference(url), tarball=url)
+        assert len(imported) == 4
+
+    def test_container_pool(self):
+        started = []
+        removed = []
+
+        def run():
+            started.append("c%d" % len(started))
+            return started[-1]
+
+        pool = ContainerPool(image="fedora", runspec="docker run -it -d /bin/bash", run=run,
+                             is_running=lambda x: x not in removed, remove=removed.append, size=1,
+                             basedir=os.path.join(self.tmpdir, "pool", "job1"))
+        pool.fill()
+        assert started == ["c0"]
+        first = pool.claim()
+        pool.wait_fill()
+        assert started == ["c0", "c1"]
+        pool.release(first, reusable=True)
+        assert pool.claim() == "c1"
+        pool.wait_fill()
+        # reusable container is used again, so that there is no new one
+        assert pool.claim() == "c0"
+        pool.wait_fill()
+        assert started == ["c0", "c1", "c2"]
+        drain_container_pools(remove=removed.append, basedir=os.path.join(self.tmpdir, "pool"), job_name="job1")
+        assert removed == ["c2"]
+
+    def test_parallel_jobs(self):
+        """
+        Jobs running at once use own pools and prepared images, end of one job does not remove
+        containers and images of others
+        """
+        removed = []
+        images = {}
+        errors = []
+
+        def job(name):
+            try:
+                started = []
+
+                def run():
+                    started.append("%s-c%d" % (name, len(started)))
+                    return started[-1]
+
+                pool = ContainerPool(image="fedora", runspec="docker run -it -d /bin/bash", run=run,
+                                     is_running=lambda x: x not in removed, remove=removed.append, size=2,
+                                     basedir=os.path.join(self.tmpdir, "pool", name))
+                prepared = PreparedImages(inspect=images.get,
+                                          commit=lambda container, repo, tag: images.update(
+                                              {"%s:%s" % (repo, tag): {"Id": container}}),
+                                          basedir=os.path.join(self.tmpdir, "prepared", name),
+                                          repository="%s-prepared" % name)
+                digest = hashlib.sha256("same setup steps").hexdigest()
+                for _ in range(5):
+                    container_id = pool.claim()
+                    assert container_id.startswith(name)
+                    with prepared.lock(digest):
+                        if not prepared.find(digest):
+                            prepared.commit(container_id, digest)
+                    pool.wait_fill()
+                    pool.release(container_id, reusable=True)
+                assert prepared.find(digest).startswith(name)
+                drain_container_pools(remove=removed.append, basedir=os.path.join(self.tmpdir, "pool"),
+                                      job_name=name)
+                drain_prepared_images(remove_image=images.pop, basedir=os.path.join(self.tmpdir, "prepared"),
+                                      job_name=name)
+                assert set(started) <= set(removed)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=job, args=("job%d" % number,)) for number in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not errors, errors
+        assert not images
+        assert not os.listdir(os.path.join(self.tmpdir, "pool"))
+
+    def test_prepared_images(self):
+        images = {}
+        prepared = PreparedImages(inspect=images.get,
+                                  commit=lambda container, repo, tag: images.update({"%s:%s" % (repo, tag): {"Id": container}}),
+                                  basedir=os.path.join(self.tmpdir, "prepared", "job1"))
+        digest = hashlib.sha256("setup steps").hexdigest()
+        with prepared.lock(digest):
+            assert prepared.find(digest) is None
+            image = prepared.commit("c1", digest)
+        with prepared.lock(digest):
+            assert prepared.find(digest) == image
+        drain_prepared_images(remove_image=images.pop, basedir=os.path.join(self.tmpdir, "prepared"), job_name="job1")
+        assert not images
+        assert prepared.find(digest) is None
+        # directory pre-created by other user or symlink is refused
+        os.makedirs(os.path.join(self.tmpdir, "shared"), 0o777)
+        os.chmod(os.path.join(self.tmpdir, "shared"), 0o777)
+        os.symlink(os.path.join(self.tmpdir, "shared"), os.path.join(self.tmpdir, "link"))
+        for basedir in ["shared", "link"]:
+            self.assertRaises(OSError, PreparedImages, inspect=images.get, commit=None,
+                              basedir=os.path.join(self.tmpdir, basedir))
+
+    def tearDown(self):
+        self.server.events.put(None)
+        self.api.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
@@ -30,6 +30,19 @@ import shutil
 import glob
 import time
 import re
+import socket
+import tempfile
+import select
+import subprocess
+import threading
+import json
+import hashlib
+import fcntl
+import urllib2
+import ctypes
+import ctypes.util
+import sys
+import signal
 
 from avocado import Test
 from avocado.utils import process
@@ -38,12 +51,191 @@ from mtf import mtfexceptions
 
 DEFAULT_RETRYTIMEOUT = 30
 DEFAULT_SLEEP = 1
+DEFAULT_BOOT_TARGET = "multi-user.target"
+DEFAULT_GUEST_PATH = "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"
+# snapshot methods in order of preference, copy is always possible
+SNAPSHOT_METHODS = ["btrfs", "overlay", "reflink", "copy"]
+OVERLAY_SUFFIX = "_overlay"
+BTRFS_SUBVOLUME_INODE = 256
+MANIFEST_SUFFIX = ".manifest.json"
+REPOMD = "repodata/repomd.xml"
+# in seconds, unreachable repository must not block setUp
+REPOMD_TIMEOUT = 10
+# images named by md5 of repositories (before ImageCache), they are never used now
+LEGACY_IMAGE_SUFFIX = re.compile(r"^[0-9a-f]{32}$")
+# in MB
+DEFAULT_IMAGE_CACHE_QUOTA = 20 * 1024
+DEFAULT_PACKAGE_CACHE_QUOTA = 5 * 1024
+POOL_BASEDIR = "/var/tmp/mtf_pool"
+# in seconds
+DEFAULT_POOL_MAX_IDLE = 30 * 60
+SESSION_BASEDIR = "/var/tmp/mtf_session"
+REAPER_BASEDIR = "/var/tmp/mtf_reaper"
+DEFAULT_REAPER_WORKERS = 2
+# fraction of free disk space, when there is less, machines are removed synchronously
+DEFAULT_REAPER_MIN_FREE = 0.1
+# inotify events signalling that file is complete (written or renamed into watched dir)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+# safety net, recheck file existence when no inotify event arrives for this time
+FILE_WATCH_RECHECK = 1
+# max number of symlinks followed when resolving path inside machine (as kernel does)
+MAX_SYMLINKS = 40
 base_package_set = ["systemd"]
 
 is_debug_low = common.is_debug
 if is_debug_low():
     logging.basicConfig(level=logging.DEBUG)
 
+__snapshot_method_cache = {}
+
+
+def get_filesystem_type(path):
+    """
+    Return type of filesystem where path is located (longest mountpoint from /proc/mounts)
+
+    :param path: str
+    :return: str
+    """
+    path = os.path.realpath(path)
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    fstype = ""
+    mountpoint = ""
+    with open("/proc/mounts") as mounts:
+        for line in mounts:
+            items = line.split()
+            mpoint = items[1].replace("\\040", " ")
+            if (path == mpoint or path.startswith(mpoint.rstrip("/") + "/")) and len(mpoint) >= len(mountpoint):
+                mountpoint = mpoint
+                fstype = items[2]
+    return fstype
+
+
+def is_btrfs_subvolume(path):
+    """
+    Check if directory is root of btrfs subvolume (it has always same inode number)
+
+    :param path: str
+    :return: bool
+    """
+    return os.path.isdir(path) and get_filesystem_type(path) == "btrfs" and \
+        os.stat(path).st_ino == BTRFS_SUBVOLUME_INODE
+
+
+def __overlay_supported():
+    with open("/proc/filesystems") as filesystems:
+        return "overlay" in filesystems.read().split()
+
+
+def __reflink_supported(directory):
+    probedir = tempfile.mkdtemp(prefix="mtf_reflink_", dir=directory)
+    try:
+        probe = os.path.join(probedir, "probe")
+        with open(probe, "w") as probefile:
+            probefile.write("probe")
+        return process.run("cp --reflink=always %s %s.copy" % (probe, probe),
+                           ignore_status=True, verbose=is_debug_low()).exit_status == 0
+    finally:
+        shutil.rmtree(probedir, ignore_errors=True)
+
+
+def detect_snapshot_method(location):
+    """
+    Return the fastest snapshot method possible for image located in location.
+    It can be forced via MTF_NSPAWN_SNAPSHOT envvar (one of SNAPSHOT_METHODS)
+
+    :param location: directory of base image
+    :return: str
+    """
+    forced = common.get_nspawn_snapshot_method()
+    if forced:
+        if forced not in SNAPSHOT_METHODS:
+            raise mtfexceptions.NspawnExc("Unknown snapshot method %s, allowed are: %s" % (forced, SNAPSHOT_METHODS))
+        return forced
+    directory = os.path.dirname(os.path.abspath(location))
+    if location not in __snapshot_method_cache:
+        if is_btrfs_subvolume(location):
+            method = "btrfs"
+        elif __overlay_supported() and get_filesystem_type(location) != "overlay":
+            method = "overlay"
+        elif __reflink_supported(directory):
+            method = "reflink"
+        else:
+            method = "copy"
+        __snapshot_method_cache[location] = method
+    return __snapshot_method_cache[location]
+
+
+def resolve_in_root(root, path, follow=True):
+    """
+    Resolve path inside root directory as chroot would do it, absolute symlinks
+    and .. never points outside of root
+
+    :param root: str - root directory on host (e.g. /proc/PID/root of machine)
+    :param path: str - path inside root
+    :param follow: bool - resolve also last component of path, otherwise just parent directories
+                   are resolved and last component is kept (as lstat does)
+    :return: str - path on host
+    """
+    parts = [x for x in path.split("/") if x]
+    if not follow and parts and parts[-1] not in [".", ".."]:
+        return os.path.join(resolve_in_root(root, "/".join(parts[:-1])), parts[-1])
+    resolved = ""
+    links = 0
+    while parts:
+        part = parts.pop(0)
+        if part == ".":
+            continue
+        if part == "..":
+            resolved = resolved.rsplit("/", 1)[0]
+            continue
+        candidate = resolved + "/" + part
+        if os.path.islink(root + candidate):
+            links += 1
+            if links > MAX_SYMLINKS:
+                raise mtfexceptions.NspawnExc("Too many levels of symbolic links in %s" % path)
+            target = os.readlink(root + candidate)
+            if target.startswith("/"):
+                resolved = ""
+            parts = [x for x in target.split("/") if x] + parts
+        else:
+            resolved = candidate
+    return root + (resolved or "/")
+
+
+def tar_copy(sources, destination):
+    """
+    Copy files and directory trees via one tar stream, ownership (numeric) and
+    permissions are preserved. When one source is given and destination is not existing directory,
+    source is copied to destination path, otherwise all sources are copied into destination directory
+
+    :param sources: list of host paths
+    :param destination: host path
+    :return: None
+    """
+    into_dir = os.path.isdir(destination) and not os.path.islink(destination)
+    if len(sources) > 1 and not into_dir:
+        raise mtfexceptions.NspawnExc("Destination %s has to be directory for multiple sources" % destination)
+    extractdir = destination if into_dir else tempfile.mkdtemp(prefix=".mtf_copy_",
+                                                               dir=os.path.dirname(destination))
+    create_cmd = ["tar", "--numeric-owner", "-cf", "-"]
+    for source in sources:
+        create_cmd += ["-C", os.path.dirname(source), os.path.basename(source)]
+    try:
+        creator = subprocess.Popen(create_cmd, stdout=subprocess.PIPE, close_fds=True)
+        extractor = subprocess.Popen(["tar", "--numeric-owner", "-xpf", "-", "-C", extractdir],
+                                     stdin=creator.stdout, close_fds=True)
+        creator.stdout.close()
+        if extractor.wait() != 0 or creator.wait() != 0:
+            raise mtfexceptions.NspawnExc("Unable to copy %s to %s" % (sources, destination))
+        if not into_dir:
+            os.rename(os.path.join(extractdir, os.path.basename(sources[0])), destination)
+    finally:
+        if not into_dir:
+            shutil.rmtree(extractdir, ignore_errors=True)
+
+
 class Image(object):
     """
     It represents image object for Nspawn virtualization
@@ -51,8 +243,10 @@ class Image(object):
     """
     logger = logging.getLogger("Image")
     def __init__(self, repos, packageset, location, installed=False, packager="dnf -y",
-                 name="unique", ignore_installed=False):
+                 name="unique", ignore_installed=False, snapshot_method=None, package_cache=None):
         self.repos = repos
+        self.package_cache = package_cache
+        self.snapshot_method = snapshot_method
         self.packageset = list(set(packageset + base_package_set))
         self.location = location
         self.packager = packager
@@ -73,22 +267,50 @@ class Image(object):
                 else:
                     raise e
 
-    def create_snapshot(self, destination):
+    @common.timed("image.snapshot")
+    def create_snapshot(self, destination, method=None):
         """
         returns Image object with copyied files from base image
         
         :param destination: directory where to crete copy
+        :param method: snapshot method (one of SNAPSHOT_METHODS), detected by default
         :return: Image
         """
-        self.logger.debug("Create Snapshot: %s -> %s" % (self.location, destination))
-        # copytree somethimes fails, it is not reliable in case of copy of system
-        # shutil.copytree(self.location, destination)
-        # cp will do better work
-        process.run("cp -rf %s %s" % (self.location, destination))
+        method = method or detect_snapshot_method(self.location)
+        if os.path.exists(destination):
+            # keep behaviour of cp for already existing (reused) destination
+            method = "copy"
+        self.logger.debug("Create Snapshot (%s): %s -> %s" % (method, self.location, destination))
+        try:
+            if method == "btrfs":
+                process.run("btrfs subvolume snapshot %s %s" % (self.location, destination),
+                            verbose=is_debug_low())
+            elif method == "overlay":
+                overlaydir = destination + OVERLAY_SUFFIX
+                for directory in [destination, os.path.join(overlaydir, "upper"), os.path.join(overlaydir, "work")]:
+                    os.makedirs(directory)
+                process.run("mount -t overlay overlay -o lowerdir=%s,upperdir=%s/upper,workdir=%s/work %s" %
+                            (self.location, overlaydir, overlaydir, destination), verbose=is_debug_low())
+            elif method == "reflink":
+                process.run("cp -a --reflink=auto %s %s" % (self.location, destination), verbose=is_debug_low())
+            else:
+                # copytree somethimes fails, it is not reliable in case of copy of system
+                # shutil.copytree(self.location, destination)
+                # cp will do better work
+                process.run("cp -rf %s %s" % (self.location, destination))
+        except process.CmdError as e:
+            if method == "copy":
+                raise e
+            self.logger.debug("Snapshot method %s failed, use copy: %s" % (method, e))
+            shutil.rmtree(destination + OVERLAY_SUFFIX, ignore_errors=True)
+            shutil.rmtree(destination, ignore_errors=True)
+            return self.create_snapshot(destination, method="copy")
         return self.__class__(repos=self.repos, packageset=self.packageset,
                               location=destination, installed=True,
-                              packager=self.packager, name=self.name)
+                              packager=self.packager, name=self.name,
+                              snapshot_method=method)
 
+    @common.timed("image.install")
     def __install(self):
         """
         Internal method for installing packages to chroot and set repositories.
@@ -98,20 +320,32 @@ class Image(object):
         self.logger.debug("Install system to direcory: %s" % self.location)
         if not os.path.exists(os.path.join(self.location, "usr")):
             if not os.path.exists(self.location):
-                os.makedirs(self.location)
+                if get_filesystem_type(self.location) == "btrfs":
+                    # subvolume allows to create snapshots in constant time
+                    if not os.path.exists(os.path.dirname(self.location)):
+                        os.makedirs(os.path.dirname(self.location))
+                    process.run("btrfs subvolume create %s" % self.location, verbose=is_debug_low())
+                else:
+                    os.makedirs(self.location)
+            if self.package_cache:
+                # ids independent on image name, so that cached metadata are found by every image
+                repoids = [self.package_cache.repo_id(repo) for repo in self.repos]
+            else:
+                repoids = ["%s%d" % (self.name, counter) for counter in range(1, len(self.repos) + 1)]
             repos_to_use = ""
-            counter = 0
-            for repo in self.repos:
-                counter = counter + 1
-                repos_to_use += " --repofrompath %s%d,%s" % (
-                    self.name, counter, repo)
+            for repoid, repo in zip(repoids, self.repos):
+                repos_to_use += " --repofrompath %s,%s" % (repoid, repo)
             self.logger.debug("Install packages: %s" % self.packageset)
             self.logger.debug("Repositories: %s" % self.repos)
-            process.run("%s install --nogpgcheck --setopt=install_weak_deps=False "
-                 "--installroot %s --allowerasing --disablerepo=* --enablerepo=%s* %s %s" %
-                                    (self.packager, self.location, self.name,
-                                     repos_to_use, " ".join(self.packageset)),
-                        verbose=is_debug_low())
+            install_cmd = "%s install --nogpgcheck --setopt=install_weak_deps=False " \
+                          "--installroot %s --allowerasing --disablerepo=* --enablerepo=%s %s %s" % \
+                          (self.packager, self.location, ",".join(repoids),
+                           repos_to_use, " ".join(self.packageset))
+            with common.TimingSpan("image.install.packages", location=self.location):
+                if self.package_cache:
+                    self.package_cache.install(install_cmd, self.location, self.packager, self.repos)
+                else:
+                    process.run(install_cmd, verbose=is_debug_low())
             insiderepopath = os.path.join(self.location, self.yumrepo[1:])
             if not os.path.exists(os.path.dirname(insiderepopath)):
                 os.makedirs(os.path.dirname(insiderepopath))
@@ -129,20 +363,29 @@ class Image(object):
                     f.write(add)
             for repo in self.repos:
                 if "file:///" in repo:
-                    src = repo[7:]
-                    srcto = os.path.join(self.location, src[1:])
-                    if not os.path.exists(os.path.dirname(srcto)):
-                        os.makedirs(os.path.dirname(srcto))
-                    shutil.copytree(src, srcto)
+                    # just mountpoint, content of repository is bind mounted when machine boots
+                    srcto = os.path.join(self.location, repo[8:])
+                    if not os.path.exists(srcto):
+                        os.makedirs(srcto)
             pkipath = "/etc/pki/rpm-gpg"
             pkipath_ch = os.path.join(self.location, pkipath[1:])
             if not os.path.exists(pkipath_ch):
                 os.makedirs(pkipath_ch)
-            for filename in glob.glob(os.path.join(pkipath, '*')):
-                shutil.copy(filename, pkipath_ch)
+            with common.TimingSpan("image.install.pki_copy", location=self.location):
+                for filename in glob.glob(os.path.join(pkipath, '*')):
+                    shutil.copy(filename, pkipath_ch)
         else:
             raise mtfexceptions.NspawnExc("Directory %s already in use" % self.location)
 
+    def bind_options(self):
+        """
+        return systemd-nspawn options what expose local (file:///) repositories
+        to machine read-only on same path as on host
+
+        :return: list
+        """
+        return ["--bind-ro=%s" % repo[7:] for repo in self.repos if "file:///" in repo]
+
     def get_location(self):
         """
         return directory location
@@ -151,8 +394,1177 @@ class Image(object):
         """
         return self.location
 
+    @common.timed("image.rmi")
     def rmi(self):
-        shutil.rmtree(self.location)
+        """
+        remove image directory, it takes care of used snapshot method
+
+        :return: None
+        """
+        if self.snapshot_method == "overlay":
+            if process.run("umount %s" % self.location, ignore_status=True, verbose=is_debug_low()).exit_status != 0:
+                with open("/proc/mounts") as mounts:
+                    mounted = " %s " % self.location in mounts.read()
+                if mounted:
+                    # busy mount is detached lazily, it is freed when last process stops using it,
+                    # so that its upper and work directories must stay on disk
+                    lazy = process.run("umount -l %s" % self.location, ignore_status=True,
+                                       verbose=is_debug_low()).exit_status == 0
+                    self.logger.warning("Unable to umount %s (%s), image directories are kept: %s, %s" %
+                                        (self.location, "detached lazily" if lazy else "still mounted",
+                                         self.location, self.location + OVERLAY_SUFFIX))
+                    return
+            shutil.rmtree(self.location + OVERLAY_SUFFIX, ignore_errors=True)
+            try:
+                os.rmdir(self.location)
+            except OSError as e:
+                self.logger.warning("Unable to remove directory of image %s: %s" % (self.location, e))
+        elif is_btrfs_subvolume(self.location) and \
+                process.run("btrfs subvolume delete %s" % self.location,
+                            ignore_status=True, verbose=is_debug_low()).exit_status == 0:
+            pass
+        else:
+            shutil.rmtree(self.location)
+
+class ImageCache(object):
+    """
+    Cache of installed base images in one directory. Image is identified by
+    checksums of repositories metadata, package set and packager, so that
+    any change of them leads to new image.
+    Every image has manifest (build time, size, last use, hits) stored next to it
+    and least recently used images are removed when cache exceeds quota.
+    """
+    logger = logging.getLogger("ImageCache")
+
+    def __init__(self, basedir, prefix, quota=None, package_cache=None):
+        """
+
+        :param basedir: directory where images are stored
+        :param prefix: prefix of image directory names (all with same prefix are taken as part of cache)
+        :param quota: maximal size of cache in MB
+        :param package_cache: PackageCache used for installation of new images
+        """
+        self.basedir = basedir
+        self.prefix = prefix
+        self.quota = quota if quota is not None else DEFAULT_IMAGE_CACHE_QUOTA
+        self.package_cache = package_cache
+        self.__in_use = {}
+
+    def __repo_checksum(self, repo):
+        """
+        Internal method
+        return checksum of repository metadata, or of repository url in case metadata are not readable
+
+        :param repo: str
+        :return: str
+        """
+        try:
+            repomd = urllib2.urlopen(os.path.join(repo, REPOMD), timeout=REPOMD_TIMEOUT)
+            try:
+                if repomd.getcode() in [None, 200]:
+                    return hashlib.sha256(repomd.read()).hexdigest()
+            finally:
+                repomd.close()
+        except (IOError, socket.error) as e:
+            self.logger.debug("Unable to read repository metadata %s: %s" % (repo, e))
+        return hashlib.sha256(repo).hexdigest()
+
+    def key(self, repos, packageset, packager):
+        """
+        Return identifier of image
+
+        :param repos: list of repositories
+        :param packageset: list of packages
+        :param packager: str
+        :return: str
+        """
+        content = {"repos": dict((repo, self.__repo_checksum(repo)) for repo in repos),
+                   "packages": sorted(set(packageset + base_package_set)),
+                   "packager": packager}
+        return hashlib.sha256(json.dumps(content, sort_keys=True)).hexdigest()
+
+    def __lock(self, location, blocking=True):
+        """
+        Internal method
+        return locked lock file of image, lock file is removed together with image,
+        so that it is checked that locked file is still the one on disk
+
+        :param location: str - location of image
+        :param blocking: bool - wait for lock
+        :return: file object or None in case lock is held by other process (not blocking)
+        """
+        while True:
+            lockfile = open(location + ".lock", "w")
+            try:
+                fcntl.flock(lockfile, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                lockfile.close()
+                return None
+            try:
+                if os.fstat(lockfile.fileno()).st_ino == os.stat(location + ".lock").st_ino:
+                    return lockfile
+            except OSError:
+                pass
+            lockfile.close()
+
+    def __read_manifest(self, location):
+        try:
+            with open(location + MANIFEST_SUFFIX) as manifest:
+                return json.load(manifest)
+        except (IOError, ValueError):
+            return None
+
+    def __write_manifest(self, location, manifest):
+        with open(location + MANIFEST_SUFFIX + ".tmp", "w") as manifestfile:
+            json.dump(manifest, manifestfile, sort_keys=True, indent=2)
+        os.rename(location + MANIFEST_SUFFIX + ".tmp", location + MANIFEST_SUFFIX)
+
+    def get_image(self, repos, packageset, packager="dnf -y", name="unique"):
+        """
+        Return installed Image from cache, image is installed in case it is not cached.
+        Image is locked as used until release is called, so that it is not evicted by other processes
+        while snapshots are created from it
+
+        :param repos: list of repositories
+        :param packageset: list of packages
+        :param packager: str
+        :param name: passed to Image
+        :return: Image
+        """
+        if not os.path.exists(self.basedir):
+            os.makedirs(self.basedir)
+        imagekey = self.key(repos, packageset, packager)
+        location = os.path.join(self.basedir, self.prefix + imagekey[:16])
+        # parallel workers wait here until image is installed by first one
+        with self.__lock(location):
+            manifest = self.__read_manifest(location)
+            if manifest and manifest.get("key") == imagekey and os.path.exists(os.path.join(location, "usr")):
+                manifest["last_use"] = time.time()
+                manifest["hits"] = manifest.get("hits", 0) + 1
+                self.__write_manifest(location, manifest)
+                common.print_info("nspawn image cache HIT (%d): %s" % (manifest["hits"], location))
+                image = Image(repos=repos, packageset=packageset, location=location,
+                              installed=True, packager=packager, name=name)
+            else:
+                common.print_info("nspawn image cache MISS: %s" % location)
+                if os.path.exists(location):
+                    # directory without manifest is result of interrupted installation
+                    Image(repos=repos, packageset=packageset, location=location, installed=True).rmi()
+                build_start = time.time()
+                image = Image(repos=repos, packageset=packageset, location=location,
+                              packager=packager, name=name, package_cache=self.package_cache)
+                size = int(process.run("du -sm %s" % location, verbose=is_debug_low()).stdout.split()[0])
+                self.__write_manifest(location, {"key": imagekey,
+                                                 "repos": repos,
+                                                 "packages": image.packageset,
+                                                 "packager": packager,
+                                                 "build_time": time.time() - build_start,
+                                                 "created": build_start,
+                                                 "last_use": time.time(),
+                                                 "size": size,
+                                                 "hits": 0})
+            if location not in self.__in_use:
+                # evict takes exclusive lock of image just under lock of image, so that it is free now
+                usefile = open(location + ".use", "w")
+                fcntl.flock(usefile, fcntl.LOCK_SH)
+                self.__in_use[location] = usefile
+        self.evict(keep=[location])
+        return image
+
+    def release(self, image):
+        """
+        Unlock image returned by get_image, it can be evicted then
+
+        :param image: Image
+        :return: None
+        """
+        usefile = self.__in_use.pop(image.get_location(), None)
+        if usefile:
+            usefile.close()
+
+    def evict(self, keep=[]):
+        """
+        Remove least recently used images until cache size is under quota,
+        images used by other processes (see get_image) are skipped
+
+        :param keep: list of locations what must not be removed
+        :return: None
+        """
+        with open("/proc/mounts") as mounts:
+            mounted = mounts.read()
+        self.__evict_leftovers(keep)
+        images = []
+        for manifestpath in glob.glob(os.path.join(self.basedir, self.prefix + "*" + MANIFEST_SUFFIX)):
+            location = manifestpath[:-len(MANIFEST_SUFFIX)]
+            manifest = self.__read_manifest(location)
+            if manifest:
+                images.append((manifest.get("last_use", 0), manifest.get("size", 0), location))
+        total = sum(x[1] for x in images)
+        if total > self.quota:
+            images += self.__legacy_images()
+            total = sum(x[1] for x in images)
+        for last_use, size, location in sorted(images):
+            if total <= self.quota:
+                break
+            # base image can be still used as lowerdir of overlay snapshots
+            if location in keep or re.search(r"(lowerdir=([^, ]*:)?|\s)%s[,: ]" % re.escape(location), mounted):
+                continue
+            if not os.path.exists(location + MANIFEST_SUFFIX):
+                self.logger.info("Remove image with legacy name: %s (%d MB)" % (location, size))
+                Image(repos=[], packageset=[], location=location, installed=True).rmi()
+                total -= size
+                continue
+            lockfile = self.__lock(location, blocking=False)
+            if not lockfile:
+                continue
+            with lockfile:
+                usefile = open(location + ".use", "w")
+                try:
+                    fcntl.flock(usefile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except IOError:
+                    self.logger.debug("Image is used by other process: %s" % location)
+                    usefile.close()
+                    continue
+                with usefile:
+                    self.logger.info("Evict image from cache: %s (%d MB)" % (location, size))
+                    os.remove(location + MANIFEST_SUFFIX)
+                    if os.path.exists(location):
+                        Image(repos=[], packageset=[], location=location, installed=True).rmi()
+                    os.remove(location + ".use")
+                    os.remove(location + ".lock")
+            total -= size
+
+    def __legacy_images(self):
+        """
+        Internal method
+        return images named by md5 of repositories (they are not found by cache anymore),
+        they are least recently used, so that they are evicted first
+
+        :return: list of tuples (last use, size in MB, location)
+        """
+        images = []
+        for location in glob.glob(os.path.join(self.basedir, self.prefix + "*")):
+            if LEGACY_IMAGE_SUFFIX.match(os.path.basename(location)[len(self.prefix):]) and os.path.isdir(location):
+                size = int(process.run("du -sm %s" % location, verbose=is_debug_low()).stdout.split()[0])
+                images.append((0, size, location))
+        return images
+
+    def __evict_leftovers(self, keep):
+        """
+        Internal method
+        remove lock files of images what do not exist
+
+        :param keep: list of locations what must not be removed
+        :return: None
+        """
+        for lockpath in glob.glob(os.path.join(self.basedir, self.prefix + "*.lock")):
+            location = lockpath[:-len(".lock")]
+            if location in keep or os.path.exists(location) or os.path.exists(location + MANIFEST_SUFFIX):
+                continue
+            lockfile = self.__lock(location, blocking=False)
+            if lockfile:
+                with lockfile:
+                    if not os.path.exists(location):
+                        if os.path.exists(location + ".use"):
+                            os.remove(location + ".use")
+                        os.remove(lockpath)
+
+
+class PackageCache(object):
+    """
+    Repository metadata and downloaded packages shared by all image installations on host.
+    Packager always uses cache directory inside installroot, so that it is seeded from host directory
+    before installation and new content is stored back after it. Repositories get ids derived from their urls,
+    so that every image finds metadata of same repository.
+    Least recently used packages are removed when cache exceeds quota.
+    """
+    logger = logging.getLogger("PackageCache")
+
+    def __init__(self, basedir, quota=None):
+        """
+
+        :param basedir: directory with cache
+        :param quota: maximal size of cache in MB
+        """
+        self.basedir = basedir
+        self.quota = quota if quota is not None else DEFAULT_PACKAGE_CACHE_QUOTA
+
+    @staticmethod
+    def repo_id(repo):
+        """
+        Return repository id used in packager commands
+
+        :param repo: str - url of repository
+        :return: str
+        """
+        return "mtf%s" % hashlib.sha256(repo).hexdigest()[:16]
+
+    def __packages(self):
+        """
+        Internal method
+        return all cached packages
+
+        :return: dict filename: path
+        """
+        packages = {}
+        for dirpath, dirnames, filenames in os.walk(self.basedir):
+            for filename in filenames:
+                if filename.endswith(".rpm"):
+                    packages[filename] = os.path.join(dirpath, filename)
+        return packages
+
+    def __seed(self, cachedir, repos):
+        """
+        Internal method
+        fill private cache of installation by content of shared cache for used repositories,
+        packages are hard linked (they are not changed by packager), metadata are copied
+
+        :param cachedir: str - cache directory of packager inside installroot
+        :param repos: list of repositories
+        :return: None
+        """
+        for repodir in sum([glob.glob(os.path.join(self.basedir, "%s-*" % self.repo_id(repo))) for repo in repos], []):
+            for dirpath, dirnames, filenames in os.walk(repodir):
+                target = os.path.join(cachedir, os.path.relpath(dirpath, self.basedir))
+                if not os.path.exists(target):
+                    os.makedirs(target)
+                for filename in filenames:
+                    if filename.endswith(".rpm"):
+                        try:
+                            os.link(os.path.join(dirpath, filename), os.path.join(target, filename))
+                            continue
+                        except OSError:
+                            pass
+                    shutil.copy2(os.path.join(dirpath, filename), os.path.join(target, filename))
+
+    def __publish(self, cachedir):
+        """
+        Internal method
+        store new packages and updated metadata from private cache of installation to shared cache,
+        it has to be called with cache locked exclusively
+
+        :param cachedir: str - cache directory of packager inside installroot
+        :return: None
+        """
+        for dirpath, dirnames, filenames in os.walk(cachedir):
+            target = os.path.join(self.basedir, os.path.relpath(dirpath, cachedir))
+            if not os.path.exists(target):
+                os.makedirs(target)
+            for filename in filenames:
+                source = os.path.join(dirpath, filename)
+                destination = os.path.join(target, filename)
+                if os.path.exists(destination):
+                    if filename.endswith(".rpm") or os.stat(source).st_mtime <= os.stat(destination).st_mtime:
+                        continue
+                elif filename.endswith(".rpm"):
+                    try:
+                        os.link(source, destination)
+                        continue
+                    except OSError:
+                        pass
+                # other installations can read cache, so that file is replaced atomically
+                shutil.copy2(source, destination + ".tmp")
+                os.rename(destination + ".tmp", destination)
+
+    def install(self, command, installroot, packager, repos):
+        """
+        Run installation command with private cache seeded from shared cache, new content is stored
+        to shared cache after installation. Cache is locked just while it is read or updated,
+        so that parallel installations do not wait for each other.
+
+        :param command: str - packager command using repo_id as repository ids
+        :param installroot: str
+        :param packager: str
+        :param repos: list of repositories used by command
+        :return: None
+        """
+        if not os.path.exists(self.basedir):
+            os.makedirs(self.basedir)
+        cachedir = os.path.join(installroot, "var", "cache", os.path.basename(packager.split()[0]))
+        if not os.path.exists(cachedir):
+            os.makedirs(cachedir)
+        with open(self.basedir + ".lock", "a") as lockfile:
+            # more installations can be seeded at once, update of cache is exclusive
+            fcntl.flock(lockfile, fcntl.LOCK_SH)
+            for repo in repos:
+                cached = glob.glob(os.path.join(self.basedir, "%s-*" % self.repo_id(repo)))
+                common.print_info("nspawn package cache metadata %s: %s" % ("HIT" if cached else "MISS", repo))
+            before = self.__packages()
+            self.__seed(cachedir, repos)
+        try:
+            process.run(command + " --setopt=keepcache=True", verbose=is_debug_low())
+            installed = process.run("rpm --root %s -qa --qf '%%{NAME}-%%{VERSION}-%%{RELEASE}.%%{ARCH}.rpm\\n'" %
+                                    installroot, verbose=is_debug_low()).stdout.split()
+            with open(self.basedir + ".lock", "a") as lockfile:
+                fcntl.flock(lockfile, fcntl.LOCK_EX)
+                self.__publish(cachedir)
+                after = self.__packages()
+                hits = [x for x in installed if x in before]
+                misses = [x for x in installed if x in after and x not in before]
+                now = time.time()
+                for package in hits + misses:
+                    os.utime(after[package], (now, now))
+                common.print_info("nspawn package cache: %d packages HIT, %d MISS" % (len(hits), len(misses)))
+                self.evict()
+        finally:
+            # image does not keep copy of cache
+            shutil.rmtree(cachedir, ignore_errors=True)
+            os.makedirs(cachedir)
+
+    def evict(self):
+        """
+        Remove least recently used packages until cache size is under quota,
+        it has to be called with cache locked
+
+        :return: None
+        """
+        total = 0
+        for dirpath, dirnames, filenames in os.walk(self.basedir):
+            total += sum(os.path.getsize(os.path.join(dirpath, x)) for x in filenames)
+        quota = self.quota * 1024 * 1024
+        for mtime, path in sorted((os.path.getmtime(x), x) for x in self.__packages().values()):
+            if total <= quota:
+                break
+            self.logger.debug("Evict package from cache: %s" % path)
+            total -= os.path.getsize(path)
+            os.remove(path)
+
+
+class MachinePool(object):
+    """
+    Pool of machines booted from one Image. Machines run as transient systemd services, so that
+    they survive process of test, which created them, and state of pool is stored in directory
+    (one json file per machine), so that it can be shared by all tests of job.
+    Machine is claimed by atomic rename of its file, pool is refilled in background thread.
+    """
+    logger = logging.getLogger("MachinePool")
+
+    def __init__(self, image, size=1, max_idle=DEFAULT_POOL_MAX_IDLE, boot_target=DEFAULT_BOOT_TARGET,
+                 nspawn_add_option_list=[], basedir=POOL_BASEDIR):
+        """
+
+        :param image: Image object, base for machines
+        :param size: int - number of machines to keep booted
+        :param max_idle: int - seconds, free machines are destroyed when pool is not used so long
+        :param boot_target: str - passed to Container.boot_service
+        :param nspawn_add_option_list: list - passed to Container.boot_service
+        :param basedir: directory with pools, there is one pool per image, target and options
+        """
+        self.image = image
+        self.size = size
+        self.max_idle = max_idle or DEFAULT_POOL_MAX_IDLE
+        self.boot_target = boot_target
+        self.nspawn_add_option_list = nspawn_add_option_list
+        poolkey = hashlib.md5(" ".join([image.get_location(), str(boot_target)] +
+                                       nspawn_add_option_list)).hexdigest()[:8]
+        self.pooldir = os.path.join(basedir, "%s_%s" % (os.path.basename(image.get_location()), poolkey))
+        for directory in [self.__freedir(), self.__claimeddir()]:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+        self.__refill_thread = None
+
+    def __freedir(self):
+        return os.path.join(self.pooldir, "free")
+
+    def __claimeddir(self):
+        return os.path.join(self.pooldir, "claimed")
+
+    def __update_metrics(self, **kwargs):
+        """
+        Internal method
+        add values to metrics stored in pool directory
+
+        :param kwargs: name of metric and value to add
+        :return: dict of metrics
+        """
+        metricspath = os.path.join(self.pooldir, "metrics.json")
+        with open(os.path.join(self.pooldir, ".lock"), "w") as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            try:
+                with open(metricspath) as metricsfile:
+                    metrics = json.load(metricsfile)
+            except (IOError, ValueError):
+                metrics = {}
+            for key, value in kwargs.items():
+                metrics[key] = metrics.get(key, 0) + value
+            with open(metricspath, "w") as metricsfile:
+                json.dump(metrics, metricsfile, sort_keys=True)
+        return metrics
+
+    def __members(self):
+        """
+        Internal method
+        list of json files of free machines, oldest first
+
+        :return: list
+        """
+        return sorted(glob.glob(os.path.join(self.__freedir(), "*.json")), key=os.path.getmtime)
+
+    def __start_member(self):
+        name = "pool%s" % common.generate_unique_name()
+        location = os.path.join(os.path.dirname(self.image.get_location()), "chroot_%s" % name)
+        snapshot = self.image.create_snapshot(location)
+        container = Container(image=snapshot, name=name)
+        container.boot_service(nspawn_add_option_list=self.nspawn_add_option_list, boot_target=self.boot_target)
+        with open(os.path.join(self.__freedir(), "%s.json" % name), "w") as memberfile:
+            json.dump({"name": name, "location": location, "snapshot_method": snapshot.snapshot_method},
+                      memberfile)
+        self.__update_metrics(started=1)
+
+    def fill(self):
+        """
+        Start machines to have pool of required size, machines boot in background
+
+        :return: None
+        """
+        with open(os.path.join(self.pooldir, ".filllock"), "w") as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            for foo in range(self.size - len(self.__members())):
+                self.__start_member()
+
+    def fill_background(self):
+        """
+        Call fill in background thread, use wait_fill to wait for it
+
+        :return: None
+        """
+        self.__refill_thread = threading.Thread(target=self.fill)
+        self.__refill_thread.daemon = True
+        self.__refill_thread.start()
+
+    def wait_fill(self):
+        if self.__refill_thread:
+            self.__refill_thread.join()
+            self.__refill_thread = None
+
+    def __expire(self):
+        """
+        Internal method
+        destroy free machines in case pool was not used longer than max_idle
+
+        :return: None
+        """
+        lastusepath = os.path.join(self.pooldir, "last_claim")
+        if os.path.exists(lastusepath) and time.time() - os.path.getmtime(lastusepath) > self.max_idle:
+            self.logger.info("Pool %s was idle more than %ss, draining" % (self.pooldir, self.max_idle))
+            drain_pool(self.pooldir)
+        with open(lastusepath, "w"):
+            pass
+
+    def claim(self, exec_channel=False):
+        """
+        Return booted Container from pool and start refilling of pool in background
+
+        :param exec_channel: bool - passed to Container
+        :return: Container
+        """
+        self.__expire()
+        for foo in range(DEFAULT_RETRYTIMEOUT):
+            members = self.__members()
+            if not members:
+                self.fill()
+                continue
+            memberpath = members[0]
+            claimedpath = os.path.join(self.__claimeddir(), os.path.basename(memberpath))
+            try:
+                os.rename(memberpath, claimedpath)
+            except OSError:
+                # other process was faster
+                continue
+            with open(claimedpath) as memberfile:
+                member = json.load(memberfile)
+            os.remove(claimedpath)
+            container = Container(image=Image(repos=self.image.repos, packageset=self.image.packageset,
+                                              location=member["location"], installed=True,
+                                              packager=self.image.packager, name=self.image.name,
+                                              snapshot_method=member["snapshot_method"]),
+                                  name=member["name"], exec_channel=exec_channel)
+            start_time = time.time()
+            try:
+                container.wait_service()
+            except process.CmdError as e:
+                self.logger.info("Pooled machine %s is broken, destroying: %s" % (member["name"], e))
+                container.stop()
+                container.rm()
+                continue
+            waittime = time.time() - start_time
+            # machine was not ready, if wait took more than one check of systemctl
+            if waittime > DEFAULT_SLEEP:
+                metrics = self.__update_metrics(waits=1, wait_time=waittime)
+                common.print_info("nspawn pool WAIT %.2fs: %s (metrics: %s)" % (waittime, member["name"], metrics))
+            else:
+                metrics = self.__update_metrics(hits=1)
+                common.print_info("nspawn pool HIT: %s (metrics: %s)" % (member["name"], metrics))
+            self.fill_background()
+            return container
+        raise mtfexceptions.NspawnExc("Unable to get booted machine from pool %s" % self.pooldir)
+
+
+def drain_pool(pooldir):
+    """
+    Destroy all free machines of pool
+
+    :param pooldir: directory of pool
+    :return: None
+    """
+    for memberpath in glob.glob(os.path.join(pooldir, "free", "*.json")):
+        claimedpath = os.path.join(pooldir, "claimed", os.path.basename(memberpath))
+        try:
+            os.rename(memberpath, claimedpath)
+        except OSError:
+            continue
+        with open(claimedpath) as memberfile:
+            member = json.load(memberfile)
+        container = Container(image=Image(repos=[], packageset=[], location=member["location"], installed=True,
+                                          snapshot_method=member["snapshot_method"]),
+                              name=member["name"])
+        container.stop()
+        try:
+            container.rm()
+        except OSError as e:
+            Container.logger.debug("Unable to remove %s: %s" % (member["location"], e))
+        os.remove(claimedpath)
+
+
+def drain_pools(basedir=POOL_BASEDIR):
+    """
+    Destroy free machines of all pools, it is called at the end of job
+
+    :param basedir: directory with pools
+    :return: None
+    """
+    for pooldir in glob.glob(os.path.join(basedir, "*")):
+        drain_pool(pooldir)
+
+
+class MachineSession(object):
+    """
+    One machine shared by tests of job. Root of machine is overlay with base image and
+    checkpoint (upper layer frozen after setup and start of service) as lower layers, so that changes done by test
+    are just in upper layer. Rollback to checkpoint means to stop machine, remove upper layer and boot machine
+    again, setup is not repeated and nothing is copied. Machine is booted again, because just reboot resets
+    state of all daemons and tmpfs mounts (/tmp, /run, /dev/shm) of machine. Boot for next test is started in
+    background when test releases session, so that it overlaps with rest of test process and next test waits
+    just for its end (see session.acquire and session.release timing spans).
+    Session is locked by test which uses it, so that parallel tests do not share machine.
+    """
+    logger = logging.getLogger("MachineSession")
+
+    def __init__(self, image, key="", basedir=SESSION_BASEDIR, sessiondir=None):
+        """
+
+        :param image: Image object, base image of machine
+        :param key: str - additional identifier of session (e.g. name of component)
+        :param basedir: directory with sessions
+        :param sessiondir: directory of existing session, it overrides image and key
+        """
+        self.image = image
+        if not sessiondir:
+            sessionkey = hashlib.md5(image.get_location() + key).hexdigest()[:8]
+            sessiondir = os.path.join(basedir, "%s_%s" % (os.path.basename(image.get_location()), sessionkey))
+        self.sessiondir = sessiondir
+        self.name = "mtfsession%s" % sessiondir.rsplit("_", 1)[-1]
+        self.location = os.path.join(self.sessiondir, "root")
+        self.__lockfile = None
+
+    def __path(self, item):
+        return os.path.join(self.sessiondir, item)
+
+    def __mount(self, lowerdirs):
+        for item in ["upper", "work", "root"]:
+            if not os.path.exists(self.__path(item)):
+                os.makedirs(self.__path(item))
+        process.run("mount -t overlay overlay -o lowerdir=%s,upperdir=%s,workdir=%s %s" %
+                    (":".join(lowerdirs), self.__path("upper"), self.__path("work"), self.location),
+                    verbose=is_debug_low())
+
+    def __umount(self):
+        with open("/proc/mounts") as mounts:
+            if " %s " % self.location in mounts.read():
+                process.run("umount %s" % self.location, verbose=is_debug_low())
+
+    def __container(self, exec_channel=False):
+        return Container(image=Image(repos=self.image.repos, packageset=self.image.packageset,
+                                     location=self.location, installed=True, packager=self.image.packager,
+                                     name=self.image.name, snapshot_method="overlay"),
+                         name=self.name, exec_channel=exec_channel)
+
+    def __reset(self):
+        """
+        Internal method
+        stop machine (also machine booted in background) and remove changes done after checkpoint
+
+        :return: None
+        """
+        container = self.__container()
+        # machine booted as service by other process
+        process.run("systemctl stop %s" % container.service_unit(), ignore_status=True, verbose=is_debug_low())
+        if process.run("machinectl status %s" % self.name, ignore_status=True,
+                       verbose=is_debug_low()).exit_status == 0:
+            container.stop()
+        self.__umount()
+        for item in ["upper", "work", "booting"]:
+            shutil.rmtree(self.__path(item), ignore_errors=True)
+
+    def __boot(self, lowerdirs, boot_target, exec_channel):
+        """
+        Internal method
+        mount root and boot machine, it returns booted machine
+
+        :return: Container
+        """
+        self.__mount(lowerdirs)
+        container = self.__container(exec_channel=exec_channel)
+        container.boot_service(boot_target=boot_target)
+        container.wait_service()
+        return container
+
+    @common.timed("session.acquire")
+    def acquire(self, setup=None, start=None, boot_target=DEFAULT_BOOT_TARGET, exec_channel=False):
+        """
+        Return booted machine with root rolled back to checkpoint
+
+        :param setup: function called with Container just once per session after first boot,
+                      its changes are checkpointed
+        :param start: function called with Container in every test (it starts the service),
+                      its changes are checkpointed in first test
+        :param boot_target: str - passed to Container.boot_service
+        :param exec_channel: bool - passed to Container
+        :return: Container or None in case session is used by other test
+        """
+        if not os.path.exists(self.sessiondir):
+            os.makedirs(self.sessiondir)
+        self.__lockfile = open(self.__path(".lock"), "w")
+        try:
+            fcntl.flock(self.__lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            self.__lockfile.close()
+            self.__lockfile = None
+            return None
+        checkpoint = self.__path("checkpoint")
+        try:
+            if os.path.exists(self.__path("booting")):
+                common.print_info("nspawn session HIT: %s booted from checkpoint in background" % self.name)
+                os.remove(self.__path("booting"))
+                container = self.__container(exec_channel=exec_channel)
+                try:
+                    container.wait_service()
+                except process.CmdError as e:
+                    self.logger.info("Machine %s booted in background is broken: %s" % (self.name, e))
+                    self.__reset()
+                    container = self.__boot([checkpoint, self.image.get_location()], boot_target, exec_channel)
+            else:
+                self.__reset()
+                if not os.path.exists(checkpoint):
+                    common.print_info("nspawn session MISS: %s setup and checkpoint" % self.name)
+                    container = self.__boot([self.image.get_location()], boot_target, exec_channel)
+                    if setup:
+                        setup(container)
+                    if start:
+                        start(container)
+                    # checkpoint is taken from stopped machine, so that files are consistent
+                    container.stop()
+                    self.__umount()
+                    os.rename(self.__path("upper"), checkpoint)
+                    shutil.rmtree(self.__path("work"))
+                else:
+                    common.print_info("nspawn session REBOOT: %s booted from checkpoint" % self.name)
+                container = self.__boot([checkpoint, self.image.get_location()], boot_target, exec_channel)
+            if start:
+                start(container)
+        except BaseException:
+            self.__lockfile.close()
+            self.__lockfile = None
+            raise
+        return container
+
+    @common.timed("session.release")
+    def release(self, container=None, boot_target=DEFAULT_BOOT_TARGET):
+        """
+        Stop machine, remove changes done by test, start boot of machine for next test in background
+        and unlock session
+
+        :param container: Container returned by acquire
+        :param boot_target: str - passed to Container.boot_service
+        :return: None
+        """
+        if not self.__lockfile:
+            return
+        try:
+            if container:
+                container.stop()
+            self.__reset()
+            if os.path.exists(self.__path("checkpoint")):
+                self.__mount([self.__path("checkpoint"), self.image.get_location()])
+                self.__container().boot_service(boot_target=boot_target)
+                open(self.__path("booting"), "w").close()
+        except (process.CmdError, mtfexceptions.NspawnExc, OSError, IOError) as e:
+            self.logger.warning("Unable to boot %s in background, it will be booted by next test: %s" %
+                                (self.name, e))
+        finally:
+            self.__lockfile.close()
+            self.__lockfile = None
+
+    def destroy(self):
+        """
+        Stop machine and remove whole session including checkpoint
+
+        :return: None
+        """
+        with open(self.__path(".lock"), "w") as lockfile:
+            fcntl.flock(lockfile, fcntl.LOCK_EX)
+            self.__reset()
+            shutil.rmtree(self.sessiondir, ignore_errors=True)
+
+
+def drain_sessions(basedir=SESSION_BASEDIR):
+    """
+    Destroy all sessions, it is called at the end of job
+
+    :param basedir: directory with sessions
+    :return: None
+    """
+    for sessiondir in glob.glob(os.path.join(basedir, "*")):
+        MachineSession(image=Image(repos=[], packageset=[], location=sessiondir, installed=True),
+                       sessiondir=sessiondir).destroy()
+
+
+class Reaper(object):
+    """
+    Stop and remove machines in background. Every test runs in own process, so that
+    queue is directory shared by all tests of job (one json file per machine) and machines
+    are removed by detached worker processes (at most workers at once), which survive test.
+    Machines are removed synchronously when there is lack of disk space.
+    """
+    logger = logging.getLogger("Reaper")
+
+    def __init__(self, basedir=REAPER_BASEDIR, workers=DEFAULT_REAPER_WORKERS, min_free=DEFAULT_REAPER_MIN_FREE):
+        """
+
+        :param basedir: directory with queue
+        :param workers: int - maximal number of parallel worker processes
+        :param min_free: float - fraction of free disk space needed for asynchronous removal
+        """
+        self.basedir = basedir
+        self.workers = workers
+        self.min_free = min_free
+        for directory in [self.__queuedir(), self.__runningdir()]:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+
+    def __queuedir(self):
+        return os.path.join(self.basedir, "queue")
+
+    def __runningdir(self):
+        return os.path.join(self.basedir, "running")
+
+    def __slot(self, number):
+        return os.path.join(self.basedir, "worker%d.lock" % number)
+
+    def __disk_pressure(self, location):
+        stat = os.statvfs(os.path.dirname(os.path.abspath(location)))
+        return stat.f_bavail < stat.f_blocks * self.min_free
+
+    @staticmethod
+    def __reap(member):
+        container = Container(image=Image(repos=[], packageset=[], location=member["location"], installed=True,
+                                          snapshot_method=member["snapshot_method"]),
+                              name=member["name"])
+        container.stop()
+        try:
+            container.rm()
+        except OSError as e:
+            Reaper.logger.debug("Unable to remove %s: %s" % (member["location"], e))
+
+    def submit(self, container):
+        """
+        Hand over container to be stopped and removed in background
+
+        :param container: Container object
+        :return: None
+        """
+        container.detach()
+        if self.__disk_pressure(container.location):
+            self.logger.info("Low disk space, removing %s synchronously" % container.name)
+            container.stop()
+            container.rm()
+            return
+        memberpath = os.path.join(self.__queuedir(), "%s.json" % container.name)
+        with open(memberpath + ".tmp", "w") as memberfile:
+            json.dump({"name": container.name, "location": container.location,
+                       "snapshot_method": container.image.snapshot_method}, memberfile)
+        os.rename(memberpath + ".tmp", memberpath)
+        with open(os.devnull, "w") as devnull:
+            # new session, so that worker is not killed together with test process
+            subprocess.Popen([sys.executable, "-c", "from mtf.backend.nspawn import Reaper; "
+                              "Reaper(basedir=%r, workers=%d).work()" % (self.basedir, self.workers)],
+                             stdin=devnull, stdout=devnull, stderr=devnull, close_fds=True, preexec_fn=os.setsid)
+
+    def __process_queue(self):
+        """
+        Internal method
+        take machines from queue (by atomic rename) and remove them until queue is empty
+
+        :return: None
+        """
+        while True:
+            members = sorted(glob.glob(os.path.join(self.__queuedir(), "*.json")), key=os.path.getmtime)
+            if not members:
+                return
+            runningpath = os.path.join(self.__runningdir(), os.path.basename(members[0]))
+            try:
+                os.rename(members[0], runningpath)
+            except OSError:
+                # other worker was faster
+                continue
+            with open(runningpath) as memberfile:
+                member = json.load(memberfile)
+            try:
+                self.__reap(member)
+            except BaseException as e:
+                self.logger.info("Unable to remove machine %s: %s" % (member["name"], e))
+            os.remove(runningpath)
+
+    def work(self):
+        """
+        Worker loop, it exits immediately when all worker slots are taken
+        (running workers will process the queue)
+
+        :return: None
+        """
+        while True:
+            for number in range(self.workers):
+                with open(self.__slot(number), "w") as lockfile:
+                    try:
+                        fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except IOError:
+                        continue
+                    self.__process_queue()
+                    break
+            else:
+                return
+            # item added after last check could be refused by other worker, while this one had slot
+            if not glob.glob(os.path.join(self.__queuedir(), "*.json")):
+                return
+
+    def drain(self):
+        """
+        Wait until all machines are removed, it is called at the end of job
+
+        :return: None
+        """
+        self.__process_queue()
+        lockfiles = [open(self.__slot(number), "w") for number in range(self.workers)]
+        try:
+            for lockfile in lockfiles:
+                fcntl.flock(lockfile, fcntl.LOCK_EX)
+            # no worker is running now, finish also machines of crashed workers
+            for runningpath in glob.glob(os.path.join(self.__runningdir(), "*.json")):
+                os.rename(runningpath, os.path.join(self.__queuedir(), os.path.basename(runningpath)))
+            self.__process_queue()
+        finally:
+            for lockfile in lockfiles:
+                lockfile.close()
+
+
+class FileWatch(object):
+    """
+    Wait for file to appear in directory without polling it by subprocesses.
+    It uses inotify (via libc), when it is not available it falls back to
+    checking file existence with growing sleep.
+    Watch has to be created before the file may appear to not miss an event.
+    """
+    __libc = None
+
+    def __init__(self, directory):
+        """
+
+        :param directory: str - directory where file will be created
+        """
+        self.directory = directory
+        self.fd = None
+        libc = self.__get_libc()
+        if libc:
+            fd = libc.inotify_init1(os.O_NONBLOCK)
+            if fd >= 0:
+                if libc.inotify_add_watch(fd, directory, IN_CLOSE_WRITE | IN_MOVED_TO) >= 0:
+                    self.fd = fd
+                else:
+                    os.close(fd)
+        if self.fd is None:
+            Container.logger.debug("inotify not available for %s, fall back to polling" % directory)
+
+    @classmethod
+    def __get_libc(cls):
+        if cls.__libc is None:
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+                cls.__libc = libc if hasattr(libc, "inotify_init1") else False
+            except OSError:
+                cls.__libc = False
+        return cls.__libc
+
+    def wait(self, filename, timeout=None):
+        """
+        Block until file exists
+
+        :param filename: str - name of file inside watched directory
+        :param timeout: seconds to wait, None means forever
+        :return: str - full path to file
+        """
+        path = os.path.join(self.directory, filename)
+        deadline = time.time() + timeout if timeout else None
+        sleep = 0.01
+        while not os.path.exists(path):
+            if deadline and time.time() > deadline:
+                raise mtfexceptions.NspawnExc("File %s was not created within %s seconds" % (path, timeout))
+            if self.fd is not None:
+                if select.select([self.fd], [], [], FILE_WATCH_RECHECK)[0]:
+                    # just drain events, file existence is checked in loop
+                    os.read(self.fd, 65536)
+            else:
+                time.sleep(sleep)
+                sleep = min(sleep * 2, FILE_WATCH_RECHECK)
+        return path
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class ExecChannel(object):
+    """
+    Long living bash process attached to namespaces of running machine via nsenter.
+    Commands are passed to its stdin and output is framed by unique marker
+    followed by exit code, so that there is no unit nor temporary file per command.
+    Channel runs in own process group, so that whole tree of commands is killed with it
+    """
+    logger = logging.getLogger("ExecChannel")
+
+    def __init__(self, leader_pid):
+        """
+
+        :param leader_pid: int - PID of machine leader (init process) on host
+        """
+        self.leader_pid = leader_pid
+        self.lock = threading.Lock()
+        self.logger.debug("Attach exec channel to PID: %s" % leader_pid)
+        self.process = subprocess.Popen(["nsenter", "--target", str(leader_pid),
+                                         "--mount", "--uts", "--ipc", "--net", "--pid",
+                                         "--root", "--wd", "/bin/bash"],
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE,
+                                        env={"PATH": DEFAULT_GUEST_PATH, "HOME": "/root"},
+                                        close_fds=True, preexec_fn=os.setsid)
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def __read_frames(self, marker, timeout):
+        """
+        Internal method
+        read stdout and stderr of channel until both contains marker of actual command
+
+        :param marker: str - marker used for command
+        :param timeout: int - timeout in seconds or None
+        :return: tuple (stdout, stderr, exit_status)
+        """
+        outfd = self.process.stdout.fileno()
+        errfd = self.process.stderr.fileno()
+        buffers = {outfd: "", errfd: ""}
+        done = {}
+        out_frame = re.compile("%s:(\\d+)\n$" % marker)
+        deadline = time.time() + timeout if timeout else None
+        while len(done) < 2:
+            waittime = max(deadline - time.time(), 0) if deadline else None
+            readable, _, _ = select.select([fd for fd in buffers if fd not in done], [], [], waittime)
+            if not readable:
+                # bash of channel waits for hung command, so that it does not exit after stdin is closed
+                self.kill()
+                raise mtfexceptions.NspawnExc("Command in exec channel timed out after %ss" % timeout)
+            for fd in readable:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    self.kill()
+                    raise mtfexceptions.NspawnExc("Exec channel to PID %s died" % self.leader_pid)
+                buffers[fd] += chunk
+            found = out_frame.search(buffers[outfd])
+            if found:
+                done[outfd] = int(found.group(1))
+                buffers[outfd] = buffers[outfd][:found.start()]
+            if buffers[errfd].endswith("%s\n" % marker):
+                done[errfd] = True
+                buffers[errfd] = buffers[errfd][:-len(marker) - 1]
+        return buffers[outfd], buffers[errfd], done[outfd]
+
+    def run(self, command, timeout=None, ignore_status=False, **kwargs):
+        """
+        execute command via channel
+
+        :param command: str
+        :param timeout: int - timeout in seconds, channel is closed after timeout
+        :param ignore_status: bool - do not raise exception in case of non zero exit code
+        :param kwargs: rest of avocado.process.run params, ignored
+        :return: avocado.process.CmdResult
+        """
+        marker = "MTF_FRAME_%s" % common.generate_unique_name(size=16)
+        script = "IFS= read -r -d '' mtf_cmd <<'{m}'\n" \
+                 "{comm}\n" \
+                 "{m}\n" \
+                 "(cd / && exec /bin/bash -c \"$mtf_cmd\") </dev/null\n" \
+                 "printf '{m}:%d\\n' $?\n" \
+                 "printf '{m}\\n' >&2\n".format(m=marker, comm=command)
+        with self.lock:
+            start_time = time.time()
+            self.process.stdin.write(script)
+            self.process.stdin.flush()
+            stdout, stderr, exit_status = self.__read_frames(marker, timeout)
+        comout = process.CmdResult(command=command, stdout=stdout, stderr=stderr,
+                                   exit_status=exit_status, duration=time.time() - start_time)
+        self.logger.debug(comout)
+        if exit_status != 0 and not ignore_status:
+            raise process.CmdError(command, comout)
+        return comout
+
+    def close(self):
+        """
+        Stop bash process of channel
+
+        :return: None
+        """
+        if self.is_alive():
+            try:
+                self.process.stdin.close()
+                self.process.wait()
+            except (IOError, OSError):
+                self.kill()
+        self.__close_pipes()
+
+    def kill(self):
+        """
+        Kill process group of channel (nsenter, bash and commands started by it),
+        it is used when command hangs or channel is broken
+
+        :return: None
+        """
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except OSError:
+            # process group does not exist anymore
+            pass
+        self.process.wait()
+        self.__close_pipes()
+
+    def __close_pipes(self):
+        for pipe in [self.process.stdin, self.process.stdout, self.process.stderr]:
+            try:
+                pipe.close()
+            except (IOError, OSError):
+                # unflushed command for killed bash
+                pass
+
 
 class Container(object):
     """
@@ -162,19 +1574,24 @@ class Container(object):
     """
     logger = logging.getLogger("Container")
     __systemd_wait_support = False
+    __notify_ready_support = False
     __default_command_sleep = 2
     __alternative_boot = False
     
-    def __init__(self, image, name=None):
+    def __init__(self, image, name=None, exec_channel=False):
         """
         
         :param image: Image object 
         :param name: optional, use unique name for generating containers in case not given, some name is generated
+        :param exec_channel: optional, use persistent ExecChannel for execute method instead of systemd-run
         """
         self.image = image
         self.name = name or common.generate_unique_name()
+        self.exec_channel = exec_channel
+        self.__channel = None
         self.location = self.image.get_location()
         self.__systemd_wait_support = self._run_systemdrun_decide()
+        self.__notify_ready_support = self._notify_ready_decide()
 
     def __machined_restart(self):
         # this is removed, it was important for crappy machinectl shell handling
@@ -204,7 +1621,51 @@ class Container(object):
                     return True
         raise mtfexceptions.NspawnExc("Unable to start machine %s within %d" % (self.name, DEFAULT_RETRYTIMEOUT))
 
-    def boot_machine(self, nspawn_add_option_list=[], boot_cmd="", wait_finish=False):
+    def __notify_socket_open(self):
+        """
+        Internal method
+        create datagram socket what is passed to systemd-nspawn as NOTIFY_SOCKET
+
+        :return: socket object
+        """
+        socketdir = tempfile.mkdtemp(prefix="mtf_notify_")
+        notify_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        notify_socket.bind(os.path.join(socketdir, "notify"))
+        notify_socket.settimeout(DEFAULT_SLEEP)
+        return notify_socket
+
+    def __notify_socket_close(self, notify_socket):
+        socketpath = notify_socket.getsockname()
+        notify_socket.close()
+        shutil.rmtree(os.path.dirname(socketpath), ignore_errors=True)
+
+    def __is_ready(self, notify_socket, nspawncont):
+        """
+        Internal method
+        wait for READY=1 message, nspawn forwards it when init inside machine reaches boot target
+        (--notify-ready=yes), timeout is used just for checking if nspawn process is still alive
+
+        :param notify_socket: socket object created by __notify_socket_open
+        :param nspawncont: process.SubProcess object of systemd-nspawn
+        :return: True
+        """
+        deadline = time.time() + DEFAULT_RETRYTIMEOUT
+        while time.time() < deadline:
+            try:
+                message = notify_socket.recv(4096)
+            except socket.timeout:
+                if nspawncont.poll() is not None:
+                    raise mtfexceptions.NspawnExc("Machine %s exited during boot" % self.name,
+                                                  nspawncont.get_stderr())
+                continue
+            self.logger.debug("notify message from %s: %s" % (self.name, message))
+            if "READY=1" in message.split("\n"):
+                return True
+        raise mtfexceptions.NspawnExc("Unable to start machine %s within %d" % (self.name, DEFAULT_RETRYTIMEOUT))
+
+    @common.timed("container.boot")
+    def boot_machine(self, nspawn_add_option_list=[], boot_cmd="", wait_finish=False,
+                     boot_target=DEFAULT_BOOT_TARGET):
         """
         start machine via -b option (full boot, default) or 
         via boot_cmd (usefull with wait_finish=True option)
@@ -212,31 +1673,86 @@ class Container(object):
         :param nspawn_add_option_list: list - additional nspawn parameters 
         :param boot_cmd: std - command with aruments for starting
         :param wait_finish: - bool - wait to process finish (by default it just wait for creting systemd unit and boot)
+        :param boot_target: str - systemd target what has to be reached to consider machine as booted
         :return: process.Subprocess object 
         """
         self.logger.debug("starting NSPAWN")
         bootmachine = ""
         bootmachine_cmd = ""
+        notify_socket = None
+        nspawn_env = None
         if boot_cmd:
             self.__alternative_boot = True
             bootmachine_cmd = boot_cmd
             process.run("systemctl reset-failed machine-%s.scope" % self.name,
                         ignore_status=True, verbose=is_debug_low())
         else:
+            self.__alternative_boot = False
             bootmachine = "-b"
+            if boot_target:
+                # arguments after -b are passed to init, systemd handles them as kernel command line
+                bootmachine_cmd = "systemd.unit=%s" % boot_target
+            if self.__notify_ready_support and not wait_finish:
+                notify_socket = self.__notify_socket_open()
+                bootmachine = "--notify-ready=yes -b"
+                nspawn_env = {"NOTIFY_SOCKET": notify_socket.getsockname()}
         command = "systemd-nspawn --machine=%s %s %s -D %s %s" % \
-                  (self.name, " ".join(nspawn_add_option_list), bootmachine, self.location, bootmachine_cmd)
+                  (self.name, " ".join(self.image.bind_options() + nspawn_add_option_list),
+                   bootmachine, self.location, bootmachine_cmd)
         self.logger.debug("Start command: %s" % command)
-        nspawncont = process.SubProcess(command)
+        nspawncont = process.SubProcess(command, env=nspawn_env)
         self.logger.info("machine: %s starting" % self.name)
         if wait_finish:
             nspawncont.wait()
+        elif notify_socket:
+            try:
+                nspawncont.start()
+                self.__is_ready(notify_socket, nspawncont)
+            finally:
+                self.__notify_socket_close(notify_socket)
         else:
             nspawncont.start()
             self.__is_booted()
         self.logger.info("machine: %s starting finished" % self.name)
         return nspawncont
 
+    def boot_service(self, nspawn_add_option_list=[], boot_target=DEFAULT_BOOT_TARGET):
+        """
+        start machine as transient systemd service (Type=notify) on host, it returns immediately
+        and machine boots in background, it is not bound to lifetime of calling process.
+        Use wait_service to wait until it is booted
+
+        :param nspawn_add_option_list: list - additional nspawn parameters
+        :param boot_target: str - systemd target what has to be reached to consider machine as booted
+        :return: None
+        """
+        notify = "--notify-ready=yes" if self.__notify_ready_support else ""
+        bootmachine_cmd = "systemd.unit=%s" % boot_target if boot_target else ""
+        process.run("systemd-run --unit %s -p Type=notify --no-block "
+                    "systemd-nspawn --machine=%s %s %s -b -D %s %s" %
+                    (self.service_unit(), self.name, " ".join(self.image.bind_options() + nspawn_add_option_list),
+                     notify, self.location, bootmachine_cmd), verbose=is_debug_low())
+        self.logger.info("machine: %s starting as service" % self.name)
+
+    def wait_service(self, timeout=2 * DEFAULT_RETRYTIMEOUT):
+        """
+        wait until machine started via boot_service is booted, start job of
+        unit finishes when machine reports ready
+
+        :param timeout: int - seconds
+        :return: None
+        """
+        process.run("systemctl start %s" % self.service_unit(), timeout=timeout, verbose=is_debug_low())
+        self.logger.info("machine: %s starting finished" % self.name)
+
+    def service_unit(self):
+        """
+        name of transient unit used by boot_service
+
+        :return: str
+        """
+        return "mtf-machine-%s.service" % self.name
+
     def execute(self, command, **kwargs):
         """
         execute command inside container, it hides what method will be used
@@ -245,8 +1761,45 @@ class Container(object):
         :param kwargs: pass thru to avocado.process.run command
         :return: process object
         """
+        if self.exec_channel and not kwargs.get("internal_background"):
+            return self.run_channel(command, **kwargs)
         return self.run_systemdrun(command, **kwargs)
 
+    def __leader_pid(self):
+        """
+        Internal method
+        get PID of machine leader on host
+
+        :return: int
+        """
+        out = process.run("machinectl show -p Leader %s" % self.name, verbose=is_debug_low()).stdout
+        return int(out.strip().split("=")[-1])
+
+    def stream_cmd(self, command):
+        """
+        return host command what executes command inside machine directly attached to its
+        namespaces, so that output can be read incrementally (systemd-run stores it to files)
+
+        :param command: str
+        :return: str
+        """
+        return 'nsenter --target %d --mount --uts --ipc --net --pid --root --wd ' \
+               'env -i PATH=%s /bin/bash -c "%s"' % (self.__leader_pid(), DEFAULT_GUEST_PATH,
+                                                    common.sanitize_cmd(command))
+
+    def run_channel(self, command, **kwargs):
+        """
+        execute command via persistent ExecChannel attached to machine,
+        channel is created on first use and recreated in case it dies
+
+        :param command: str
+        :param kwargs: pass thru to ExecChannel.run
+        :return: avocado.process.CmdResult
+        """
+        if not self.__channel or not self.__channel.is_alive():
+            self.__channel = ExecChannel(self.__leader_pid())
+        return self.__channel.run(command, **kwargs)
+
     def _run_systemdrun_decide(self):
         """
         Internal method
@@ -254,27 +1807,33 @@ class Container(object):
 
         :return:
         """
-        return "--wait" in process.run("systemd-run --help", verbose=is_debug_low()).stdout
+        return common.get_host_fact("systemd_run_wait")
 
-    def __systemctl_wait_until_finish(self, machine, unit):
+    def _notify_ready_decide(self):
         """
         Internal method
-        workaround for systemd-run without --wait option
+        decide if it is possible to use --notify-ready option of systemd-nspawn
+        to get event about finished boot instead of polling machinectl
 
-        :param machine:
-        :param unit:
-        :return:
+        :return: bool
         """
-        while True:
-            output = [x.strip() for x in
-                      process.run("systemctl show -M {} {}".format(machine, unit),
-                                   verbose=is_debug_low()).stdout.split("\n")]
-            retcode = int([x[-1] for x in output if "ExecMainStatus=" in x][0])
-            if not ("SubState=exited" in output or "SubState=failed" in output):
-                time.sleep(0.1)
-            else:
-                break
-        process.run("systemctl -M {} stop {}".format(machine, unit), ignore_status=True, verbose=is_debug_low())
+        return common.get_host_fact("nspawn_notify_ready")
+
+    def __wait_until_finish(self, watch, lpath, timeout=None):
+        """
+        Internal method
+        workaround for systemd-run without --wait option, command wrapper renames exit code
+        file into place when command finishes, so wait for it via inotify instead of polling systemctl
+
+        :param watch: FileWatch of directory with exit code file
+        :param lpath: path of command output files inside machine
+        :param timeout: seconds to wait
+        :return: int exit code
+        """
+        rcpath = watch.wait("{}.rc".format(os.path.basename(lpath)), timeout=timeout)
+        with open(rcpath) as rcfile:
+            retcode = int(rcfile.read().strip())
+        os.remove(rcpath)
         return retcode
 
     def run_systemdrun(self, command, internal_background=False, **kwargs):
@@ -292,14 +1851,18 @@ class Container(object):
         add_sleep_infinite = ""
         unit_name = common.generate_unique_name()
         lpath = "/var/tmp/{}".format(unit_name)
+        watch = None
         if self.__systemd_wait_support:
             add_wait_var = "--wait"
         else:
-            # keep service exist after it finish, to be able to read exit code
-            add_wait_var = "-r"
+            # exit code is stored to file and moved atomically to place when command finishes
+            add_wait_var = ""
+            add_sleep_infinite = "; echo $? >{pin}.rc.tmp; mv {pin}.rc.tmp {pin}.rc".format(pin=lpath)
         if internal_background:
             add_wait_var = ""
             add_sleep_infinite = "&& sleep infinity"
+        elif not self.__systemd_wait_support:
+            watch = FileWatch("{chroot}{dir}".format(chroot=self.location, dir=os.path.dirname(lpath)))
         opts = " --unit {unitname} {wait} -M {machine}".format(wait=add_wait_var,
                                                               machine=self.name,
                                                               unitname=unit_name
@@ -310,7 +1873,7 @@ class Container(object):
                 **kwargs)
             if not internal_background:
                 if not self.__systemd_wait_support:
-                    comout.exit_status = self.__systemctl_wait_until_finish(self.name,unit_name)
+                    comout.exit_status = self.__wait_until_finish(watch, lpath, timeout=kwargs.get("timeout"))
                 with open("{chroot}{pin}.stdout".format(chroot=self.location, pin=lpath), 'r') as content_file:
                     comout.stdout = content_file.read()
                 with open("{chroot}{pin}.stderr".format(chroot=self.location, pin=lpath), 'r') as content_file:
@@ -324,6 +1887,9 @@ class Container(object):
             return comout
         except process.CmdError as e:
             raise e
+        finally:
+            if watch:
+                watch.close()
 
     def run_machinectl(self, command, **kwargs):
         """
@@ -372,32 +1938,77 @@ class Container(object):
         """
         return self.execute("true")
 
+    def __rootfs(self, writable=False):
+        """
+        Internal method
+        return directory on host what shows filesystem of running machine including its own mounts
+        (e.g. tmpfs on /tmp), None in case it is not accessible directly
+
+        :param writable: bool - root has to be writable
+        :return: str or None
+        """
+        try:
+            root = "/proc/%d/root" % self.__leader_pid()
+        except (process.CmdError, ValueError):
+            return None
+        if not os.access(root, os.W_OK if writable else os.R_OK):
+            return None
+        return root
+
     def copy_to(self, src, dest):
         """
-        Copy file to module from host
+        Copy files to module from host, files are written directly to filesystem of machine,
+        machinectl copy-to is used as fallback
 
-        :param src: source file on host
+        :param src: source file on host or list of files (then dest has to be directory)
         :param dest: destination file on module
         :return: None
         """
-        self.logger.debug("copy files (inside) from: %s to: %s" % (src, dest))
-        process.run(
-            " machinectl copy-to  %s %s %s" %
-            (self.name, src, dest), timeout=DEFAULT_RETRYTIMEOUT, verbose=is_debug_low())
+        sources = src if isinstance(src, list) else [src]
+        self.logger.debug("copy files (inside) from: %s to: %s" % (sources, dest))
+        root = self.__rootfs(writable=True)
+        if root:
+            tar_copy([os.path.abspath(x) for x in sources], resolve_in_root(root, dest))
+            return
+        for source in sources:
+            target = os.path.join(dest, os.path.basename(source)) if isinstance(src, list) else dest
+            process.run(
+                " machinectl copy-to  %s %s %s" %
+                (self.name, source, target), timeout=DEFAULT_RETRYTIMEOUT, verbose=is_debug_low())
 
     def copy_from(self, src, dest):
         """
-        Copy file from module to host
+        Copy files from module to host, files are read directly from filesystem of machine,
+        machinectl copy-from is used as fallback
 
-        :param src: source file on module
+        :param src: source file on module or list of files (then dest has to be directory)
         :param dest: destination file on host
         :return: None
         """
-        self.logger.debug("copy files (outside) from: %s to: %s" % (src, dest))
-        process.run(
-            " machinectl copy-from  %s %s %s" %
-            (self.name, src, dest), timeout=DEFAULT_RETRYTIMEOUT, verbose=is_debug_low())
+        sources = src if isinstance(src, list) else [src]
+        self.logger.debug("copy files (outside) from: %s to: %s" % (sources, dest))
+        root = self.__rootfs()
+        if root:
+            # copy has same name as requested source, also in case it is symlink
+            tar_copy([resolve_in_root(root, x, follow=False) for x in sources], os.path.abspath(dest))
+            return
+        for source in sources:
+            target = os.path.join(dest, os.path.basename(source)) if isinstance(src, list) else dest
+            process.run(
+                " machinectl copy-from  %s %s %s" %
+                (self.name, source, target), timeout=DEFAULT_RETRYTIMEOUT, verbose=is_debug_low())
 
+    def detach(self):
+        """
+        Close resources bound to this process (exec channel), machine keeps running
+
+        :return: None
+        """
+        if self.__channel:
+            self.__channel.close()
+            self.__channel = None
+
+    @common.timed("container.stop")
     def stop(self):
         """
         Stop the nspawn container
@@ -406,6 +2017,9 @@ class Container(object):
         """
         self.logger.debug("Stop")
         self.__machined_restart()
+        if self.__channel:
+            self.__channel.close()
+            self.__channel = None
         try:
             if not self.__alternative_boot:
                 process.run("machinectl poweroff %s" % self.name, verbose=is_debug_low())
@@ -432,6 +2046,7 @@ class Container(object):
                 pass
             pass
 
+    @common.timed("container.rm")
     def rm(self):
         """
         Remove container image via image method
@@ -467,6 +2082,17 @@ class testImage(Test):
         assert os.path.exists(os.path.join(self.i2.get_location(), "usr"))
         self.i2.rmi()
 
+    def test_snapshot_methods(self):
+        for method in SNAPSHOT_METHODS:
+            if method == "btrfs" and not is_btrfs_subvolume(self.loc1):
+                continue
+            t_before = time.time()
+            self.i2 = self.i1.create_snapshot(self.loc2, method=method)
+            self.log.info("snapshot %s (used %s): %.2fs" % (method, self.i2.snapshot_method, time.time() - t_before))
+            assert os.path.exists(os.path.join(self.i2.get_location(), "usr"))
+            self.i2.rmi()
+            assert not os.path.exists(self.loc2)
+
     def tearDown(self):
         try:
             self.i1.rmi()
@@ -478,6 +2104,103 @@ class testImage(Test):
             pass
 
 
+class testImageCache(Test):
+    """
+    Test cache of installed base images: hit, miss and eviction
+    """
+    repo = "http://ftp.fi.muni.cz/pub/linux/fedora/linux/releases/26/Everything/x86_64/os/"
+    prefix = "chroot_test_image_"
+
+    def setUp(self):
+        self.basedir = tempfile.mkdtemp(prefix="mtf_image_cache_")
+
+    def test_hit_miss_evict(self):
+        cache = ImageCache(basedir=self.basedir, prefix=self.prefix)
+        i1 = cache.get_image(repos=[self.repo], packageset=["bash"])
+        with open(i1.get_location() + MANIFEST_SUFFIX) as manifest:
+            assert json.load(manifest)["hits"] == 0
+        assert cache.get_image(repos=[self.repo], packageset=["bash"]).get_location() == i1.get_location()
+        with open(i1.get_location() + MANIFEST_SUFFIX) as manifest:
+            assert json.load(manifest)["hits"] == 1
+        legacy = os.path.join(self.basedir, self.prefix + hashlib.md5(self.repo).hexdigest())
+        os.makedirs(os.path.join(legacy, "usr"))
+        # legacy image is removed just when cache exceeds quota
+        cache.evict()
+        assert os.path.exists(legacy)
+        # other package set is new image, least recently used image does not fit to quota,
+        # but it is used by other cache (process)
+        cache_quota = ImageCache(basedir=self.basedir, prefix=self.prefix, quota=0)
+        i2 = cache_quota.get_image(repos=[self.repo], packageset=["bash", "sed"])
+        assert i2.get_location() != i1.get_location()
+        assert os.path.exists(os.path.join(i2.get_location(), "usr"))
+        assert os.path.exists(os.path.join(i1.get_location(), "usr"))
+        assert not os.path.exists(legacy)
+        cache.release(i1)
+        cache_quota.evict()
+        for path in [i1.get_location(), i1.get_location() + MANIFEST_SUFFIX, i1.get_location() + ".lock",
+                     i1.get_location() + ".use"]:
+            assert not os.path.exists(path)
+        assert os.path.exists(os.path.join(i2.get_location(), "usr"))
+        cache_quota.release(i2)
+
+    def test_unreachable_repository(self):
+        t_before = time.time()
+        ImageCache(basedir=self.basedir, prefix=self.prefix).key(["http://10.255.255.1/repo/"], ["bash"], "dnf -y")
+        assert time.time() - t_before < REPOMD_TIMEOUT + 5
+
+    def tearDown(self):
+        for location in glob.glob(os.path.join(self.basedir, self.prefix + "*")):
+            if os.path.isdir(location):
+                Image(repos=[], packageset=[], location=location, installed=True).rmi()
+        shutil.rmtree(self.basedir, ignore_errors=True)
+
+
+class testPackageCache(Test):
+    """
+    Test that parallel installations do not hold package cache lock while packager runs
+    """
+    repo = "http://example.com/repo/"
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="mtf_package_cache_")
+
+    def test_parallel_install(self):
+        cache = PackageCache(basedir=os.path.join(self.tmpdir, "cache"))
+        repodir = os.path.join(self.tmpdir, "cache", "%s-0123456789abcdef" % cache.repo_id(self.repo))
+        os.makedirs(os.path.join(repodir, "packages"))
+        open(os.path.join(repodir, "repomd.xml"), "w").close()
+        errors = []
+
+        def install(name, other):
+            installroot = os.path.join(self.tmpdir, name)
+            cachedir = os.path.join(installroot, "var", "cache", "dnf", os.path.basename(repodir))
+            # both fake packagers have to run at once, seeded metadata are visible for them
+            command = ("sh -c 'test -f %s/repomd.xml && touch %s/%s && "
+                       "for i in $(seq 100); do test -e %s/%s && break; sleep 0.1; done && "
+                       "test -e %s/%s && touch %s/packages/%s-1-1.noarch.rpm'" %
+                       (cachedir, self.tmpdir, name, self.tmpdir, other, self.tmpdir, other, cachedir, name))
+            try:
+                cache.install(command, installroot, "dnf -y", [self.repo])
+                # cache inside installroot is emptied, content is stored in shared cache
+                assert not os.listdir(os.path.join(installroot, "var", "cache", "dnf"))
+            except Exception as e:
+                # exceptions of threads are not reported by test, they are checked in main thread
+                errors.append(e)
+
+        threads = [threading.Thread(target=install, args=("first", "second")),
+                   threading.Thread(target=install, args=("second", "first"))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not errors, errors
+        for name in ["first", "second"]:
+            assert os.path.exists(os.path.join(repodir, "packages", "%s-1-1.noarch.rpm" % name))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+
 class testContainer(Test):
     """
     It tests Container object and his abilities to run various commands
@@ -514,6 +2237,150 @@ class testContainer(Test):
         assert "sbin" in self.c1.run_systemdrun(command="ls /").stdout
 
 
+    def test_local_repo_bind(self):
+        repodir = tempfile.mkdtemp(prefix="mtf_local_repo_")
+        try:
+            with open(os.path.join(repodir, "marker"), "w") as marker:
+                marker.write("local repo")
+            image = Image(repos=self.i1.repos + ["file://%s" % repodir], packageset=[],
+                          location=self.i1.get_location(), installed=True)
+            assert image.bind_options() == ["--bind-ro=%s" % repodir]
+            self.c1 = Container(image=image, name=self.cname)
+            self.c1.boot_machine()
+            # repository is visible on same path in machine and read-only, it is not copied to image
+            assert self.c1.execute(command="cat %s/marker" % repodir).stdout == "local repo"
+            assert self.c1.execute(command="touch %s/new" % repodir, ignore_status=True).exit_status != 0
+            assert not os.path.exists(os.path.join(image.get_location(), repodir[1:], "marker"))
+        finally:
+            shutil.rmtree(repodir, ignore_errors=True)
+
+    def test_exec_channel(self):
+        self.c1 = Container(image=self.i1, name=self.cname, exec_channel=True)
+        self.c1.boot_machine()
+        assert "sbin" in self.c1.execute(command="ls /").stdout
+        out = self.c1.execute(command="echo -n out; echo err >&2; exit 3", ignore_status=True)
+        assert out.stdout == "out"
+        assert out.stderr == "err\n"
+        assert out.exit_status == 3
+        assert "'\"" in self.c1.execute(command="""echo "'\\"" """).stdout
+        # output of commands does not mix
+        for num in range(100):
+            out = self.c1.execute(command="echo %d; echo %d >&2" % (num, num))
+            assert out.stdout == out.stderr == "%d\n" % num
+        assert self.c1.run_systemdrun(command="echo -n out").stdout == "out"
+
+    def test_exec_channel_timeout(self):
+        self.c1 = Container(image=self.i1, name=self.cname, exec_channel=True)
+        self.c1.boot_machine()
+        self.c1.execute(command="true")
+        channel = self.c1._Container__channel
+        self.assertRaises(mtfexceptions.NspawnExc, self.c1.execute, command="sleep 100", timeout=1)
+        # hung command is killed with channel
+        pgids = []
+        for pid in [int(x) for x in os.listdir("/proc") if x.isdigit()]:
+            try:
+                pgids.append(os.getpgid(pid))
+            except OSError:
+                pass
+        assert channel.process.pid not in pgids
+        assert channel.process.stdout.closed
+        # channel is created again for next command
+        assert "sbin" in self.c1.execute(command="ls /").stdout
+
+    def test_systemdrun_without_wait(self):
+        self.c1 = Container(image=self.i1, name=self.cname)
+        self.c1.boot_machine()
+        # force workaround used for systemd-run without --wait option
+        self.c1._Container__systemd_wait_support = False
+        out = self.c1.run_systemdrun(command="echo -n out; exit 3", ignore_status=True)
+        assert out.stdout == "out"
+        assert out.exit_status == 3
+        assert not glob.glob(os.path.join(self.c1.location, "var", "tmp", "*.rc"))
+
+    def test_copy_tree(self):
+        self.c1 = Container(image=self.i1, name=self.cname)
+        self.c1.boot_machine()
+        srcdir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(srcdir, "tree", "sub"))
+        for num in range(100):
+            with open(os.path.join(srcdir, "tree", "sub", "file%d" % num), "w") as fixture:
+                fixture.write("fixture")
+        os.chmod(os.path.join(srcdir, "tree", "sub", "file0"), 0o751)
+        open(os.path.join(srcdir, "single"), "w").close()
+        t_before = time.time()
+        # /tmp is tmpfs inside machine, so it is not visible in image directory
+        self.c1.copy_to([os.path.join(srcdir, "tree"), os.path.join(srcdir, "single")], "/tmp")
+        self.log.info("copy of 100 files: %.3fs" % (time.time() - t_before))
+        assert "-rwxr-x--x" in self.c1.execute(command="ls -l /tmp/tree/sub/file0").stdout
+        assert "single" in self.c1.execute(command="ls /tmp").stdout
+        self.c1.copy_from("/tmp/tree", os.path.join(srcdir, "back"))
+        assert len(os.listdir(os.path.join(srcdir, "back", "sub"))) == 100
+        shutil.rmtree(srcdir)
+
+    def test_session(self):
+        session = MachineSession(image=self.i1, basedir=tempfile.mkdtemp())
+        started = []
+
+        def start(container):
+            container.execute(command="mkdir -p /var/lib/service; echo started >> /var/lib/service/log")
+            started.append(container.name)
+
+        self.c1 = session.acquire(setup=lambda c: c.execute(command="touch /setup_done /var/tmp/removed; "
+                                                                    "mkdir /opt/data; touch /opt/data/file"),
+                                  start=start)
+        self.c1.execute(command="touch /var/tmp/dirty /tmp/dirty /run/dirty; rm /var/tmp/removed; "
+                                "echo test >> /var/lib/service/log; rm -rf /etc/skel /opt/data; "
+                                "echo x >> /etc/passwd")
+        session.release(self.c1)
+        self.c1 = session.acquire(setup=lambda c: self.fail("setup has to be called just once"), start=start)
+        # service is started in every test, files created or removed by previous test are rolled back
+        assert len(started) == 3
+        assert "setup_done" in self.c1.execute(command="ls /").stdout
+        for path in ["/var/tmp/dirty", "/tmp/dirty", "/run/dirty"]:
+            assert self.c1.execute(command="test -e %s" % path, ignore_status=True).exit_status != 0
+        assert "removed" in self.c1.execute(command="ls /var/tmp").stdout
+        assert self.c1.execute(command="cat /var/lib/service/log").stdout.split() == ["started", "started"]
+        assert self.c1.execute(command="ls /etc/skel/.bashrc /opt/data/file", ignore_status=True).exit_status == 0
+        assert self.c1.execute(command="cat /etc/passwd").stdout == \
+            open(os.path.join(self.i1.get_location(), "etc", "passwd")).read()
+        session.release(self.c1)
+        # session released without machine (test failed) is booted from checkpoint
+        self.c1 = session.acquire(start=start)
+        session.release()
+        self.c1 = session.acquire(start=start)
+        assert "setup_done" in self.c1.execute(command="ls /").stdout
+        session.release(self.c1)
+        session.destroy()
+
+    def test_stream(self):
+        self.c1 = Container(image=self.i1, name=self.cname)
+        self.c1.boot_machine()
+        stream = common.CmdStream(self.c1.stream_cmd("seq 100000; echo err >&2"), spool_limit=1024)
+        lines = [line for name, line in stream if name == "stdout"]
+        assert lines[0] == "1"
+        assert lines[-1] == "100000"
+        assert stream.exit_status == 0
+        assert stream.stderr == "err\n"
+        assert stream.stdout.endswith("99999\n100000\n")
+
+    def test_machine_pool(self):
+        pooldir = tempfile.mkdtemp()
+        pool = MachinePool(image=self.i1, size=1, basedir=pooldir)
+        self.c1 = pool.claim()
+        assert "sbin" in self.c1.execute(command="ls /").stdout
+        pool.wait_fill()
+        t_before = time.time()
+        c2 = pool.claim()
+        self.log.info("claim from filled pool: %.2fs" % (time.time() - t_before))
+        assert "sbin" in c2.execute(command="ls /").stdout
+        c2.stop()
+        c2.rm()
+        pool.wait_fill()
+        drain_pools(pooldir)
+        assert not glob.glob(os.path.join(pool.pooldir, "free", "*"))
+        self.c1.stop()
+        self.c1.rm()
+
     def BAD_test_basic_machinectl_shell(self):
         # this test is able to break machine (lock machinectl)
         self.c1 = Container(image=self.i1, name=self.cname)
@@ -537,6 +2404,30 @@ class testContainer(Test):
         self.c1.copy_from(ff1, ff2)
         assert "inside" in process.run("cat %s" % ff2).stdout
 
+    def test_boot_ready_benchmark(self):
+        """
+        Machine booted via --notify-ready has reached boot target, latency of both boot methods is just logged
+        """
+        class ContainerPoll(Container):
+            def _notify_ready_decide(self):
+                return False
+        self.c1 = ContainerPoll(image=self.i1, name=self.cname)
+        t_before = time.time()
+        self.c1.boot_machine()
+        time_poll = time.time() - t_before
+        assert "sbin" in self.c1.execute(command="ls /").stdout
+        self.c1.stop()
+        self.c1 = Container(image=self.i1, name=self.cname)
+        if not self.c1._notify_ready_decide():
+            self.cancel("systemd-nspawn does not support --notify-ready")
+        t_before = time.time()
+        nspawncont = self.c1.boot_machine()
+        time_notify = time.time() - t_before
+        assert "--notify-ready=yes" in nspawncont.cmd
+        # READY=1 is sent when boot target is reached, so that it is active without any further waiting
+        assert self.c1.execute(command="systemctl is-active %s" % DEFAULT_BOOT_TARGET).stdout.strip() == "active"
+        self.log.info("boot to ready latency: machinectl poll %.2fs, notify %.2fs" % (time_poll, time_notify))
+
     def test_boot_command(self):
         self.c1 = Container(image=self.i1, name=self.cname)
         self.c1.boot_machine(boot_cmd="sleep 100")
@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+#
+# Meta test family (MTF) is a tool to test components of a modular Fedora:
+# https://docs.pagure.org/modularity/
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# he Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Authors: Jan Scotka <jscotka@redhat.com>
+#
+
+"""
+Low level library following pods in OpenShift. Pods are followed via watch stream of API (or ``oc get --watch``
+when API token is not available), so that readiness of application is known as soon as it changes and failure
+of pod (image can not be pulled, container crashes) is reported immediately instead of after timeout.
+"""
+
+import os
+import ssl
+import json
+import time
+import base64
+import socket
+import httplib
+import urllib
+import urlparse
+import logging
+import tempfile
+import threading
+import BaseHTTPServer
+import SocketServer
+import Queue
+import shutil
+
+from avocado import Test
+from avocado.utils import process
+from mtf import mtfexceptions
+from mtf.backend.docker_api import APIEventStream, CommandEventStream
+
+# reasons of waiting container what are not resolved by waiting
+POD_FAILURE_REASONS = ["ImagePullBackOff", "ErrImageNeverPull", "InvalidImageName", "CrashLoopBackOff",
+                       "CreateContainerConfigError", "RunContainerError"]
+# phases of pod what never get ready
+POD_FAILURE_PHASES = ["Failed", "Succeeded"]
+DEFAULT_API_TIMEOUT = 30
+DEFAULT_WATCH_TIMEOUT = 50
+
+
+def pod_state(pod):
+    """
+    Return readiness of pod
+
+    :param pod: dict - pod object of API
+    :return: tuple (bool - Ready condition is true, str - reason of failure or None)
+    """
+    status = pod.get("status") or {}
+    if status.get("phase") in POD_FAILURE_PHASES:
+        return False, "pod is %s" % status.get("phase")
+    for container in (status.get("initContainerStatuses") or []) + (status.get("containerStatuses") or []):
+        waiting = (container.get("state") or {}).get("waiting") or {}
+        if waiting.get("reason") in POD_FAILURE_REASONS:
+            return False, "container %s: %s %s" % (container.get("name"), waiting["reason"],
+                                                   waiting.get("message", ""))
+    for condition in status.get("conditions") or []:
+        if condition.get("type") == "Ready":
+            return condition.get("status") == "True", None
+    return False, None
+
+
+def wait_for_pod(events, timeout=DEFAULT_WATCH_TIMEOUT):
+    """
+    Return first ready pod from stream of watch events, stream is closed then
+
+    :param events: stream of tuples (event type, pod) with close method, e.g. OpenShiftAPI.watch_pods
+    :param timeout: int - seconds to wait for ready pod
+    :return: dict - pod object or None when no pod is ready before timeout
+    """
+    logger = logging.getLogger("OpenShiftAPI")
+    # stream is closed by timer, so that reader blocked by waiting for next event is woken up
+    timer = threading.Timer(timeout, events.close)
+    timer.daemon = True
+    timer.start()
+    try:
+        for event_type, pod in events:
+            name = pod.get("metadata", {}).get("name")
+            if event_type == "DELETED":
+                continue
+            ready, failure = pod_state(pod)
+            logger.debug("Pod %s (%s): ready %s, phase %s" % (
+                name, event_type, ready, pod.get("status", {}).get("phase")))
+            if failure:
+                raise mtfexceptions.ContainerExc("Pod %s failed: %s" % (name, failure))
+            if ready:
+                return pod
+    except (socket.error, httplib.HTTPException, ValueError, IOError, AttributeError) as e:
+        # AttributeError is raised by socket file closed by timer
+        logger.debug("Watch of pods finished: %s" % e)
+    finally:
+        timer.cancel()
+        events.close()
+    return None
+
+
+class PodEventStream(APIEventStream):
+    """
+    Events read from streamed response of watch request, every event is JSON on own line
+    """
+
+    def __iter__(self):
+        for line in self.lines():
+            if line.strip():
+                event = json.loads(line)
+                if event.get("type") == "ERROR":
+                    raise mtfexceptions.ContainerExc("Watch of pods failed: %s" % event["object"].get("message"))
+                yield event.get("type"), event.get("object") or {}
+
+
+class CommandPodStream(CommandEventStream):
+    """
+    Pods printed by ``oc get pods --watch -o json``, it prints pod objects (not one per line) when they change
+    """
+
+    def __iter__(self):
+        decoder = json.JSONDecoder()
+        buffered = ""
+        for data in iter(lambda: os.read(self.process.stdout.fileno(), 4096), ""):
+            buffered = (buffered + data).lstrip()
+            while buffered:
+                try:
+                    pod, end = decoder.raw_decode(buffered)
+                except ValueError:
+                    # object is not complete yet
+                    break
+                buffered = buffered[end:].lstrip()
+                yield "MODIFIED", pod
+
+
+def oc_watch_pods(label_selector):
+    """
+    Return stream of pods in actual project, counterpart of OpenShiftAPI.watch_pods via oc command
+
+    :param label_selector: str - e.g. app=memcached
+    :return: CommandPodStream
+    """
+    return CommandPodStream(["oc", "get", "pods", "-l", label_selector, "-o", "json", "--watch"])
+
+
+def get_openshift_api():
+    """
+    Return client of API of cluster what is used by oc command (server, token and project of actual context)
+
+    :return: OpenShiftAPI or None when oc is not logged in by token
+    """
+    result = process.run("oc config view --minify --raw -o json", ignore_status=True, verbose=False)
+    if result.exit_status != 0:
+        return None
+    try:
+        config = json.loads(result.stdout)
+        cluster = config["clusters"][0]["cluster"]
+        user = config["users"][0]["user"]
+        context = config["contexts"][0]["context"]
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+    if not user.get("token"):
+        return None
+    cadata = cluster.get("certificate-authority-data")
+    return OpenShiftAPI(cluster["server"], token=user["token"], namespace=context.get("namespace") or "default",
+                        cadata=base64.b64decode(cadata) if cadata else None, cafile=cluster.get("certificate-authority"),
+                        verify=not cluster.get("insecure-skip-tls-verify"))
+
+
+class OpenShiftAPI(object):
+    """
+    Client of OpenShift (Kubernetes) API, it implements just calls used by MTF
+    """
+    logger = logging.getLogger("OpenShiftAPI")
+
+    def __init__(self, server, token=None, namespace="default", cadata=None, cafile=None, verify=True,
+                 timeout=DEFAULT_API_TIMEOUT):
+        """
+
+        :param server: str - URL of API server, e.g. https://127.0.0.1:8443
+        :param token: str - bearer token of user
+        :param namespace: str - project
+        :param cadata: str - PEM certificate of cluster CA
+        :param cafile: str - path to certificate of cluster CA
+        :param verify: bool - verify certificate of server
+        :param timeout: int - timeout of connection in seconds
+        """
+        self.server = urlparse.urlparse(server)
+        self.token = token
+        self.namespace = namespace
+        self.timeout = timeout
+        self.context = None
+        if self.server.scheme == "https":
+            self.context = ssl.create_default_context(cafile=cafile, cadata=cadata)
+            if not verify:
+                self.context.check_hostname = False
+                self.context.verify_mode = ssl.CERT_NONE
+
+    def __connection(self, timeout):
+        if self.context:
+            return httplib.HTTPSConnection(self.server.netloc, timeout=timeout, context=self.context)
+        return httplib.HTTPConnection(self.server.netloc, timeout=timeout)
+
+    def __request(self, path, query, timeout):
+        """
+        Internal method
+        send GET request and return connection and response what is not read yet
+
+        :return: tuple (httplib.HTTPConnection, httplib.HTTPResponse)
+        """
+        headers = {"Accept": "application/json"}
+        if self.token:
+            headers["Authorization"] = "Bearer %s" % self.token
+        connection = self.__connection(timeout)
+        connection.request("GET", "%s%s?%s" % (self.server.path.rstrip("/"), path, urllib.urlencode(query)),
+                           headers=headers)
+        response = connection.getresponse()
+        if response.status != 200:
+            data = response.read()
+            connection.close()
+            try:
+                message = json.loads(data).get("message", data)
+            except ValueError:
+                message = data
+            raise mtfexceptions.ContainerExc("OpenShift API GET %s failed (%s): %s" % (path, response.status, message))
+        return connection, response
+
+    def get_pods(self, label_selector):
+        """
+        Return pods, counterpart of oc get pods -l label_selector -o json
+
+        :param label_selector: str - e.g. app=memcached
+        :return: list of pod objects
+        """
+        connection, response = self.__request("/api/v1/namespaces/%s/pods" % self.namespace,
+                                              {"labelSelector": label_selector}, self.timeout)
+        try:
+            return json.loads(response.read()).get("items") or []
+        finally:
+            connection.close()
+
+    def watch_pods(self, label_selector, timeout=DEFAULT_WATCH_TIMEOUT):
+        """
+        Return stream of changes of pods, existing pods are sent as ADDED events first
+
+        :param label_selector: str - e.g. app=memcached
+        :param timeout: int - server closes stream after this time (seconds)
+        :return: PodEventStream
+        """
+        connection, response = self.__request("/api/v1/namespaces/%s/pods" % self.namespace,
+                                              {"labelSelector": label_selector, "watch": "true",
+                                               "timeoutSeconds": timeout}, timeout + self.timeout)
+        return PodEventStream(connection, response)
+
+
+class FakeOpenShiftHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Stand-in of OpenShift API server, it implements just calls used by testOpenShiftAPI
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path, query = urllib.splitquery(self.path)
+        self.server.requests.append((path, dict(urlparse.parse_qsl(query or "")),
+                                     self.headers.get("Authorization")))
+        if path != "/api/v1/namespaces/test/pods":
+            body = json.dumps({"kind": "Status", "message": "not found"})
+            self.send_response(404)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        # chunked stream, pods are sent by test via server.events queue
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        self.wfile.flush()
+        while True:
+            event = self.server.events.get()
+            if event is None:
+                self.wfile.write("0\r\n\r\n")
+                break
+            chunk = json.dumps({"type": event[0], "object": event[1]}) + "\n"
+            self.wfile.write("%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.flush()
+        self.close_connection = 1
+
+
+class FakeOpenShiftServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), FakeOpenShiftHandler)
+        self.requests = []
+        self.events = Queue.Queue()
+
+
+def fake_pod(name, phase="Pending", ready=False, waiting=None):
+    """
+    Return pod object as it is sent by API
+
+    :param name: str
+    :param phase: str
+    :param ready: bool - state of Ready condition
+    :param waiting: str - reason of waiting container
+    :return: dict
+    """
+    state = {"waiting": {"reason": waiting, "message": "image can not be pulled"}} if waiting else {"running": {}}
+    return {"metadata": {"name": name, "labels": {"app": "memcached"}},
+            "status": {"phase": phase,
+                       "conditions": [{"type": "Ready", "status": "True" if ready else "False"}],
+                       "containerStatuses": [{"name": "memcached", "state": state}]}}
+
+
+class testOpenShiftAPI(Test):
+    """
+    Test watching of pods against stand-in API server on local port
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.server = FakeOpenShiftServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.api = OpenShiftAPI("http://127.0.0.1:%d" % self.server.server_address[1], token="secret",
+                                namespace="test")
+
+    def test_ready(self):
+        for event in [("ADDED", fake_pod("memcached-1-abc")),
+                      ("MODIFIED", fake_pod("memcached-1-abc", phase="Running")),
+                      ("MODIFIED", fake_pod("memcached-1-abc", phase="Running", ready=True))]:
+            self.server.events.put(event)
+        start = time.time()
+        pod = wait_for_pod(self.api.watch_pods("app=memcached"), timeout=10)
+        assert time.time() - start < 5
+        assert pod["metadata"]["name"] == "memcached-1-abc"
+        path, query, authorization = self.server.requests[0]
+        assert query["labelSelector"] == "app=memcached"
+        assert query["watch"] == "true"
+        assert authorization == "Bearer secret"
+
+    def test_image_pull_failure(self):
+        self.server.events.put(("ADDED", fake_pod("memcached-1-abc", waiting="ContainerCreating")))
+        self.server.events.put(("MODIFIED", fake_pod("memcached-1-abc", waiting="ImagePullBackOff")))
+        start = time.time()
+        self.assertRaises(mtfexceptions.ContainerExc, wait_for_pod, self.api.watch_pods("app=memcached"), 10)
+        assert time.time() - start < 5
+
+    def test_timeout(self):
+        self.server.events.put(("ADDED", fake_pod("memcached-1-abc", phase="Running")))
+        start = time.time()
+        assert wait_for_pod(self.api.watch_pods("app=memcached"), timeout=1) is None
+        assert time.time() - start < 5
+
+    def test_api_error(self):
+        self.api.namespace = "missing"
+        self.assertRaises(mtfexceptions.ContainerExc, self.api.watch_pods, "app=memcached")
+
+    def test_command_stream(self):
+        output = os.path.join(self.tmpdir, "pods.json")
+        with open(output, "w") as pods:
+            pods.write(json.dumps(fake_pod("memcached-1-abc"), indent=4))
+            pods.write(json.dumps(fake_pod("memcached-1-abc", phase="Running", ready=True), indent=4))
+        pod = wait_for_pod(CommandPodStream(["sh", "-c", "cat %s; exec sleep 10" % output]), timeout=5)
+        assert pod["status"]["phase"] == "Running"
+
+    def tearDown(self):
+        for _ in range(len(self.server.requests)):
+            self.server.events.put(None)
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
@@ -4,7 +4,6 @@ import os
 import sys
 import glob
 from urllib import urlretrieve
-from avocado.utils import process
 from urlparse import urlparse
 from warnings import warn
 
@@ -135,6 +134,7 @@ class MetadataLoader(object):
                 print_debug("Directory %s already exist" % test)
             else:
                 print_debug("Cloning git %s to directory %s" % (gitdict[test], test))
+                from avocado.utils import process
                 process.run("git clone %s %s" % (gitdict[test], test))
 
 
@@ -377,6 +377,7 @@ class MetadataLoaderMTF(MetadataLoader):
     def _import_tests(self, testglob, pathlenght=0):
         pathglob = testglob if testglob.startswith(os.pathsep) else os.path.join(self.location, testglob)
         print_debug("Import by pathglob: %s" % pathglob)
+        from avocado.utils import process
         tests_cmd = process.run("%s %s" % (self.listcmd, pathglob), shell=True, verbose=False, ignore_status=True)
         tests = tests_cmd.stdout.splitlines()
         if tests_cmd.exit_status != 0:
@@ -409,6 +410,7 @@ class MetadataLoaderMTF(MetadataLoader):
     def filter_tags(self, tests, tag_list):
         output = []
         test_sources = [x[SOURCE] for x in tests]
+        from avocado.utils import process
         cmd = process.run("%s %s %s" % (self.listcmd, self.__avcado_tag_args(tag_list), " ".join(test_sources)))
         testlist = []
         for line in cmd.stdout.splitlines():
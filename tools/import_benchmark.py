@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#
+# Meta test family (MTF) is a tool to test components of a modular Fedora:
+# https://docs.pagure.org/modularity/
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# he Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Authors: Jan Scotka <jscotka@redhat.com>
+#
+
+"""
+Measure import time of modules used by MTF command line tools.
+Every module is imported in fresh interpreter more times and the best time is compared with budget,
+so that heavy dependencies imported by accident on startup are found.
+Entry point of mtf-env-set/mtf-env-clean reads config on import, so that it has to be measured
+in directory with config.yaml (or with CONFIG and URL envvars).
+"""
+
+import os
+import sys
+import json
+import subprocess
+
+from optparse import OptionParser
+
+# module imported by command line tool: budget in seconds
+BUDGETS = {
+    "moduleframework.common": 0.3,
+    "moduleframework.bashhelper": 0.6,
+    "moduleframework.mtf_scheduler": 0.6,
+    # mtf-env-set and mtf-env-clean, it imports environment of used module type only
+    "moduleframework.mtf_environment": 0.6,
+}
+# modules what have to be imported lazily, when they are really used
+HEAVY_MODULES = ["requests", "pdc_client", "odcs", "netifaces"]
+
+MEASURE = """
+import sys, time, json
+start = time.time()
+__import__(sys.argv[1])
+print(json.dumps({"time": time.time() - start,
+                  "heavy": [x for x in sys.argv[2:] if x in sys.modules]}))
+"""
+
+
+def measure(module, repeat):
+    """
+    Import module in fresh interpreters
+
+    :param module: str
+    :param repeat: int - how many times module is imported
+    :return: tuple (best time in seconds, list of heavy modules imported by module),
+             time is None in case import failed
+    """
+    results = []
+    for _ in range(repeat):
+        try:
+            output = subprocess.check_output([sys.executable, "-c", MEASURE, module] + HEAVY_MODULES)
+        except subprocess.CalledProcessError:
+            return None, []
+        results.append(json.loads(output.strip().split("\n")[-1]))
+    return min(x["time"] for x in results), results[0]["heavy"]
+
+
+def main():
+    parser = OptionParser(usage="%prog [options] [module ...]")
+    parser.add_option("-r", "--repeat", type="int", default=5,
+                      help="import every module REPEAT times, best time is used")
+    parser.add_option("-s", "--scale", type="float", default=1.0,
+                      help="multiply budgets by SCALE (slow machines)")
+    options, args = parser.parse_args()
+    failed = False
+    for module in args or sorted(BUDGETS):
+        budget = BUDGETS.get(module, max(BUDGETS.values())) * options.scale
+        best, heavy = measure(module, options.repeat)
+        if best is None:
+            failed = True
+            print("%-5s %-35s import failed (see traceback above)" % ("ERROR", module))
+            continue
+        state = "OK" if best <= budget else "SLOW"
+        if heavy:
+            state = "HEAVY"
+        failed = failed or state != "OK"
+        print("%-5s %-35s %.3fs (budget %.3fs)%s" % (state, module, best, budget,
+                                                     " imports: %s" % ", ".join(heavy) if heavy else ""))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()